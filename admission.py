@@ -0,0 +1,137 @@
+# admission.py — 受付制御と、混んでいる時の段階的な手抜き
+# -------------------------------------------------------------
+# API の枠を超えて注文が来ると、リクエストが溜まり続けて gunicorn の
+# タイムアウトで殺される。そこで
+# ・同時に作る冊数を slots 冊までにし、あふれた分は待ち行列（queue_max まで）に並べる
+# ・「いま並んだら何秒待ちそうか」（並んでいる数 × 1 冊の平均時間 ÷ slots と、
+#   最近の実測待ち時間の大きい方）で、作り方を段階的に軽くする
+#   空きの枠があればすぐ作れるので 0 秒。最近の待ち時間は、1 冊の平均時間の 2 倍を
+#   半減期にして時間とともに減らす（混雑が去った後まで手抜きを続けない）
+#     level 0 … ふつう
+#     level 1 … 挿絵を fast プロファイル（dall-e-2 512px）で
+#     level 2 … ＋ 読み上げを省く
+#     level 3 … ＋ 3 ページを 2 ページにまとめる・作り置きプールを優先
+#     それ以上 … 503 + Retry-After で断る
+#   BOOK_ADMIT_SLOTS=8  BOOK_ADMIT_QUEUE=32  BOOK_ADMIT_WAIT=30
+#   BOOK_DEGRADE_AT="5,15,30,60"   # level 1・2・3・お断り になる予想待ち秒数
+# ※ 数えるのはプロセスごと（gunicorn のワーカーごとに slots 冊）。
+import threading, time
+import metrics
+
+LEVELS = (
+    (),
+    ("fast_images",),
+    ("fast_images", "no_tts"),
+    ("fast_images", "no_tts", "fewer_pages", "prefer_pool"),
+)
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(f"overloaded: {reason}")
+        self.retry_after = max(1, round(retry_after))
+        self.reason = reason
+
+
+class Ticket:
+    """受付済みの 1 冊。終わったら release()（with でも可）"""
+
+    def __init__(self, admission, level: int, waited: float):
+        self.level = level
+        self.degrade = LEVELS[level]
+        self.waited = waited
+        self._admission = admission
+        self._started = time.monotonic()
+        self._released = False
+
+    def info(self) -> dict:
+        return {"level": self.level, "applied": list(self.degrade), "queue_wait": round(self.waited, 3)}
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._admission._leave(time.monotonic() - self._started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Admission:
+    def __init__(self, slots: int = 8, queue_max: int = 32, max_wait: float = 30,
+                 thresholds=(5, 15, 30, 60), service_time: float = 30):
+        self.slots = slots
+        self.queue_max = queue_max
+        self.max_wait = max_wait
+        self.thresholds = tuple(thresholds)
+        self.running = 0
+        self.waiting = 0
+        self.service = service_time        # 1 冊の平均時間（指数移動平均）
+        self.recent_wait = 0.0             # 最近の待ち時間（指数移動平均。recent() は時間で減らした値）
+        self._recent_at = time.monotonic()
+        self._cond = threading.Condition()
+
+    def recent(self) -> float:
+        half_life = 2 * self.service
+        return self.recent_wait * 0.5 ** ((time.monotonic() - self._recent_at) / half_life)
+
+    def expected_wait(self) -> float:
+        backlog = max(0, self.running + self.waiting + 1 - self.slots)
+        if not backlog:
+            return 0.0                     # 空きの枠がある → すぐ作れる
+        return max(self.recent(), backlog * self.service / self.slots)
+
+    def admit(self) -> Ticket:
+        """受け付けて Ticket を返す。無理なら Overloaded"""
+        with self._cond:
+            expected = self.expected_wait()
+            level = sum(expected >= t for t in self.thresholds)
+            if level >= len(LEVELS):
+                self._reject("overloaded")
+                raise Overloaded(expected, "expected wait too long")
+            if self.running >= self.slots and self.waiting >= self.queue_max:
+                self._reject("queue_full")
+                raise Overloaded(expected, "queue full")
+            self.waiting += 1
+            self._gauges()
+            t0 = time.monotonic()
+            while self.running >= self.slots:
+                remaining = t0 + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    self.waiting -= 1
+                    self._gauges()
+                    self._reject("timeout")
+                    raise Overloaded(self.expected_wait(), "timed out in queue")
+                self._cond.wait(remaining)
+            waited = time.monotonic() - t0
+            self.waiting -= 1
+            self.running += 1
+            self.recent_wait = 0.8 * self.recent() + 0.2 * waited
+            self._recent_at = time.monotonic()
+            self._gauges()
+        metrics.observe("admission_wait", waited)
+        metrics.inc("book_admissions_total", help="Admission decisions by degradation level.",
+                    result="admitted", level=str(level))
+        return Ticket(self, level, waited)
+
+    def _leave(self, seconds: float):
+        with self._cond:
+            self.running -= 1
+            self.service = 0.8 * self.service + 0.2 * seconds
+            self._cond.notify()
+            self._gauges()
+
+    def _reject(self, reason: str):
+        metrics.inc("book_admissions_total", help="Admission decisions by degradation level.",
+                    result=reason, level="reject")
+
+    def _gauges(self):
+        metrics.set_gauge("book_admission_running", self.running, help="Books being generated now.")
+        metrics.set_gauge("book_admission_waiting", self.waiting, help="Books waiting for a slot.")
+        expected = self.expected_wait()
+        metrics.set_gauge("book_admission_expected_wait_seconds", round(expected, 3),
+                          help="Expected queue wait for the next request.")
+        metrics.set_gauge("book_degradation_level", min(len(LEVELS), sum(expected >= t for t in self.thresholds)),
+                          help="Degradation level the next request would get (4 = reject).")
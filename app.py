@@ -1,15 +1,26 @@
 # app.py — あなただけのえほんジェネレーター（音声読み上げ対応 Flask アプリ）
 # -------------------------------------------------------------
-from flask import Flask, render_template_string, request, jsonify, send_from_directory
-import os, json, textwrap, datetime, traceback, sys, requests
+from flask import Flask, Response, render_template_string, request, jsonify, send_file, abort
+import os, json, textwrap, traceback, sys, threading, time, uuid, queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from openai import OpenAI
-from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen.canvas import Canvas
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from backend import make_client
+from story_stream import consume_stream
+from story_cache import StoryCache
+from story_repair import complete_story
+from image_store import ImageStore
+from artifact_store import ArtifactStore
+from singleflight import SingleFlight
+from book_pool import BookPool
+from render_profiles import DEFAULT_PROFILE, get_profile, image_kwargs
+import metrics
+from metrics import stage, traced, submit
+from checkpoint import RunStore
+from job_queue import JobQueue
+from admission import Admission, Overloaded
+from pdf_images import PDF_JPEG_QUALITY, pdf_pixels, scaled_jpeg
+from pdf_setup import ensure_fonts, preload
+from scheduler import priority
 
 # ====== 共通プロンプト（日本人が好む・文字なし・主人公統一） ======
 PROMPT_BASE = (
@@ -20,23 +31,145 @@ PROMPT_BASE = (
 
 # ====== OpenAI 初期化 ======
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = make_client()   # BOOK_BACKEND=fake でオフライン
 
-# ====== PDF 用フォント設定 ======
-pdfmetrics.registerFont(TTFont("JPFont", "fonts/NotoSansJP-Bold.ttf"))
+# ====== PDF 設定（フォントは最初の PDF 書き出し時に登録） ======
 IMG_SIZE, MARGIN = 512, 40
 
+# ====== 並列実行の上限（1 リクエストあたり） ======
+MAX_PARALLEL = int(os.getenv("BOOK_MAX_PARALLEL", "4"))
+
+# ====== バックグラウンドジョブ設定 ======
+JOB_WORKERS = int(os.getenv("BOOK_JOB_WORKERS", "8"))
+JOB_TTL = int(os.getenv("BOOK_JOB_TTL", "3600"))   # 完了ジョブを残す秒数
+
+# ====== 生成をワーカープロセスに任せる（BOOK_QUEUE=1。worker.py を別に動かす） ======
+# Web は job_queue に積んで、途中経過と結果を読むだけになる
+BOOK_QUEUE = os.getenv("BOOK_QUEUE", "0") == "1"
+QUEUE_WAIT = float(os.getenv("BOOK_QUEUE_WAIT", "300"))    # Web が 1 冊を待つ上限（秒）
+QUEUE_POLL = float(os.getenv("BOOK_QUEUE_POLL", "0.5"))
+job_queue = JobQueue(
+    os.getenv("BOOK_QUEUE_PATH", "cache/jobs.sqlite3"),
+    visibility=float(os.getenv("BOOK_QUEUE_VISIBILITY", "120")),     # heartbeat が止まってから拾い直すまで
+    max_attempts=int(os.getenv("BOOK_QUEUE_ATTEMPTS", "3")),         # これだけ失敗したら dead
+    retry_delay=float(os.getenv("BOOK_QUEUE_RETRY_DELAY", "5")),
+)
+
+# ====== ストーリーをストリーミングで受け取り、できたシーンから挿絵に回す ======
+STORY_STREAM = os.getenv("BOOK_STORY_STREAM", "1") == "1"
+
+# ====== ストーリーキャッシュ（全ワーカー共有の SQLite） ======
+story_cache = StoryCache(
+    os.getenv("STORY_CACHE_PATH", "cache/stories.sqlite3"),
+    variants=int(os.getenv("STORY_CACHE_VARIANTS", "3")),
+    ttl=int(os.getenv("STORY_CACHE_TTL", str(7 * 86400))),
+    max_entries=int(os.getenv("STORY_CACHE_MAX", "5000")),
+)
+
+# ====== 挿絵キャッシュ（ディスク・LRU） ======
+image_store = ImageStore(
+    os.getenv("IMAGE_CACHE_DIR", "cache/images"),
+    max_bytes=int(os.getenv("IMAGE_CACHE_BYTES", str(2 * 1024 ** 3))),
+)
+
+# ====== 音声・PDF の置き場（ハッシュ名・TTL と容量上限で掃除） ======
+artifacts = ArtifactStore(
+    os.getenv("ARTIFACT_DIR", "cache/artifacts"),
+    ttl=int(os.getenv("ARTIFACT_TTL", str(7 * 86400))),
+    max_bytes=int(os.getenv("ARTIFACT_BYTES", str(5 * 1024 ** 3))),
+)
+
+# ====== 1 冊ごとの途中経過（失敗したら続きから） ======
+runs = RunStore(os.getenv("BOOK_RUNS_PATH", "cache/runs.sqlite3"),
+                ttl=int(os.getenv("BOOK_RUNS_TTL", str(7 * 86400))))
+
+# ====== 受付制御（混んできたら作り方を軽くし、それでも無理なら 503） ======
+admission = Admission(
+    slots=int(os.getenv("BOOK_ADMIT_SLOTS", "8")),
+    queue_max=int(os.getenv("BOOK_ADMIT_QUEUE", "32")),
+    max_wait=float(os.getenv("BOOK_ADMIT_WAIT", "30")),
+    thresholds=[float(v) for v in os.getenv("BOOK_DEGRADE_AT", "5,15,30,60").split(",")],
+)
+
+# ====== 同じ条件の同時リクエストを 1 本にまとめる ======
+flight = SingleFlight(os.getenv("SINGLEFLIGHT_DIR", "cache/locks"))
+
+# ====== 作り置き絵本プール（BOOK_POOL=1 で有効） ======
+BOOK_POOL = os.getenv("BOOK_POOL", "0") == "1"
+book_pool = BookPool(
+    os.getenv("BOOK_POOL_PATH", "cache/pool.sqlite3"),
+    base_depth=int(os.getenv("BOOK_POOL_BASE_DEPTH", "1")),
+    max_depth=int(os.getenv("BOOK_POOL_MAX_DEPTH", "5")),
+)
+
+# フォームの選択肢（HTML の <option> と同じ並び）
+FORM_CHOICES = {
+    "age":    ["0", "2", "4", "6", "8", "10"],
+    "gender": ["おとこのこ", "おんなのこ"],
+    "hero":   ["ろぼっと", "くるま", "まほうつかい", "じぶん"],
+    "theme":  ["ゆうじょう", "ぼうけん", "ちょうせん", "かぞく", "まなび"],
+}
+
 app = Flask(__name__, static_folder="static")
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "0") == "1"
 
 # ====== 画像生成ラッパー ======
-def dall_e(prompt: str) -> str:
-    rsp = client.images.generate(
-        model="dall-e-3",
-        prompt=PROMPT_BASE + prompt,
-        n=1,
-        size="1024x1024",
-    )
-    return rsp.data[0].url
+def image_request(prompt: str, profile: str | None = None) -> tuple[dict, str]:
+    """images.generate に渡す引数と、挿絵キャッシュのキー"""
+    kwargs = image_kwargs(get_profile(profile))
+    key = ImageStore.make_key(PROMPT_BASE + prompt, kwargs["model"],
+                              kwargs["size"] + (":" + kwargs["quality"] if "quality" in kwargs else ""))
+    return kwargs, key
+
+def illustrate(prompt: str, profile: str | None = None) -> str:
+    """挿絵を（なければ生成して）キャッシュに置き、キーを返す"""
+    kwargs, key = image_request(prompt, profile)
+
+    def generate():
+        with stage("image"):
+            rsp = client.images.generate(
+                prompt=PROMPT_BASE + prompt,
+                n=1,
+                **kwargs,
+            )
+        with stage("image_download"):
+            return image_store.put_url(key, rsp.data[0].url)
+
+    if image_store.get(key) is None:
+        flight.do("image:" + key, generate, lookup=lambda: image_store.get(key))
+    return key
+
+def dall_e(prompt: str, profile: str | None = None) -> str:
+    return f"/images/{illustrate(prompt, profile)}.jpg"
+
+# ====== 音声合成ラッパー ======
+TTS_MODEL, TTS_VOICE = "tts-1", "shimmer"
+CLIP_WAIT = float(os.getenv("BOOK_CLIP_WAIT", "90"))   # 連続再生で次のシーンの音声を待つ秒数
+
+def clip_name(text: str) -> str:
+    # 同じ文章・声・モデルなら同じファイル名（= 使い回し・相乗りできる）
+    return ArtifactStore.make_name(TTS_MODEL, TTS_VOICE, text, ext="mp3")
+
+def narration_url(scenes: list) -> str:
+    """シーンごとの音声を順につないで流す URL（まだできていないシーンは待つ）"""
+    return "/audio/book/" + "-".join(clip_name(sc).removesuffix(".mp3") for sc in scenes) + ".mp3"
+
+def tts(text: str) -> str:
+    filename = clip_name(text)
+
+    def generate():
+        with stage("tts"):
+            speech = client.audio.speech.create(
+                model=TTS_MODEL,
+                voice=TTS_VOICE,
+                input=text
+            )
+            artifacts.put(filename, speech.stream_to_file)
+        return filename
+
+    if artifacts.get(filename):
+        return filename
+    return flight.do("tts:" + filename, generate, lookup=lambda: filename if artifacts.get(filename) else None)
 
 # ====== プロンプト生成 ======
 def story_prompt(age: str, gender: str, hero: str, theme: str) -> str:
@@ -47,33 +180,380 @@ def story_prompt(age: str, gender: str, hero: str, theme: str) -> str:
 JSON={{"title":"タイトル","story":["シーン1","シーン2","シーン3"]}}
 """
 
+# ====== ストーリー生成 ======
+def story_request(params) -> tuple[dict, str]:
+    """chat.completions.create に渡す引数と、ストーリーキャッシュのキー"""
+    prompt = story_prompt(params['age'], params['gender'], params['hero'], params['theme'])
+    kwargs = dict(
+        model="gpt-4o-mini",
+        messages=[{"role": "system", "content": prompt}],
+        max_tokens=700,
+        response_format={"type": "json_object"}
+    )
+    key = StoryCache.make_key({k: params[k] for k in ("age", "gender", "hero", "theme")},
+                              prompt, kwargs["model"], kwargs.get("temperature"))
+    return kwargs, key
+
+def write_story(params, on_scene=lambda i, text: None) -> dict:
+    """ストリーミング時はシーンの文字列が閉じた瞬間に on_scene(i, text) を呼ぶ"""
+    kwargs, key = story_request(params)
+    streamed = set()
+
+    def generate():
+        with stage("chat"):
+            if STORY_STREAM:
+                def emit(i, sc):
+                    streamed.add(i)
+                    on_scene(i, sc)
+                text = consume_stream(client.chat.completions.create(stream=True, **kwargs), on_scene=emit)
+            else:
+                text = client.chat.completions.create(**kwargs).choices[0].message.content
+        # 切れた JSON やシーン数の過不足はその場で直す（足りない分だけ続きを書いてもらう）
+        story = complete_story(client, text, 3, kwargs)
+        story_cache.put(key, story)
+        return story
+
+    # 同じ条件のリクエストが同時に来たら、1 本のおはなしを分け合う
+    story_json = story_cache.get(key) or flight.do("story:" + key, generate,
+                                                   lookup=lambda: story_cache.recent(key, 120))
+    for i, sc in enumerate(story_json["story"]):
+        if i not in streamed:
+            on_scene(i, sc)
+    return story_json
+
+# ====== 絵本パイプライン（ストーリー → 音声・挿絵） ======
+def make_pages(scenes: list, images: dict, clips: dict) -> list[dict]:
+    """1 ページ = 挿絵 URL・本文・読み上げ URL（まだなければ None）"""
+    return [{"img": images.get(i), "text": sc, "audio": clips.get(i)} for i, sc in enumerate(scenes)]
+
+def build_book(params, report=lambda **kw: None, use_pool=True, run_id=None, degrade=()) -> dict:
+    """report(stage=..., ...) で途中経過を通知しながら絵本を組み立てる。
+    run_id を渡すと、その冊の保存済みの工程（ストーリー・挿絵・音声）は作り直さない。
+    degrade は混雑時の手抜き（admission.LEVELS の中身）"""
+    requested = params.get("profile") or DEFAULT_PROFILE
+    profile = "fast" if "fast_images" in degrade else requested
+    n_pages = 2 if "fewer_pages" in degrade else 3
+    with_voice = "no_tts" not in degrade
+    run = runs.load(run_id) if run_id else None
+    if BOOK_POOL and use_pool and run is None and (requested == DEFAULT_PROFILE or "prefer_pool" in degrade):
+        book = book_pool.take(params, is_valid=pooled_book_is_valid)
+        if book is not None:
+            report(stage="media", title=book["title"], pages=[{"img": None, "text": pg["text"]} for pg in book["pages"]])
+            report(pages=book["pages"], audio_url=book["audio_url"])
+            return book
+
+    if run is None:
+        run_id = run_id or uuid.uuid4().hex
+        run = runs.save(run_id, params={k: params.get(k) for k in ("age", "gender", "hero", "theme", "profile")})
+    hero_tag = f"main character is a {params['hero']}"
+    report(stage="story", run_id=run_id)
+
+    # 工程が終わるたびに保存（他の挿絵が失敗しても、できた分は残る）
+    def draw(i, sc):
+        url = dall_e(hero_tag + ", " + sc[:60], profile)
+        runs.save(run_id, images={i: url})
+        return url
+
+    def narrate(i, sc):
+        url = f"/audio/{tts(sc)}"
+        runs.save(run_id, clips={i: url})
+        return url
+
+    try:
+        # 読み上げはシーンごとに並列。挿絵の順番待ちにならないよう別のプールで回す
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as ex, \
+             ThreadPoolExecutor(max_workers=3, thread_name_prefix="tts") as voice_ex:
+            # シーン 1 の挿絵と音声は、シーン 2 以降の執筆中にもう作り始める
+            # （最後のページは残りのシーンをまとめることがあるので、読み上げは全文がそろってから）
+            futs = {}
+            def on_scene(i, sc):
+                if i >= n_pages:
+                    return
+                if i not in run["images"]:
+                    futs[submit(ex, draw, i, sc)] = ("img", i)
+                if with_voice and i < n_pages - 1 and i not in run["clips"]:
+                    futs[submit(voice_ex, narrate, i, sc)] = ("audio", i)
+
+            if run.get("story"):
+                story_json = run["story"]
+                for i, sc in enumerate(story_json["story"]):
+                    on_scene(i, sc)
+            else:
+                story_json = write_story(params, on_scene)
+                runs.save(run_id, story=story_json)
+            scenes = story_json["story"][:3]
+            if n_pages < len(scenes):
+                scenes = scenes[:n_pages - 1] + ["".join(scenes[n_pages - 1:])]
+            last = len(scenes) - 1
+            clips = {i: url for i, url in run["clips"].items()
+                     if with_voice and i <= last and url == f"/audio/{clip_name(scenes[i])}"}
+            if with_voice and last not in clips:
+                futs[submit(voice_ex, narrate, last, scenes[last])] = ("audio", last)
+            pages = make_pages(scenes, run["images"], clips)
+            report(stage="media", title=story_json.get("title"), pages=pages)
+
+            # 続けて読む音声は、シーン 1 の音声ができた時点で再生を始めてもらう
+            audio_url = narration_url(scenes) if with_voice else None
+            audio_sent = bool(pages[0]["audio"])
+            if audio_sent:
+                report(audio_url=audio_url)
+            for fut in as_completed(futs):
+                kind, i = futs[fut]
+                pages[i][kind] = fut.result()
+                report(pages=pages)
+                if not audio_sent and pages[0]["audio"]:
+                    report(audio_url=audio_url)
+                    audio_sent = True
+    except Exception as e:
+        runs.save(run_id, status="error", error=str(e))
+        e.run_id = run_id                # 呼び出し側が「続きから」を案内できるように
+        raise
+
+    runs.save(run_id, status="done", error=None, audio_url=audio_url)
+    return {"run_id": run_id, "title": story_json.get("title"), "pages": pages, "audio_url": audio_url}
+
+def build_book_queued(params, report=lambda **kw: None, run_id=None, degrade=()) -> dict:
+    """build_book と同じ結果を、待ち行列に積んでワーカーに作らせて待つ。
+    途中経過は progress を見て、build_book と同じ順に report する"""
+    job_id = job_queue.enqueue({k: params.get(k, "") for k in ("age", "gender", "hero", "theme", "profile")},
+                               job_id=run_id, degrade=degrade)
+    deadline = time.monotonic() + QUEUE_WAIT
+    seen = {}
+    while True:
+        job = job_queue.get(job_id) or {"state": "dead", "error": "job disappeared", "progress": {}}
+        progress = job["progress"]
+        if progress.get("title") and "title" not in seen:
+            report(stage="media", title=progress["title"], pages=progress["pages"])
+        if progress.get("pages") and progress["pages"] != seen.get("pages"):
+            report(pages=progress["pages"])
+        if progress.get("audio_url") and "audio_url" not in seen:
+            report(audio_url=progress["audio_url"])
+        seen = progress
+        if job["state"] == "done":
+            return job["result"]
+        if job["state"] == "dead" or time.monotonic() > deadline:
+            # dead でも、run_id で積み直せば途中経過から続きを作る
+            e = RuntimeError(job["error"] if job["state"] == "dead" else f"timed out waiting for job {job_id}")
+            e.run_id = job_id
+            raise e
+        time.sleep(QUEUE_POLL)
+
+def run_book(params, report=lambda **kw: None, run_id=None, degrade=()) -> dict:
+    """リクエストの 1 冊。BOOK_QUEUE=1 ならワーカーに任せ、そうでなければこのプロセスで作る"""
+    if BOOK_QUEUE:
+        return build_book_queued(params, report, run_id=run_id, degrade=degrade)
+    return build_book(params, report, run_id=run_id, degrade=degrade)
+
+def pooled_book_is_valid(book: dict) -> bool:
+    """作り置きの音声・挿絵ファイルがまだ残っているか"""
+    return all(pg.get("audio") and artifacts.get(pg["audio"].rsplit("/", 1)[-1])
+               and image_store.get(pg["img"].rsplit("/", 1)[-1].removesuffix(".jpg")) for pg in book["pages"])
+
+def prefill_book(params) -> dict:
+    """作り置き用の 1 冊。API の順番待ちは warmup クラス（Web の注文より後回し）"""
+    with priority("warmup"):
+        return build_book(params, use_pool=False)
+
+def start_pool_refiller():
+    book_pool.start_refiller(prefill_book, interval=float(os.getenv("BOOK_POOL_INTERVAL", "30")))
+
+# ====== 裏のスレッド（生成物の掃除・作り置きの補充）はワーカーの中で始める ======
+# `gunicorn 'app:create_app()' --preload` では import が fork 前の master で走る。
+# そこでスレッドを始めると master にしか残らず、補充のロック（flock）の fd も
+# 全ワーカーに引き継がれてしまう。なので import では始めず、各プロセスの最初の
+# リクエストで始める（pid で見るので、fork 後の子はそれぞれ自分の分を始める）。
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background():
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    artifacts.start_sweeper(interval=float(os.getenv("ARTIFACT_SWEEP_INTERVAL", "600")))
+    # BOOK_QUEUE=1 の時は、作り置きもワーカー側（worker.py）で行う
+    if BOOK_POOL and not BOOK_QUEUE:
+        start_pool_refiller()
+
+@app.before_request
+def _start_background():
+    start_background()
+
+# ====== ジョブ管理（ワーカープロセス内メモリ） ======
+# ※ ジョブはプロセスごとに持つので gunicorn は `-w 1 --threads N` で動かすこと
+#   （BOOK_QUEUE=1 なら job_queue に積むので、Web は何プロセスでもよい）
+jobs: dict[str, dict] = {}
+jobs_lock = threading.Lock()
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="book-job")
+
+def _update_job(job_id: str, **fields):
+    with jobs_lock:
+        job = jobs[job_id]
+        if "pages" in fields:
+            fields["pages"] = [dict(pg) for pg in fields["pages"]]
+        job.update(fields, updated=time.time())
+
+def _run_job(job_id: str, params: dict):
+    try:
+        with traced("job", job_id=job_id):
+            result = build_book(params, report=lambda **kw: _update_job(job_id, **kw), run_id=job_id)
+        _update_job(job_id, stage="done", **result)
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        _update_job(job_id, stage="error", error=str(e))
+
+def submit_job(params: dict, job_id: str | None = None) -> str:
+    """job_id はそのまま run_id になる。既存の run_id を渡すと続きから作る"""
+    if BOOK_QUEUE:
+        return job_queue.enqueue(params, job_id=job_id)
+    now = time.time()
+    job_id = job_id or uuid.uuid4().hex
+    with jobs_lock:
+        # 古い完了ジョブを掃除
+        for jid in [k for k, j in jobs.items() if j["stage"] in ("done", "error") and now - j["updated"] > JOB_TTL]:
+            del jobs[jid]
+        jobs[job_id] = {"id": job_id, "stage": "queued", "title": None, "pages": [],
+                        "audio_url": None, "error": None, "created": now, "updated": now}
+    job_executor.submit(_run_job, job_id, params)
+    return job_id
+
+def get_job(job_id: str) -> dict | None:
+    if BOOK_QUEUE and (job := job_queue.get(job_id)):
+        state = {"queued": "queued", "done": "done", "dead": "error"}.get(
+            job["state"], job["progress"].get("stage", "story"))
+        body = job["result"] or job["progress"]
+        return {"id": job_id, "stage": state, "title": body.get("title"), "pages": body.get("pages", []),
+                "audio_url": body.get("audio_url"), "error": job["error"], "attempts": job["attempts"]}
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job:
+            return json.loads(json.dumps(job))
+    # 別ワーカー・再起動前のジョブは保存済みの途中経過から答える
+    run = runs.load(job_id)
+    if run is None:
+        return None
+    scenes = (run.get("story") or {}).get("story", [])[:3]
+    return {"id": job_id, "stage": run["status"], "title": (run.get("story") or {}).get("title"),
+            "pages": make_pages(scenes, run["images"], run["clips"]),
+            "audio_url": run.get("audio_url"), "error": run.get("error")}
+
+# ====== ストリーミング配信（Server-Sent Events） ======
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class BookEvents:
+    """build_book の途中経過（report の中身）を SSE イベントに変える。同期版・async 版で共用"""
+
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.sent, self.clips_sent = set(), set()
+
+    def _t(self) -> float:
+        return round(time.monotonic() - self.t0, 3)
+
+    def _pages(self, pages):
+        for i, pg in enumerate(pages):
+            if pg["img"] and i not in self.sent:
+                if not self.sent:
+                    metrics.observe("time_to_first_page", time.monotonic() - self.t0)
+                self.sent.add(i)
+                yield _sse("page", {"index": i, "img": pg["img"], "t": self._t()})
+            if pg.get("audio") and i not in self.clips_sent:
+                self.clips_sent.add(i)
+                yield _sse("clip", {"index": i, "audio": pg["audio"], "t": self._t()})
+
+    def events(self, kind: str, payload: dict):
+        """kind は report / done / error。done・error の後はストリームを閉じる"""
+        t = self._t()
+        if kind == "error":
+            yield _sse("error", {**payload, "t": t})
+            return
+        if kind == "done":
+            yield from self._pages(payload["pages"])
+            yield _sse("done", {"t": t})
+            return
+        if "title" in payload:
+            yield _sse("story", {"title": payload["title"], "pages": [pg["text"] for pg in payload["pages"]], "t": t})
+        elif "pages" in payload:
+            yield from self._pages(payload["pages"])
+        if "audio_url" in payload:
+            yield _sse("audio", {"audio_url": payload["audio_url"], "t": t})
+
+def stream_book(params: dict, run_id: str | None = None, ticket=None):
+    """タイトルと本文 → 挿絵・シーンごとの音声（できた順）→ 続けて読む音声 の順にイベントを流す。
+    ticket（受付済みの枠）は、ブラウザが途中で閉じても作り終わった時点で返す"""
+    q = queue.Queue()
+    out = BookEvents()
+    degrade = ticket.degrade if ticket else ()
+
+    def run():
+        try:
+            with traced("book_stream", degradation=ticket.level if ticket else 0):
+                q.put(("done", run_book(params, report=lambda **kw: q.put(("report", kw)), run_id=run_id,
+                                        degrade=degrade)))
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            q.put(("error", {"error": str(e), "run_id": getattr(e, "run_id", None)}))
+        finally:
+            if ticket:
+                ticket.release()
+
+    # 枠を持ったまま生成が始まらない、ということがないよう、ここで投入してしまう
+    job_executor.submit(run)
+
+    def events():
+        if ticket:
+            yield _sse("admission", ticket.info())
+        while True:
+            kind, payload = q.get()
+            yield from out.events(kind, payload)
+            if kind != "report":
+                return
+    return events()
+
 # ====== PDF 生成 ======
-def generate_pdf(data: dict, hero_tag: str) -> str:
+def generate_pdf(data: dict, hero_tag: str, profile: str | None = None) -> str:
+    """artifacts に置いた PDF のファイル名を返す（中身が同じなら作り直さない）"""
     title, scenes = data["title"], data["story"]
-    filename = f"book_{datetime.datetime.now():%Y%m%d_%H%M%S}.pdf"
-    path = f"/tmp/{filename}"
+    pixels = pdf_pixels(get_profile(profile)["pixels"], IMG_SIZE)
+    keys = [illustrate(hero_tag + ", " + scene[:60], profile) for scene in scenes[:3]]
+    filename = ArtifactStore.make_name(title, *scenes[:3], *keys, f"{pixels}q{PDF_JPEG_QUALITY}", ext="pdf")
+    if artifacts.get(filename):
+        return filename
+
+    # 貼る大きさに縮めた JPEG を用意し、パスのまま渡す（DCT のまま・同じ絵は 1 回だけ埋め込む）
+    images = []
+    for key in keys:
+        with stage("image_decode"):
+            images.append(scaled_jpeg(image_store.path(key),
+                                      image_store.variant_path(key, f"{pixels}q{PDF_JPEG_QUALITY}"), pixels))
+
+    with stage("pdf_render"):
+        artifacts.put(filename, lambda path: _render_pdf(path, title, scenes, images))
+    return filename
 
+def _render_pdf(path: str, title: str, scenes: list, images: list):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen.canvas import Canvas
+    ensure_fonts("JPFontB")
     canvas = Canvas(path, pagesize=A4)
     W, H = A4
 
-    for idx, scene in enumerate(scenes[:3]):
-        url = dall_e(hero_tag + ", " + scene[:60])
-        with Image.open(requests.get(url, stream=True).raw) as img:
-            img = img.resize((IMG_SIZE, IMG_SIZE), Image.LANCZOS)
-            canvas.drawImage(ImageReader(img), MARGIN, H - IMG_SIZE - MARGIN, IMG_SIZE, IMG_SIZE)
+    for idx, (scene, img) in enumerate(zip(scenes[:3], images)):
+        canvas.drawImage(img, MARGIN, H - IMG_SIZE - MARGIN, IMG_SIZE, IMG_SIZE)
 
         if idx == 0:
-            canvas.setFont("JPFont", 14)
+            canvas.setFont("JPFontB", 14)
             canvas.drawString(MARGIN, H - IMG_SIZE - MARGIN - 20, f"『{title}』")
 
-        canvas.setFont("JPFont", 11)
+        canvas.setFont("JPFontB", 11)
         t = canvas.beginText(MARGIN, H - IMG_SIZE - MARGIN - 40)
         t.textLines(textwrap.fill(scene, 38))
         canvas.drawText(t)
         canvas.showPage()
 
     canvas.save()
-    return filename
 
 # ====== HTML UI ======
 HTML = """
@@ -133,47 +613,94 @@ const msg = document.getElementById('msg');
 const pages = document.getElementById('pages');
 const audio = document.getElementById('player');
 const loading = document.getElementById('loading');
+let resumeRunId = null;
+let notice = "";   // 混雑で かんたんにした時のお知らせ（完了後も残す）
+form.onchange = () => { resumeRunId = null; };   // 条件を変えたら最初から
 
 form.onsubmit = async e => {
   e.preventDefault();
   const bgm = document.getElementById('bgm');
   try { bgm.play(); } catch (e) {}
   btn.disabled = true;
-  msg.textContent = "";
+  msg.textContent = notice = "";
   pages.innerHTML = "";
   loading.style.display = "block";
 
-  const res = await fetch("/api/book_with_voice", { method: "POST", body: new FormData(form) });
-  const data = await res.json();
+  // できたページから順に届くストリーム（SSE）を読む
+  // 前回とちゅうで失敗していたら、その続きから作ってもらう
+  const body = new FormData(form);
+  if (resumeRunId) body.append("run_id", resumeRunId);
+  resumeRunId = null;
+  const res = await fetch("/api/book_stream", { method: "POST", body });
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "", failed = false;
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let cut;
+    while ((cut = buf.indexOf("\\n\\n")) >= 0) {
+      const chunk = buf.slice(0, cut);
+      buf = buf.slice(cut + 2);
+      const ev = (chunk.match(/^event: (.*)$/m) || [])[1];
+      const data = JSON.parse((chunk.match(/^data: (.*)$/m) || [])[1] || "{}");
+      if (ev === "error") failed = onError(data);
+      else handleEvent(ev, data);
+    }
+  }
+  if (!failed) msg.textContent = "✅ 完了！" + (notice && "（" + notice + "）");
+  btn.disabled = false;
+};
 
+function stopLoading() {
+  const bgm = document.getElementById('bgm');
   loading.style.display = "none";
   bgm.pause();
   bgm.currentTime = 0;
+}
 
-  if (data.error) {
-    msg.textContent = "❌ " + data.error;
-    btn.disabled = false;
-    return;
-  }
+function onError(data) {
+  stopLoading();
+  msg.textContent = "❌ " + data.error;
+  resumeRunId = data.run_id || null;
+  if (resumeRunId) msg.textContent += "（もういちど おすと つづきから つくるよ）";
+  return true;
+}
 
-  
-  msg.textContent = "✅ 完了！";
-  data.pages.forEach(pg => {
-    pages.insertAdjacentHTML("beforeend", `
-      <div class="page">
-        <img src="${pg.img}" />
-        <p>${pg.text}</p>
-      </div>`);
-  });
-
-  if (data.audio_url) {
+function handleEvent(ev, data) {
+  if (ev === "story") {
+    // 本文だけ先に並べておき、挿絵は届いたものから差し込む
+    data.pages.forEach((text, i) => {
+      pages.insertAdjacentHTML("beforeend", `
+        <div class="page" id="page-${i}" style="display:none">
+          <img />
+          <p></p>
+        </div>`);
+      document.querySelector(`#page-${i} p`).textContent = text;
+    });
+  } else if (ev === "page") {
+    stopLoading();
+    const div = document.getElementById(`page-${data.index}`);
+    div.querySelector("img").src = data.img;
+    div.style.display = "block";
+  } else if (ev === "admission") {
+    if (data.level > 0) msg.textContent = notice = "こみあっているので、かんたんな えほんに しています";
+  } else if (ev === "clip") {
+    // ページの絵をタップすると、そのページだけ読み上げる
+    document.querySelector(`#page-${data.index} img`).onclick = () => {
+      audio.src = data.audio;
+      audio.style.display = "block";
+      audio.play();
+    };
+  } else if (ev === "audio") {
     audio.src = data.audio_url;
     audio.style.display = "block";
     audio.play();
+  } else if (ev === "done") {
+    stopLoading();
   }
-
-  btn.disabled = false;
-};
+}
 </script>
 """
 
@@ -182,38 +709,145 @@ form.onsubmit = async e => {
 def index():
     return render_template_string(HTML)
 
+BUSY_MESSAGE = "混み合っています。少し待ってからもう一度どうぞ。"
+
 @app.route("/api/book_with_voice", methods=["POST"])
 def api_book_with_voice():
     try:
-        f = request.form
-        rsp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "system", "content": story_prompt(f['age'], f['gender'], f['hero'], f['theme'])}],
-            max_tokens=700,
-            response_format={"type": "json_object"}
-        )
-        story_json = json.loads(rsp.choices[0].message.content)
-
-        story_text = "。".join(story_json["story"])
-        filename = f"tts_{datetime.datetime.now():%Y%m%d_%H%M%S}.mp3"
-        path = os.path.join("/tmp", filename)
-
-        speech = client.audio.speech.create(
-            model="tts-1",
-            voice="shimmer",
-            input=story_text
-        )
-        speech.stream_to_file(path)
-
-        hero_tag = f"main character is a {f['hero']}"
-        pages = [{"img": dall_e(hero_tag + ", " + sc[:60]), "text": sc} for sc in story_json["story"][:3]]
-
-        return jsonify({"pages": pages, "audio_url": f"/audio/{filename}"})
+        get_profile(request.form.get("profile"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        ticket = admission.admit()
+    except Overloaded as e:
+        return jsonify({"error": BUSY_MESSAGE, "retry_after": e.retry_after}), 503, {"Retry-After": str(e.retry_after)}
+    try:
+        with ticket, traced("book_with_voice", degradation=ticket.level):
+            book = run_book(request.form, run_id=request.form.get("run_id") or None, degrade=ticket.degrade)
+        return jsonify({"pages": book["pages"], "audio_url": book["audio_url"], "run_id": book.get("run_id"),
+                        "degradation": ticket.info()}), 200, {"X-Book-Degradation": str(ticket.level)}
 
     except Exception as e:
         traceback.print_exc(file=sys.stderr)
-        return jsonify({"error": str(e)}), 500
+        if getattr(e, "status_code", None) == 429:
+            # 再試行しても枠が空かなかった → 少し待ってから来てもらう
+            return jsonify({"error": BUSY_MESSAGE}), 503, {"Retry-After": "30"}
+        # run_id を付けてもう一度 POST すれば、できている所から続きを作る
+        return jsonify({"error": str(e), "run_id": getattr(e, "run_id", None)}), 500
+
+@app.route("/api/book_stream", methods=["POST"])
+def api_book_stream():
+    f = request.form
+    params = {k: f.get(k, "") for k in ("age", "gender", "hero", "theme", "profile")}
+    try:
+        get_profile(params["profile"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        ticket = admission.admit()
+    except Overloaded as e:
+        # フロントは SSE として読むので、断る時も error イベントで返す
+        return Response(_sse("error", {"error": BUSY_MESSAGE, "retry_after": e.retry_after}), 503,
+                        mimetype="text/event-stream", headers={"Retry-After": str(e.retry_after)})
+    return Response(stream_book(params, f.get("run_id") or None, ticket), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                             "X-Book-Degradation": str(ticket.level)})
+
+@app.route("/api/jobs", methods=["POST"])
+def api_create_job():
+    f = request.form
+    missing = [k for k in ("age", "gender", "hero", "theme") if not f.get(k)]
+    if missing:
+        return jsonify({"error": f"missing: {', '.join(missing)}"}), 400
+    try:
+        get_profile(f.get("profile"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job_id = submit_job({k: f.get(k, "") for k in ("age", "gender", "hero", "theme", "profile")},
+                        job_id=f.get("run_id") or None)
+    return jsonify({"job_id": job_id, "status_url": f"/api/jobs/{job_id}"}), 202
+
+@app.route("/api/jobs/<job_id>")
+def api_get_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
+@app.route("/metrics")
+def prometheus_metrics():
+    for name, value in story_cache.stats().items():
+        if name in ("hit", "miss", "entries"):
+            metrics.set_gauge("book_story_cache", value, help="Story cache counters (shared across workers).", kind=name)
+    if BOOK_QUEUE:
+        counts = job_queue.stats()
+        for state in ("queued", "running", "done", "dead"):
+            metrics.set_gauge("book_queue_jobs", counts.get(state, 0), help="Jobs in the durable queue by state.",
+                              state=state)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/cache_stats")
+def api_cache_stats():
+    return jsonify({"story": story_cache.stats()})
+
+@app.route("/images/<key>.jpg")
+def serve_image(key):
+    # キー = プロンプトのハッシュなので中身は変わらない → 長期キャッシュ可
+    if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+        abort(404)
+    path = image_store.get(key)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype="image/jpeg", etag=key, conditional=True,
+                     max_age=365 * 86400)
 
 @app.route("/audio/<filename>")
 def serve_audio(filename):
-    return send_from_directory("/tmp", filename, mimetype="audio/mpeg")
+    # ファイル名 = 入力のハッシュなので中身は変わらない → 長期キャッシュ可。
+    # conditional=True で Range（シーク）に答え、本体は wsgi.file_wrapper
+    # （gunicorn では sendfile）で送る。前段に nginx があれば USE_X_SENDFILE=1
+    path = artifacts.get(filename) if filename.endswith(".mp3") else None
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype="audio/mpeg", etag=filename.removesuffix(".mp3"), conditional=True,
+                     max_age=365 * 86400)
+
+@app.route("/audio/book/<names>.mp3")
+def serve_narration(names):
+    # シーンごとの MP3 をそのままつないで流す（MP3 はフレームの連結で再生できる）。
+    # まだ合成中のシーンは、できるまで待ってから続きを送る
+    clips = [n + ".mp3" for n in names.split("-")]
+    if not 1 <= len(clips) <= 10 or not all(ArtifactStore.valid_name(c) for c in clips):
+        abort(404)
+    if artifacts.get(clips[0]) is None:
+        abort(404)
+
+    def body():
+        for name in clips:
+            deadline = time.monotonic() + CLIP_WAIT
+            while (path := artifacts.get(name)) is None:
+                if time.monotonic() > deadline:
+                    return
+                time.sleep(0.2)
+            with open(path, "rb") as fp:
+                while chunk := fp.read(64 * 1024):
+                    yield chunk
+
+    return Response(body(), mimetype="audio/mpeg", headers={"Cache-Control": "no-cache"})
+
+# ====== 起動モード ======
+# `gunicorn app:app` … 重い import（reportlab・Pillow・openai）とフォント解析は最初に使う時まで遅らせる
+# `gunicorn 'app:create_app()' --preload`（または BOOK_PRELOAD=1）
+#   … fork 前に済ませておき、解析済みのフォントを全ワーカーで共有する（copy-on-write）
+def warm_up():
+    preload()
+    if os.getenv("BOOK_BACKEND", "openai") != "fake":
+        import openai  # noqa: F401
+
+def create_app(preload_pdf: bool = True):
+    if preload_pdf:
+        warm_up()
+    return app
+
+if os.getenv("BOOK_PRELOAD", "0") == "1":
+    warm_up()
@@ -0,0 +1,246 @@
+# app_async.py — 絵本パイプラインの async 版（AsyncOpenAI + ASGI）
+# -------------------------------------------------------------
+# 同期版（app.py）は 1 冊がスレッドを 30〜90 秒占有し、そのほとんどが API 待ち。
+# こちらは待ちをすべて await にして、1 プロセスで数百冊を同時に進める。
+#   uvicorn app_async:app --workers 1
+# プロンプト・キャッシュ・ページの組み立て・SSE イベントは app.py のものを使う。
+# CPU を使う所（画像のデコードと JPEG 保存）だけスレッドに逃がす。
+# ※ 作り置きプール・途中経過からの再開・ジョブ API は同期版だけ。
+import asyncio, sys, time, traceback
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+import metrics
+from metrics import stage, traced
+from app import (HTML, PROMPT_BASE, STORY_STREAM, TTS_MODEL, TTS_VOICE, CLIP_WAIT, BookEvents,
+                 artifacts, clip_name, image_request, image_store, make_pages, narration_url,
+                 start_background, story_cache, story_request)
+from artifact_store import ArtifactStore
+from backend import make_async_client
+from imaging import afetch
+from render_profiles import DEFAULT_PROFILE, get_profile
+from story_repair import acomplete_story
+from story_stream import aconsume_stream
+
+client = make_async_client()   # BOOK_BACKEND=fake でオフライン
+
+# ====== 同じキーの処理が同時に走ったら 1 本にまとめる（プロセス内） ======
+_inflight: dict[str, asyncio.Future] = {}
+
+async def once(key: str, fn):
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(fn())
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # 待っている側がキャンセルされても、共有している本体は止めない
+    return await asyncio.shield(task)
+
+# ====== 画像生成 ======
+async def illustrate(prompt: str, profile: str | None = None) -> str:
+    kwargs, key = image_request(prompt, profile)
+
+    async def generate():
+        with stage("image"):
+            rsp = await client.images.generate(prompt=PROMPT_BASE + prompt, n=1, **kwargs)
+        with stage("image_download"):
+            data = await afetch(rsp.data[0].url)
+            await asyncio.to_thread(image_store.put_bytes, key, data)
+
+    if image_store.get(key) is None:
+        await once("image:" + key, generate)
+    return f"/images/{key}.jpg"
+
+# ====== 音声合成 ======
+async def tts(text: str) -> str:
+    filename = clip_name(text)
+
+    async def generate():
+        with stage("tts"):
+            speech = await client.audio.speech.create(model=TTS_MODEL, voice=TTS_VOICE, input=text)
+        await asyncio.to_thread(artifacts.put_bytes, filename, speech.content)
+
+    if artifacts.get(filename) is None:
+        await once("tts:" + filename, generate)
+    return f"/audio/{filename}"
+
+# ====== ストーリー生成 ======
+async def write_story(params, on_scene=lambda i, text: None) -> dict:
+    kwargs, key = story_request(params)
+    streamed = set()
+
+    async def generate():
+        with stage("chat"):
+            if STORY_STREAM:
+                def emit(i, sc):
+                    streamed.add(i)
+                    on_scene(i, sc)
+                rsp = await client.chat.completions.create(stream=True, **kwargs)
+                text = await aconsume_stream(rsp, on_scene=emit)
+            else:
+                text = (await client.chat.completions.create(**kwargs)).choices[0].message.content
+        story = await acomplete_story(client, text, 3, kwargs)
+        await asyncio.to_thread(story_cache.put, key, story)
+        return story
+
+    # キャッシュは SQLite（他のプロセスのロック待ちがある）なので、イベントループを止めないようスレッドで
+    story_json = await asyncio.to_thread(story_cache.get, key) or await once("story:" + key, generate)
+    for i, sc in enumerate(story_json["story"]):
+        if i not in streamed:
+            on_scene(i, sc)
+    return story_json
+
+# ====== 絵本パイプライン ======
+async def build_book(params, report=lambda **kw: None) -> dict:
+    profile = params.get("profile") or DEFAULT_PROFILE
+    hero_tag = f"main character is a {params['hero']}"
+    report(stage="story")
+
+    # シーンが書き上がった瞬間に、その挿絵と読み上げを始める
+    # （最後のページは修復で残りのシーンがまとめられることがあるので、読み上げは全文がそろってから）
+    tasks = {}
+    def on_scene(i, sc):
+        if i < 3:
+            tasks[asyncio.ensure_future(illustrate(hero_tag + ", " + sc[:60], profile))] = ("img", i)
+        if i < 2:
+            tasks[asyncio.ensure_future(tts(sc))] = ("audio", i)
+
+    try:
+        story_json = await write_story(params, on_scene)
+        scenes = story_json["story"][:3]
+        last = len(scenes) - 1
+        tasks[asyncio.ensure_future(tts(scenes[last]))] = ("audio", last)
+        pages = make_pages(scenes, {}, {})
+        report(stage="media", title=story_json.get("title"), pages=pages)
+
+        audio_url = narration_url(scenes)
+        audio_sent = False
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                kind, i = tasks[task]
+                pages[i][kind] = task.result()
+            report(pages=pages)
+            if not audio_sent and pages[0]["audio"]:
+                report(audio_url=audio_url)
+                audio_sent = True
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return {"title": story_json.get("title"), "pages": pages, "audio_url": audio_url}
+
+# ====== ストリーミング配信（Server-Sent Events） ======
+async def stream_book(params: dict):
+    q = asyncio.Queue()
+    out = BookEvents()
+
+    async def run():
+        try:
+            with traced("book_stream_async"):
+                q.put_nowait(("done", await build_book(params, report=lambda **kw: q.put_nowait(("report", kw)))))
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            q.put_nowait(("error", {"error": str(e)}))
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            kind, payload = await q.get()
+            for event in out.events(kind, payload):
+                yield event
+            if kind != "report":
+                return
+    finally:
+        task.cancel()              # ブラウザが閉じられたら、その冊の生成もやめる
+
+# ====== ルーティング ======
+def _params(form) -> dict:
+    return {k: form.get(k, "") for k in ("age", "gender", "hero", "theme", "profile")}
+
+async def index(request: Request):
+    return HTMLResponse(HTML)
+
+async def api_book_with_voice(request: Request):
+    params = _params(await request.form())
+    try:
+        get_profile(params["profile"])
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    try:
+        with traced("book_with_voice_async"):
+            book = await build_book(params)
+        return JSONResponse({"pages": book["pages"], "audio_url": book["audio_url"]})
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        if getattr(e, "status_code", None) == 429:
+            return JSONResponse({"error": "混み合っています。少し待ってからもう一度どうぞ。"}, 503,
+                                headers={"Retry-After": "30"})
+        return JSONResponse({"error": str(e)}, 500)
+
+async def api_book_stream(request: Request):
+    params = _params(await request.form())
+    try:
+        get_profile(params["profile"])
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    return StreamingResponse(stream_book(params), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def prometheus_metrics(request: Request):
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def serve_image(request: Request):
+    key = request.path_params["key"]
+    path = image_store.get(key) if len(key) == 64 and all(c in "0123456789abcdef" for c in key) else None
+    if path is None:
+        return Response(status_code=404)
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=31536000"})
+
+async def serve_audio(request: Request):
+    filename = request.path_params["filename"]
+    path = artifacts.get(filename) if filename.endswith(".mp3") else None
+    if path is None:
+        return Response(status_code=404)
+    return FileResponse(path, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=31536000"})
+
+async def serve_narration(request: Request):
+    clips = [n + ".mp3" for n in request.path_params["names"].split("-")]
+    if not 1 <= len(clips) <= 10 or not all(ArtifactStore.valid_name(c) for c in clips):
+        return Response(status_code=404)
+    if artifacts.get(clips[0]) is None:
+        return Response(status_code=404)
+
+    async def body():
+        for name in clips:
+            deadline = time.monotonic() + CLIP_WAIT
+            while (path := artifacts.get(name)) is None:
+                if time.monotonic() > deadline:
+                    return
+                await asyncio.sleep(0.2)
+            yield await asyncio.to_thread(_read, path)
+
+    return StreamingResponse(body(), media_type="audio/mpeg", headers={"Cache-Control": "no-cache"})
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as fp:
+        return fp.read()
+
+@asynccontextmanager
+async def lifespan(app):
+    start_background()      # 生成物の掃除はワーカーが起動してから（fork 後）
+    yield
+
+app = Starlette(routes=[
+    Route("/", index),
+    Route("/api/book_with_voice", api_book_with_voice, methods=["POST"]),
+    Route("/api/book_stream", api_book_stream, methods=["POST"]),
+    Route("/metrics", prometheus_metrics),
+    Route("/images/{key}.jpg", serve_image),
+    Route("/audio/book/{names}.mp3", serve_narration),
+    Route("/audio/{filename}", serve_audio),
+    Mount("/static", StaticFiles(directory="static"), name="static"),
+], lifespan=lifespan)
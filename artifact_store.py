@@ -0,0 +1,116 @@
+# artifact_store.py — 音声・PDF などの生成物の置き場（TTL・容量上限つき）
+# -------------------------------------------------------------
+# /tmp に時刻名で書いていた頃は、同じ秒の 2 リクエストが上書きし合い、
+# しかも誰も消さないので /tmp が増え続けた。
+# ・名前は中身（入力）のハッシュ → 衝突しない・同じものは使い回せる
+# ・<root>/<先頭2文字>/<ハッシュ>.<拡張子> に分けて置く（1 ディレクトリに溜めない）
+# ・書き込みは一時ファイル → os.replace（書きかけは見えない）
+# ・掃除スレッドが TTL 切れを消し、合計サイズが上限を超えたら古く使われた順に消す
+import fcntl, hashlib, os, re, tempfile, threading, time
+
+NAME_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+
+class ArtifactStore:
+    def __init__(self, root: str, ttl: int = 7 * 86400, max_bytes: int = 5 * 1024 ** 3):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_name(*parts: str, ext: str) -> str:
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest() + "." + ext
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        return bool(NAME_RE.match(name))
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name[:2], name)
+
+    def get(self, name: str) -> str | None:
+        """あればパスを返し、最終アクセス時刻（mtime）を更新する"""
+        if not self.valid_name(name):
+            return None
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, name: str, write) -> str:
+        """write(一時ファイルのパス) で中身を書かせ、できあがったら name に置く"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        return path
+
+    def put_bytes(self, name: str, data: bytes) -> str:
+        def write(tmp):
+            with open(tmp, "wb") as fp:
+                fp.write(data)
+        return self.put(name, write)
+
+    def sweep(self) -> dict:
+        """TTL 切れと容量超過分を消す。他のワーカーが掃除中なら何もしない"""
+        removed = freed = 0
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {"removed": 0, "freed": 0}
+            now = time.time()
+            files, total = [], 0
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    # 書きかけ（.part）は 1 時間放置されていたら落ちた残骸とみなす
+                    limit = 3600 if entry.name.endswith(".part") else self.ttl
+                    if now - st.st_mtime > limit:
+                        if self._unlink(entry.path):
+                            removed, freed = removed + 1, freed + st.st_size
+                    elif not entry.name.endswith(".part"):
+                        files.append((st.st_mtime, st.st_size, entry.path))
+                        total += st.st_size
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if self._unlink(path):
+                    removed, freed = removed + 1, freed + size
+                total -= size
+        return {"removed": removed, "freed": freed}
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def start_sweeper(self, interval: float = 600):
+        def loop():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"⚠️ artifact sweep failed: {e}")
+                time.sleep(interval)
+        threading.Thread(target=loop, name="artifact-sweeper", daemon=True).start()
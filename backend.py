@@ -0,0 +1,88 @@
+# backend.py — 生成バックエンドの切り替え
+# -------------------------------------------------------------
+#   BOOK_BACKEND=openai（既定） … 本物の OpenAI API
+#   BOOK_BACKEND=fake           … fake_openai.FakeOpenAI（オフライン）
+# どちらも rate_limit.LimitedClient で包み、モデルごとのレート制限と
+# 429 のバックオフを全ワーカーで共有する（再試行は SDK ではなくこちらで行う）。
+# openai パッケージの import は重いので、最初の API 呼び出しまで遅らせる。
+# 同期版の呼び出しは scheduler.py の優先度つき順番待ちを通す（BOOK_SCHEDULER=off で外す）。
+# IMAGE_HEDGE=1 なら、挿絵の API 呼び出し 1 回ごとにヘッジする（hedge.py。遅い挿絵に 2 本目を出す）。
+import os, threading
+from rate_limit import AsyncLimitedClient, LimitedClient, RateLimiter, parse_limits
+from scheduler import RemoteScheduler, Scheduler, parse_classes
+
+
+class LazyClient:
+    """最初に属性を触られた時に factory() で本物のクライアントを作る"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
+
+
+def _openai():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+
+def _async_openai():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+
+def _limiter():
+    return RateLimiter(os.getenv("RATE_LIMIT_PATH", "cache/ratelimit.sqlite3"),
+                       parse_limits(os.getenv("RATE_LIMITS", "")),
+                       burst_seconds=float(os.getenv("RATE_LIMIT_BURST", "10")))
+
+
+def local_scheduler():
+    return Scheduler(_limiter(),
+                     weights=parse_classes(os.getenv("SCHED_WEIGHTS", ""), {}),
+                     caps=parse_classes(os.getenv("SCHED_CAPS", ""), {}),
+                     aging=float(os.getenv("SCHED_AGING", "60")))
+
+
+def _scheduler():
+    mode = os.getenv("BOOK_SCHEDULER", "local")
+    if mode == "off":
+        return None
+    if mode == "socket":
+        return RemoteScheduler(os.getenv("SCHED_SOCKET", "cache/scheduler.sock"), local_scheduler())
+    return local_scheduler()
+
+
+def _hedger():
+    if os.getenv("IMAGE_HEDGE", "0") != "1":
+        return None
+    from hedge import Hedger
+    return Hedger.from_env()
+
+
+def make_client():
+    if os.getenv("BOOK_BACKEND", "openai") == "fake":
+        from fake_openai import FakeOpenAI
+        raw = FakeOpenAI.from_env()
+    else:
+        raw = LazyClient(_openai)
+    return LimitedClient(raw, _limiter(), max_retries=int(os.getenv("RATE_MAX_RETRIES", "5")),
+                         scheduler=_scheduler(), hedger=_hedger())
+
+
+def make_async_client():
+    """make_client の AsyncOpenAI 版（app_async.py 用）。レート制限の枠は同期版と共有"""
+    if os.getenv("BOOK_BACKEND", "openai") == "fake":
+        from fake_openai import AsyncFakeOpenAI
+        raw = AsyncFakeOpenAI.from_env()
+    else:
+        raw = LazyClient(_async_openai)
+    return AsyncLimitedClient(raw, _limiter(), max_retries=int(os.getenv("RATE_MAX_RETRIES", "5")),
+                              hedger=_hedger())
@@ -0,0 +1,136 @@
+# bench.py — オフラインの端から端までのレイテンシ計測（fake バックエンド使用）
+# -------------------------------------------------------------
+# 本物の API を呼ばずに、同時実行数ごとの p50/p95/p99 とスループットを測る。
+#   python bench.py                          # 既定: 同時 1,4,16 / 各 16 冊
+#   python bench.py --levels 1,8,32 --books 64 --scale 0.02
+#   FAKE_OPENAI_LATENCY="image=20:0.8" python bench.py   # 画像の裾を重く
+#   python bench.py --compare                # build_book の逐次（並列化前）と並列の比較
+import argparse, itertools, json, math, os, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+FORM = {"age": "4", "gender": "おんなのこ", "hero": "ろぼっと", "theme": "ぼうけん"}
+
+
+def form(i: int, tag: str = "") -> dict:
+    """i 冊目の注文。冊ごとに主人公を変える（同じ注文だと singleflight とキャッシュで 1 冊にまとまる）"""
+    return {**FORM, "hero": f"{FORM['hero']}{tag}{i}"}
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def run_level(fn, level: int, n: int):
+    """fn を同時 level 本で n 回呼び、(各回の秒数, 失敗数, 全体の秒数) を返す"""
+    def timed(_):
+        t = time.perf_counter()
+        try:
+            fn()
+            return time.perf_counter() - t, True
+        except Exception as e:
+            print(f"  ! {type(e).__name__}: {e}", file=sys.stderr)
+            return time.perf_counter() - t, False
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as ex:
+        results = list(ex.map(timed, range(n)))
+    wall = time.perf_counter() - t0
+    return [s for s, ok in results if ok], sum(not ok for _, ok in results), wall
+
+
+def report(name, level, lat, errors, wall):
+    print(f"{name:<22}{level:>5}{len(lat):>6}{errors:>5}"
+          f"{percentile(lat, 50):>9.3f}{percentile(lat, 95):>9.3f}{percentile(lat, 99):>9.3f}"
+          f"{len(lat) / wall:>10.2f}")
+
+
+def sequential_book(app, params) -> dict:
+    """並列化する前の build_book：ストーリーを書き終えてから、シーンごとに挿絵 → 読み上げを 1 つずつ"""
+    story = app.write_story(params)
+    scenes = story["story"][:3]
+    hero_tag = f"main character is a {params['hero']}"
+    pages = [{"img": app.dall_e(hero_tag + ", " + sc[:60], params.get("profile")),
+              "audio": f"/audio/{app.tts(sc)}", "text": sc} for sc in scenes]
+    return {"title": story.get("title"), "pages": pages, "audio_url": app.narration_url(scenes)}
+
+
+def compare(app, books: int):
+    """同じ fake バックエンドで、逐次と並列の build_book を 1 冊ずつ books 冊ずつ比べる"""
+    results, orders = {}, itertools.count()
+    for name, fn in (("build_book sequential", lambda: sequential_book(app, form(next(orders)))),
+                     ("build_book parallel", lambda: app.build_book(form(next(orders)), use_pool=False))):
+        lat, errors, wall = run_level(fn, 1, books)
+        report(name, 1, lat, errors, wall)
+        results[name] = percentile(lat, 50)
+    seq, par = results.values()
+    print(f"parallel / sequential p50: {par / seq:.2f}x")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="fake バックエンドでのレイテンシ計測")
+    ap.add_argument("--levels", default="1,4,16", help="同時実行数（カンマ区切り）")
+    ap.add_argument("--books", type=int, default=16, help="1 レベルあたりの冊数")
+    ap.add_argument("--scale", default="0.05", help="fake の待ち時間の倍率（FAKE_OPENAI_SCALE）")
+    ap.add_argument("--compare", action="store_true", help="build_book の逐次と並列を比べるだけ")
+    args = ap.parse_args(argv)
+
+    # app を import する前に環境を整える（キャッシュ類は使い捨てディレクトリへ）
+    tmp = tempfile.mkdtemp(prefix="bookbench_")
+    os.environ["BOOK_BACKEND"] = "fake"
+    os.environ.setdefault("FAKE_OPENAI_SCALE", args.scale)
+    os.environ["STORY_CACHE_VARIANTS"] = "0"
+    os.environ["BOOK_POOL"] = "0"
+    for env, sub in (("STORY_CACHE_PATH", "stories.sqlite3"), ("IMAGE_CACHE_DIR", "images"),
+                     ("SINGLEFLIGHT_DIR", "locks"), ("BOOK_POOL_PATH", "pool.sqlite3"),
+                     ("ARTIFACT_DIR", "artifacts"), ("BOOK_RUNS_PATH", "runs.sqlite3"),
+                     ("RATE_LIMIT_PATH", "ratelimit.sqlite3"), ("BOOK_QUEUE_PATH", "jobs.sqlite3")):
+        os.environ[env] = os.path.join(tmp, sub)
+
+    import app, generate_book
+    from imaging import fetch, load_scaled
+
+    if args.compare:
+        print(f"{'stage':<22}{'conc':>5}{'ok':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'books/s':>10}")
+        compare(app, args.books)
+        return
+
+    web = app.app.test_client()
+
+    orders = itertools.count()
+
+    def book_with_voice():
+        rsp = web.post("/api/book_with_voice", data=form(next(orders)))
+        if rsp.status_code != 200:
+            raise RuntimeError(rsp.get_json().get("error"))
+
+    def pdf():
+        story = app.client.chat.completions.create(model="gpt-4o-mini", messages=[])
+        app.generate_pdf(json.loads(story.choices[0].message.content), "main character is a robot")
+
+    def save_pdf():
+        url = generate_book.client.images.generate(prompt="", size="1024x1024").data[0].url
+        img = generate_book.save_jpeg(load_scaled(fetch(url), generate_book.IMG_SIZE),
+                                      os.path.join(tmp, f"bench_{threading.get_ident()}.jpg"))
+        scenes = ["むかしむかし、げんきな ろぼっとが いました。"] * 5
+        generate_book.save_pdf("ベンチマーク", scenes, [img] * 5, os.path.join(tmp, f"bench_{threading.get_ident()}.pdf"))
+
+    print(f"{'stage':<22}{'conc':>5}{'ok':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'books/s':>10}")
+    for level in [int(v) for v in args.levels.split(",")]:
+        for name, fn in (("api_book_with_voice", book_with_voice), ("generate_pdf", pdf),
+                         ("generate_book.save_pdf", save_pdf)):
+            for client in (app.client, generate_book.client):
+                client.calls.clear()
+            lat, errors, wall = run_level(fn, level, args.books)
+            report(name, level, lat, errors, wall)
+            # バックエンド呼び出しごとの内訳
+            for stage in ("chat", "tts", "image"):
+                calls = [s for st, s, ok in app.client.calls + generate_book.client.calls if st == stage and ok]
+                if calls:
+                    report(f"  └ {stage}", level, calls, 0, wall)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench_async.py — 1 プロセスで同時に何冊作れるか（同期版 vs async 版）
+# -------------------------------------------------------------
+# fake バックエンドで、同じ冊数を一斉に投げて比べる。
+#   sync  … app.build_book をスレッドで回す（gunicorn `-w 1 --threads N` の 1 ワーカー相当。
+#           同時に進められるのは N 冊まで、残りは順番待ち）
+#   async … app_async.build_book を 1 つのイベントループで全部同時に回す
+# 冊数ごとに、実際に同時進行した冊数の最大・経過時間・冊/秒・p50/p95・スレッド数を出す。
+# 1 冊ごとに注文（主人公）を変え、モードごとに空のキャッシュから始める
+# （先に走ったモードの挿絵・音声・ストーリーを後のモードが使い回さないように）。
+#   python bench_async.py                          # 既定: 50,200 冊 / sync は 16 スレッド
+#   python bench_async.py --books 100,400 --threads 32 --scale 0.05
+import argparse, asyncio, os, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from bench import form, percentile
+
+
+class InFlight:
+    def __init__(self):
+        self.now = self.peak = 0
+        self.threads = threading.active_count()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.now += 1
+            self.peak = max(self.peak, self.now)
+            self.threads = max(self.threads, threading.active_count())
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.now -= 1
+
+
+def report(name, n, gauge, lat, errors, wall):
+    print(f"{name:<8}{n:>7}{gauge.peak:>10}{len(lat):>6}{errors:>5}{wall:>9.2f}{len(lat) / wall:>9.2f}"
+          f"{percentile(lat, 50):>9.2f}{percentile(lat, 95):>9.2f}{gauge.threads:>9}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="同期版と async 版の同時冊数の比較（fake バックエンド）")
+    ap.add_argument("--books", default="50,200", help="一斉に投げる冊数（カンマ区切り）")
+    ap.add_argument("--threads", type=int, default=16, help="同期版のスレッド数（gunicorn --threads 相当）")
+    ap.add_argument("--scale", default="0.1", help="fake の待ち時間の倍率（FAKE_OPENAI_SCALE）")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="asyncbench_")
+    os.environ["BOOK_BACKEND"] = "fake"
+    os.environ.setdefault("FAKE_OPENAI_SCALE", args.scale)
+    os.environ["STORY_CACHE_VARIANTS"] = "0"
+    os.environ["BOOK_POOL"] = "0"
+    for env, sub in (("STORY_CACHE_PATH", "stories.sqlite3"), ("IMAGE_CACHE_DIR", "images"),
+                     ("SINGLEFLIGHT_DIR", "locks"), ("BOOK_POOL_PATH", "pool.sqlite3"),
+                     ("ARTIFACT_DIR", "artifacts"), ("BOOK_RUNS_PATH", "runs.sqlite3"),
+                     ("RATE_LIMIT_PATH", "ratelimit.sqlite3"), ("BOOK_QUEUE_PATH", "jobs.sqlite3")):
+        os.environ[env] = os.path.join(tmp, sub)
+
+    import app, app_async
+    from artifact_store import ArtifactStore
+    from image_store import ImageStore
+    from story_cache import StoryCache
+
+    def fresh_stores(tag):
+        d = os.path.join(tmp, tag)
+        app.image_store = app_async.image_store = ImageStore(os.path.join(d, "images"))
+        app.artifacts = app_async.artifacts = ArtifactStore(os.path.join(d, "artifacts"))
+        app.story_cache = app_async.story_cache = StoryCache(os.path.join(d, "stories.sqlite3"), variants=0)
+
+    def run_sync(n):
+        fresh_stores(f"sync{n}")
+        gauge, lat, errors = InFlight(), [], 0
+        def one(i):
+            t = time.perf_counter()
+            with gauge:
+                app.build_book(form(i, f"s{n}-"), use_pool=False)
+            return time.perf_counter() - t
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as ex:
+            futs = [ex.submit(one, i) for i in range(n)]
+            for fut in futs:
+                try:
+                    lat.append(fut.result())
+                except Exception:
+                    errors += 1
+        return gauge, lat, errors, time.perf_counter() - t0
+
+    async def run_async(n):
+        fresh_stores(f"async{n}")
+        gauge = InFlight()
+        async def one(i):
+            t = time.perf_counter()
+            with gauge:
+                await app_async.build_book(form(i, f"a{n}-"))
+            return time.perf_counter() - t
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(n)), return_exceptions=True)
+        lat = [r for r in results if not isinstance(r, BaseException)]
+        return gauge, lat, len(results) - len(lat), time.perf_counter() - t0
+
+    # ※ 同期版の「遅延」は順番待ちを含む（ブラウザから見た待ち時間）
+    print(f"{'mode':<8}{'books':>7}{'in-flight':>10}{'ok':>6}{'err':>5}{'wall s':>9}{'books/s':>9}"
+          f"{'p50':>9}{'p95':>9}{'threads':>9}")
+    for n in [int(v) for v in args.books.split(",")]:
+        report("sync", n, *run_sync(n))
+        report("async", n, *asyncio.run(run_async(n)))
+
+
+if __name__ == "__main__":
+    main()
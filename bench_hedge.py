@@ -0,0 +1,57 @@
+# bench_hedge.py — 挿絵のヘッジリクエストで裾（p95/p99）がどれだけ縮むか
+# -------------------------------------------------------------
+# fake バックエンドの images.generate を、裾の重い遅延（対数正規 + まれな大停滞）で
+# 何度も呼び、ヘッジなし / あり の p50・p95・p99・最大と、2 本目を出した割合を比べる。
+# 最初の warmup 回は所要時間の記録づくり（集計に入れない）。
+#   python bench_hedge.py                                   # 既定: 400 回・同時 16
+#   python bench_hedge.py --calls 1000 --percentile 95 --budget 120
+import argparse, os, tempfile, time
+from bench import percentile, run_level
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="挿絵のヘッジリクエストの効果（fake バックエンド）")
+    ap.add_argument("--calls", type=int, default=400, help="計測する呼び出し回数")
+    ap.add_argument("--warmup", type=int, default=50, help="所要時間の記録づくりに使う回数")
+    ap.add_argument("--level", type=int, default=16, help="同時に呼ぶ本数")
+    ap.add_argument("--percentile", type=float, default=90, help="2 本目を出すまでの待ち（直近の何 % 点か）")
+    ap.add_argument("--budget", type=int, default=600, help="2 本目の上限（本/分）")
+    ap.add_argument("--latency", default="image=8:0.5", help="FAKE_OPENAI_LATENCY")
+    ap.add_argument("--stall", default="image=0.05:8", help="FAKE_OPENAI_STALL")
+    ap.add_argument("--scale", type=float, default=0.02, help="待ち時間の倍率")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="hedgebench_")
+    os.environ["RATE_LIMIT_PATH"] = os.path.join(tmp, "ratelimit.sqlite3")
+    from fake_openai import FakeOpenAI
+    from hedge import Hedger
+    from backend import _limiter
+    from rate_limit import LimitedClient
+
+    def parse(spec):
+        out = {}
+        for part in filter(None, spec.split(",")):
+            stage, _, rest = part.partition("=")
+            a, _, b = rest.partition(":")
+            out[stage] = (float(a), float(b))
+        return out
+
+    print(f"{'mode':<10}{'ok':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'hedges':>8}{'extra':>8}")
+    for mode in ("plain", "hedged"):
+        raw = FakeOpenAI(latency=parse(args.latency), stall=parse(args.stall), scale=args.scale, seed=1)
+        hedger = None
+        if mode == "hedged":
+            hedger = Hedger(percentile=args.percentile, budget=args.budget, min_samples=min(20, args.warmup))
+        client = LimitedClient(raw, _limiter(), hedger=hedger)
+        call = lambda: client.images.generate(model="dall-e-2", prompt="bench", n=1, size="256x256")
+        run_level(call, args.level, args.warmup)
+        before = len(raw.calls)
+        lat, errors, wall = run_level(call, args.level, args.calls)
+        time.sleep(max(s for _, s, _ in raw.calls))          # 捨てた 2 本目が終わるのを待つ
+        extra = len(raw.calls) - before - args.calls
+        print(f"{mode:<10}{len(lat):>6}{errors:>5}{percentile(lat, 50):>9.3f}{percentile(lat, 95):>9.3f}"
+              f"{percentile(lat, 99):>9.3f}{max(lat):>9.3f}{extra:>8}{extra / args.calls:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_imaging.py — 挿絵の取得と縮小を「これまで」と imaging.py で比べる
+# -------------------------------------------------------------
+# 1024px の PNG（DALL·E が返す形）と JPEG をローカルの HTTP サーバーから配り、
+#   before … Image.open(requests.get(url, stream=True).raw).resize(LANCZOS)
+#   after  … imaging.load_scaled(imaging.fetch(url))（共有セッション・draft / reduce）
+# の 1 枚あたりの時間を出す。取得を除いた縮小だけの時間（decode 行）も出す。
+#   python bench_imaging.py                     # 既定: 512px へ・各 20 回
+#   python bench_imaging.py --size 256 --repeat 50
+import argparse, io, statistics, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_images(px: int) -> dict:
+    """写真に近い重さになるよう、ノイズ入りの px×px 画像を PNG と JPEG で作る"""
+    from PIL import Image
+    img = Image.merge("RGB", [Image.effect_noise((px, px), sigma) for sigma in (32, 48, 64)])
+    out = {}
+    for fmt in ("PNG", "JPEG"):
+        buf = io.BytesIO()
+        img.save(buf, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+        out[fmt.lower()] = buf.getvalue()
+    return out
+
+
+def serve(images: dict) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = images[self.path.strip("/")]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(fn, repeat: int) -> list:
+    fn()                                        # 1 回目（接続・import）は数えない
+    out = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="挿絵の取得と縮小（これまで / imaging.py）")
+    ap.add_argument("--source", type=int, default=1024, help="元画像の一辺(px)")
+    ap.add_argument("--size", type=int, default=512, help="縮小後の一辺(px)（generate_book.IMG_SIZE）")
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    import requests
+    from PIL import Image
+    from imaging import fetch, load_scaled
+
+    images = make_images(args.source)
+    server = serve(images)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    size = (args.size, args.size)
+
+    def before(url):
+        return Image.open(requests.get(url, stream=True).raw).resize(size, Image.LANCZOS)
+
+    def after(url):
+        return load_scaled(fetch(url), args.size)
+
+    print(f"{'format':<8}{'case':<20}{'KB':>8}{'p50 ms':>10}{'mean ms':>10}{'x':>7}")
+    for fmt, data in images.items():
+        url = f"{base}/{fmt}"
+        cases = (("fetch+scale", lambda: before(url), lambda: after(url)),
+                 ("decode", lambda: Image.open(io.BytesIO(data)).resize(size, Image.LANCZOS),
+                  lambda: load_scaled(data, args.size)))
+        for case, old, new in cases:
+            base_p50 = None
+            for name, fn in (("before", old), ("after", new)):
+                lat = timed(fn, args.repeat)
+                p50 = statistics.median(lat)
+                base_p50 = base_p50 or p50
+                print(f"{fmt:<8}{case + ' ' + name:<20}{len(data) / 1024:>8.0f}{p50 * 1000:>10.1f}"
+                      f"{statistics.mean(lat) * 1000:>10.1f}{base_p50 / p50:>7.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
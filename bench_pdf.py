@@ -0,0 +1,117 @@
+# bench_pdf.py — PDF の大きさと書き出し時間を「これまで」と「JPEG 埋め込み」で比べる
+# -------------------------------------------------------------
+# output/ のサンプル絵本から挿絵（RGB の生データ）を取り出し、同じ絵・同じ本文で
+#   before … PIL 画像を ImageReader で渡す（RGB + Flate + ASCII85）
+#   after  … pdf_images の JPEG をパスで渡す（DCT のまま・同じ絵は 1 回）
+# の 2 通りに書き出して、ファイルサイズと所要時間を出す。
+#   python bench_pdf.py                       # output/*.pdf をすべて
+#   python bench_pdf.py --repeat 10 --quality 80 output/book_20250714_141936.pdf
+import argparse, base64, glob, io, os, re, statistics, sys, tempfile, textwrap, time, zlib
+
+SCENE = "むかしむかし、もりの おくに ちいさな ろぼっとが すんでいました。まいにち ともだちと あそびました。"
+IMAGE_RE = re.compile(rb"<<(?:(?!>>).)*?/Subtype /Image(?:(?!>>).)*>>\s*stream\r?\n", re.S)
+
+
+def extract_images(path: str):
+    """ReportLab が書いた PDF から RGB 画像を取り出す（ASCII85 / Flate のみ対応）"""
+    from PIL import Image
+    data = open(path, "rb").read()
+    for m in IMAGE_RE.finditer(data):
+        head = m.group()
+        length = int(re.search(rb"/Length (\d+)", head).group(1))
+        width = int(re.search(rb"/Width (\d+)", head).group(1))
+        height = int(re.search(rb"/Height (\d+)", head).group(1))
+        raw = data[m.end():m.end() + length]
+        if b"/ASCII85Decode" in head:
+            raw = base64.a85decode(re.sub(rb"\s", b"", raw).removesuffix(b"~>"))
+        if b"/FlateDecode" in head:
+            raw = zlib.decompress(raw)
+        if b"/DCTDecode" in head:
+            yield Image.open(io.BytesIO(raw)).convert("RGB")
+        else:
+            yield Image.frombytes("RGB", (width, height), raw)
+
+
+def render(outfile, title, images, draw):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen.canvas import Canvas
+    from generate_book import IMG_SIZE, MARGIN
+    canvas = Canvas(outfile, pagesize=A4)
+    W, H = A4
+    for idx, img in enumerate(images):
+        draw(canvas, img, MARGIN, H - IMG_SIZE - MARGIN, IMG_SIZE, IMG_SIZE)
+        if idx == 0:
+            canvas.setFont("JPFontB", 14)
+            canvas.drawString(MARGIN, H - IMG_SIZE - MARGIN - 20, f"『{title}』")
+        canvas.setFont("JPFontR", 11)
+        t = canvas.beginText(MARGIN, H - IMG_SIZE - MARGIN - 40)
+        t.textLines(textwrap.fill(SCENE, 38))
+        canvas.drawText(t)
+        canvas.showPage()
+    canvas.save()
+
+
+def measure(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="PDF の大きさと書き出し時間の比較")
+    ap.add_argument("books", nargs="*", help="サンプル PDF（既定: output/*.pdf）")
+    ap.add_argument("--repeat", type=int, default=5, help="1 冊あたりの書き出し回数（中央値を出す）")
+    ap.add_argument("--quality", type=int, help="JPEG 画質（既定: PDF_JPEG_QUALITY）")
+    args = ap.parse_args(argv)
+    if args.quality:
+        os.environ["PDF_JPEG_QUALITY"] = str(args.quality)
+
+    from reportlab import rl_config
+    from reportlab.lib.utils import ImageReader
+    from pdf_setup import ensure_fonts
+    ensure_fonts()
+    from pdf_images import PDF_JPEG_QUALITY, save_jpeg
+
+    books = args.books or sorted(glob.glob("output/*.pdf"))
+    if not books:
+        sys.exit("サンプル PDF がありません（output/*.pdf）")
+    tmp = tempfile.mkdtemp(prefix="pdfbench_")
+
+    def before(path):
+        rl_config.useA85 = 1
+        try:
+            render(path, "ベンチマーク", images, lambda c, img, *box: c.drawImage(ImageReader(img), *box))
+        finally:
+            rl_config.useA85 = 0
+
+    def after(path):
+        # JPEG への変換も時間に含める（実際は挿絵の保存時に 1 回だけ）
+        jpegs = [save_jpeg(img, os.path.join(tmp, f"p{i}.jpg")) for i, img in enumerate(images)]
+        render(path, "ベンチマーク", jpegs, lambda c, img, *box: c.drawImage(img, *box))
+
+    print(f"JPEG quality={PDF_JPEG_QUALITY}  repeat={args.repeat}")
+    print(f"{'book':<28}{'pages':>6}{'before MB':>11}{'after MB':>10}{'before s':>10}{'after s':>9}")
+    for book in books:
+        images = list(extract_images(book))
+        sizes, times = {}, {}
+        for name, fn in (("before", before), ("after", after)):
+            out = os.path.join(tmp, f"{name}.pdf")
+            times[name] = measure(lambda: fn(out), args.repeat)
+            sizes[name] = os.path.getsize(out)
+        print(f"{os.path.basename(book):<28}{len(images):>6}{sizes['before'] / 1e6:>11.2f}{sizes['after'] / 1e6:>10.2f}"
+              f"{times['before']:>10.3f}{times['after']:>9.3f}")
+
+        # 同じ絵が何度出ても 1 回だけ埋め込まれること
+        if images:
+            dup = os.path.join(tmp, "dup.pdf")
+            jpeg = save_jpeg(images[0], os.path.join(tmp, "dup.jpg"))
+            render(dup, "ベンチマーク", [jpeg] * len(images), lambda c, img, *box: c.drawImage(img, *box))
+            print(f"{'  └ same image × ' + str(len(images)):<28}{len(images):>6}{'':>11}"
+                  f"{os.path.getsize(dup) / 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
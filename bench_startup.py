@@ -0,0 +1,54 @@
+# bench_startup.py — ワーカー起動から最初の応答（GET /）までの時間を測る
+# -------------------------------------------------------------
+# 新しい Python プロセスで app を import し、test_client で「/」を 1 回返すまでを
+#   lazy    … 既定。重い import とフォント解析は使う時まで遅らせる
+#   preload … BOOK_PRELOAD=1。import 時に済ませる（gunicorn --preload の master 相当）
+# の 2 通りで繰り返し、中央値と、その時点で読み込まれていた重いモジュールを出す。
+#   python bench_startup.py --runs 10
+import argparse, json, os, statistics, subprocess, sys, tempfile
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+rsp = app.app.test_client().get("/")
+t2 = time.perf_counter()
+assert rsp.status_code == 200, rsp.status_code
+print(json.dumps({"import": t1 - t0, "first_response": t2 - t1,
+                  "heavy": [m for m in ("reportlab", "PIL", "openai", "requests") if m in sys.modules]}))
+"""
+
+
+def run(env: dict) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode != 0:
+        sys.exit(out.stderr)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ワーカー起動〜最初の応答までの時間")
+    ap.add_argument("--runs", type=int, default=5, help="モードごとの回数（中央値を出す）")
+    ap.add_argument("--backend", default="openai", help="BOOK_BACKEND（API は呼ばないので既定は openai）")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="startupbench_")
+    base = {**os.environ, "BOOK_BACKEND": args.backend, "BOOK_POOL": "0", "OPENAI_API_KEY": "sk-bench"}
+    for env, sub in (("STORY_CACHE_PATH", "stories.sqlite3"), ("IMAGE_CACHE_DIR", "images"),
+                     ("SINGLEFLIGHT_DIR", "locks"), ("BOOK_POOL_PATH", "pool.sqlite3"),
+                     ("ARTIFACT_DIR", "artifacts"), ("BOOK_RUNS_PATH", "runs.sqlite3"),
+                     ("RATE_LIMIT_PATH", "ratelimit.sqlite3")):
+        base[env] = os.path.join(tmp, sub)
+
+    print(f"{'mode':<10}{'import':>9}{'first /':>9}{'total':>9}  heavy modules loaded")
+    for mode, extra in (("lazy", {"BOOK_PRELOAD": "0"}), ("preload", {"BOOK_PRELOAD": "1"})):
+        results = [run({**base, **extra}) for _ in range(args.runs)]
+        imp = statistics.median(r["import"] for r in results)
+        first = statistics.median(r["first_response"] for r in results)
+        print(f"{mode:<10}{imp:>9.3f}{first:>9.3f}{imp + first:>9.3f}  {', '.join(results[-1]['heavy']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# book_pool.py — 作り置き絵本のプール（SQLite・再起動しても残る）
+# -------------------------------------------------------------
+# 入力の組み合わせは 6×2×4×5=240 通りしかないので、
+# 組み合わせごとに完成済みの絵本（ストーリー・挿絵・音声）を貯めておき、
+# リクエストが来たら 1 冊取り出して即返す。取り出した分は裏で補充する。
+# よく選ばれる組み合わせほどプールを深くする。
+#
+#   python book_pool.py --depth 1          # 全組み合わせを 1 冊ずつ作り置き
+#   python book_pool.py --hero ろぼっと     # 一部だけ
+import fcntl, itertools, json, os, sqlite3, sys, threading, time, traceback
+
+PARAM_KEYS = ("age", "gender", "hero", "theme")
+
+
+def combo_key(params) -> str:
+    return json.dumps([str(params[k]).strip() for k in PARAM_KEYS], ensure_ascii=False)
+
+
+class BookPool:
+    def __init__(self, path: str, base_depth: int = 1, max_depth: int = 5):
+        self.path = path
+        self.base_depth = base_depth
+        self.max_depth = max(max_depth, base_depth)     # 基本の深さより浅い上限は意味がない
+        self.wakeup = threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY, combo TEXT NOT NULL, body TEXT NOT NULL, created REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS books_combo ON books(combo)")
+            db.execute("CREATE TABLE IF NOT EXISTS demand (combo TEXT PRIMARY KEY, hits INTEGER NOT NULL)")
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    # ── リクエスト時：O(1) で 1 冊取り出す ──
+    def take(self, params, is_valid=lambda book: True) -> dict | None:
+        combo = combo_key(params)
+        db = self._db()
+        try:
+            db.execute("INSERT INTO demand(combo, hits) VALUES(?, 1) "
+                       "ON CONFLICT(combo) DO UPDATE SET hits = hits + 1", (combo,))
+            while True:
+                db.execute("BEGIN IMMEDIATE")
+                row = db.execute("SELECT id, body FROM books WHERE combo = ? LIMIT 1", (combo,)).fetchone()
+                if row:
+                    db.execute("DELETE FROM books WHERE id = ?", (row[0],))
+                db.execute("COMMIT")
+                if row is None:
+                    return None
+                book = json.loads(row[1])
+                if is_valid(book):          # 音声や画像が消えていたら捨てて次へ
+                    return book
+        finally:
+            db.close()
+            self.wakeup.set()
+
+    def add(self, params, book: dict):
+        with self._db() as db:
+            db.execute("INSERT INTO books(combo, body, created) VALUES(?, ?, ?)",
+                       (combo_key(params), json.dumps(book, ensure_ascii=False), time.time()))
+
+    # ── 補充計画：人気の組み合わせほど深く ──
+    def deficits(self, combos=None) -> list[tuple[dict, int]]:
+        with self._db() as db:
+            demand = dict(db.execute("SELECT combo, hits FROM demand").fetchall())
+            stock = dict(db.execute("SELECT combo, COUNT(*) FROM books GROUP BY combo").fetchall())
+        total = sum(demand.values())
+        if combos is None:
+            # 補充スレッドは、実際に選ばれたことのある組み合わせだけを見る
+            combos = [dict(zip(PARAM_KEYS, json.loads(c))) for c in demand]
+        plan = []
+        for params in combos:
+            combo = combo_key(params)
+            share = demand.get(combo, 0) / total if total else 0.0
+            depth = min(self.max_depth, self.base_depth + int(round(share * self.max_depth * 2)))
+            if depth > stock.get(combo, 0):
+                plan.append((params, depth - stock.get(combo, 0), demand.get(combo, 0)))
+        plan.sort(key=lambda p: -p[2])
+        return [(params, n) for params, n, _ in plan]
+
+    def fill(self, build, combos=None, log=print):
+        for params, n in self.deficits(combos):
+            for _ in range(n):
+                try:
+                    self.add(params, build(params))
+                    log(f"📚 pool +1 {combo_key(params)}")
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+
+    def start_refiller(self, build, interval: float = 30.0):
+        """プロセスをまたいで 1 本だけ補充スレッドを動かす（ロックが取れたワーカーが担当）"""
+        lock = open(self.path + ".refill.lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+
+        def loop():
+            while True:
+                self.fill(build, log=lambda m: print(m, file=sys.stderr))
+                self.wakeup.wait(interval)
+                self.wakeup.clear()
+
+        self._refill_lock = lock            # プロセスが生きている間ロックを持ち続ける
+        t = threading.Thread(target=loop, name="book-pool-refill", daemon=True)
+        t.start()
+        return t
+
+
+# ====== CLI：作り置き ======
+def main(argv=None):
+    import argparse
+    from app import FORM_CHOICES, book_pool, prefill_book
+
+    ap = argparse.ArgumentParser(description="絵本プールを事前に満たす")
+    ap.add_argument("--depth", type=int, default=None, help="組み合わせごとの冊数（既定: BOOK_POOL_BASE_DEPTH）")
+    for k in PARAM_KEYS:
+        ap.add_argument(f"--{k}", action="append", help=f"{k} を絞り込む（複数可）")
+    args = ap.parse_args(argv)
+
+    if args.depth is not None:
+        if args.depth < 0:
+            ap.error("--depth は 0 以上にしてください")
+        if args.depth > book_pool.max_depth:
+            print(f"ℹ️ --depth {args.depth} は BOOK_POOL_MAX_DEPTH={book_pool.max_depth} より深いので、上限も {args.depth} にします")
+            book_pool.max_depth = args.depth
+        book_pool.base_depth = args.depth
+    choices = [getattr(args, k) or FORM_CHOICES[k] for k in PARAM_KEYS]
+    combos = [dict(zip(PARAM_KEYS, c)) for c in itertools.product(*choices)]
+    print(f"=== 絵本プール作り置き: {len(combos)} 通り ===")
+    book_pool.fill(prefill_book, combos)
+    print("✅ 完了")
+
+
+if __name__ == "__main__":
+    main()
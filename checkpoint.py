@@ -0,0 +1,60 @@
+# checkpoint.py — 絵本 1 冊ごとの途中経過を保存し、失敗しても続きから作る
+# -------------------------------------------------------------
+# 1 冊 = 1 レコード（run_id）。工程が終わるたびに結果を書き足す。
+#   story     … ストーリー JSON
+#   images    … {シーン番号: 挿絵 URL}
+#   clips     … {シーン番号: 読み上げ音声 URL}
+#   audio_url … 全シーン続けて読む音声 URL
+# 3 枚目の挿絵で失敗しても、同じ run_id でやり直せば
+# ストーリー・音声・1〜2 枚目はそのまま使い、残りだけ作る。
+import json, os, sqlite3, time
+
+
+class RunStore:
+    def __init__(self, path: str, ttl: int = 7 * 86400):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY, body TEXT NOT NULL, updated REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS runs_updated ON runs(updated)")
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def load(self, run_id: str) -> dict | None:
+        db = self._db()
+        try:
+            row = db.execute("SELECT body FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        run = json.loads(row[0])
+        for name in ("images", "clips"):
+            run[name] = {int(k): v for k, v in run.get(name, {}).items()}
+        return run
+
+    def save(self, run_id: str, images: dict | None = None, clips: dict | None = None, **fields) -> dict:
+        """fields を上書きし、images・clips はシーン番号ごとに足し込む"""
+        now = time.time()
+        db = self._db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT body FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            run = json.loads(row[0]) if row else {"run_id": run_id, "images": {}, "status": "running"}
+            run.update(fields)
+            for name, new in (("images", images), ("clips", clips)):
+                for idx, url in (new or {}).items():
+                    run.setdefault(name, {})[str(idx)] = url
+            db.execute("INSERT OR REPLACE INTO runs(run_id, body, updated) VALUES(?, ?, ?)",
+                       (run_id, json.dumps(run, ensure_ascii=False), now))
+            db.execute("DELETE FROM runs WHERE updated < ?", (now - self.ttl,))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        for name in ("images", "clips"):
+            run[name] = {int(k): v for k, v in run.get(name, {}).items()}
+        return run
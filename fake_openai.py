@@ -0,0 +1,192 @@
+# fake_openai.py — オフライン用の OpenAI もどき（ベンチマーク・動作確認用）
+# -------------------------------------------------------------
+# BOOK_BACKEND=fake で app.py / generate_book.py / main.py がこれを使う。
+# 決まったストーリー JSON・単色 PNG・無音 MP3 を返し、
+# 待ち時間（対数正規分布）とエラー率を環境変数で調整できる。
+#
+#   FAKE_OPENAI_LATENCY="chat=1.5:0.4,image=8:0.5,tts=3:0.3"   # 中央値秒:σ
+#   FAKE_OPENAI_SCALE=0.05                                     # 全体を縮める
+#   FAKE_OPENAI_ERROR_RATE=0.02
+#   FAKE_OPENAI_429_RATE=0.1  FAKE_OPENAI_RETRY_AFTER=2              # 429 を混ぜる
+#   FAKE_OPENAI_STALL="image=0.05:8"   # 5% の回だけ 8 倍遅い（裾の重い遅延。確率:倍率）
+# AsyncFakeOpenAI は AsyncOpenAI と同じ呼び方（await / async for）で、待ちは asyncio.sleep。
+import asyncio, base64, json, math, os, random, struct, threading, time, zlib
+from types import SimpleNamespace
+
+DEFAULT_LATENCY = {"chat": (1.5, 0.4), "image": (8.0, 0.5), "tts": (3.0, 0.3)}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, message: str, status_code: int = 500, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def _png(width: int, height: int, rgb=(255, 228, 225)) -> bytes:
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height, 1))
+            + chunk(b"IEND", b""))
+
+
+# MPEG-1 Layer III 128kbps 44.1kHz の無音フレーム（1 フレーム 417 バイト ≒ 26ms）
+_SILENT_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+class _Speech:
+    def __init__(self, seconds: float):
+        self.content = _SILENT_FRAME * max(1, int(seconds / 0.026))
+
+    def stream_to_file(self, path):
+        with open(path, "wb") as fp:
+            fp.write(self.content)
+
+    def read(self):
+        return self.content
+
+
+class FakeOpenAI:
+    def __init__(self, latency=None, scale: float = 1.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float | None = None, seed=None,
+                 stall=None):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.stall = stall or {}          # stage → (確率, 倍率)
+        self.scale = scale
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = []                 # (stage, 秒, 成功したか)
+        self._lock = threading.Lock()
+        self._png_cache = {}
+        self._n = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.images = SimpleNamespace(generate=self._image)
+        self.audio = SimpleNamespace(speech=SimpleNamespace(create=self._speech))
+
+    @classmethod
+    def from_env(cls):
+        latency = {}
+        for part in filter(None, os.getenv("FAKE_OPENAI_LATENCY", "").split(",")):
+            stage, spec = part.split("=")
+            median, _, sigma = spec.partition(":")
+            latency[stage.strip()] = (float(median), float(sigma or 0))
+        stall = {}
+        for part in filter(None, os.getenv("FAKE_OPENAI_STALL", "").split(",")):
+            stage, spec = part.split("=")
+            prob, _, factor = spec.partition(":")
+            stall[stage.strip()] = (float(prob), float(factor or 10))
+        return cls(latency=latency, stall=stall,
+                   scale=float(os.getenv("FAKE_OPENAI_SCALE", "1")),
+                   error_rate=float(os.getenv("FAKE_OPENAI_ERROR_RATE", "0")),
+                   rate_limit_rate=float(os.getenv("FAKE_OPENAI_429_RATE", "0")),
+                   retry_after=float(os.environ["FAKE_OPENAI_RETRY_AFTER"]) if os.getenv("FAKE_OPENAI_RETRY_AFTER") else None)
+
+    # ── 共通：待ち時間とエラー ──
+    def _delay(self, stage: str) -> tuple[float, bool]:
+        median, sigma = self.latency[stage]
+        prob, factor = self.stall.get(stage, (0.0, 1.0))
+        with self._lock:
+            z = self.rng.gauss(0, 1)
+            fail = self.rng.random() < self.error_rate
+            stalled = self.rng.random() < prob
+        return median * math.exp(sigma * z) * (factor if stalled else 1) * self.scale, fail
+
+    def _rate_limited(self, stage: str):
+        with self._lock:
+            limited = self.rng.random() < self.rate_limit_rate
+        if limited:
+            # 本物と同じく、429 はすぐ返ってくる
+            with self._lock:
+                self.calls.append((stage, 0.0, False))
+            headers = {"retry-after": str(self.retry_after)} if self.retry_after is not None else {}
+            raise FakeAPIError(f"fake {stage} rate limited", 429, headers)
+
+    def _done(self, stage: str, seconds: float, fail: bool):
+        with self._lock:
+            self.calls.append((stage, seconds, not fail))
+        if fail:
+            raise FakeAPIError(f"fake {stage} error")
+
+    def _call(self, stage: str):
+        self._rate_limited(stage)
+        seconds, fail = self._delay(stage)
+        time.sleep(seconds)
+        self._done(stage, seconds, fail)
+
+    # ── chat.completions.create ──
+    def _story_text(self) -> str:
+        with self._lock:
+            self._n += 1
+            n = self._n
+        story = {"title": f"ふしぎな もりの ぼうけん #{n}",
+                 "story": [f"シーン{i + 1}：むかしむかし、げんきな しゅじんこうが いました。（{n}）" for i in range(5)]}
+        return json.dumps(story, ensure_ascii=False)
+
+    def _chat(self, model=None, messages=None, stream=False, **kwargs):
+        text = self._story_text()
+        if not stream:
+            self._call("chat")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+        return self._chat_stream(text)
+
+    def _chat_stream(self, text):
+        seconds, fail = self._delay("chat")
+        pieces = [text[i:i + 8] for i in range(0, len(text), 8)]
+        for piece in pieces:
+            time.sleep(seconds / len(pieces))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+        self._done("chat", seconds, fail)
+
+    # ── images.generate ──
+    def _image(self, model=None, prompt="", n=1, size="1024x1024", **kwargs):
+        self._call("image")
+        return self._image_result(size)
+
+    def _image_result(self, size: str):
+        with self._lock:
+            if size not in self._png_cache:
+                w, h = (int(v) for v in size.split("x"))
+                self._png_cache[size] = "data:image/png;base64," + base64.b64encode(_png(w, h)).decode()
+            url = self._png_cache[size]
+        return SimpleNamespace(data=[SimpleNamespace(url=url)])
+
+    # ── audio.speech.create ──
+    def _speech(self, model=None, voice=None, input="", **kwargs):
+        self._call("tts")
+        return _Speech(len(input) * 0.15)
+
+
+class AsyncFakeOpenAI(FakeOpenAI):
+    async def _call(self, stage: str):
+        self._rate_limited(stage)
+        seconds, fail = self._delay(stage)
+        await asyncio.sleep(seconds)
+        self._done(stage, seconds, fail)
+
+    async def _chat(self, model=None, messages=None, stream=False, **kwargs):
+        text = self._story_text()
+        if not stream:
+            await self._call("chat")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+        return self._chat_stream(text)
+
+    async def _chat_stream(self, text):
+        seconds, fail = self._delay("chat")
+        pieces = [text[i:i + 8] for i in range(0, len(text), 8)]
+        for piece in pieces:
+            await asyncio.sleep(seconds / len(pieces))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+        self._done("chat", seconds, fail)
+
+    async def _image(self, model=None, prompt="", n=1, size="1024x1024", **kwargs):
+        await self._call("image")
+        return self._image_result(size)
+
+    async def _speech(self, model=None, voice=None, input="", **kwargs):
+        await self._call("tts")
+        return _Speech(len(input) * 0.15)
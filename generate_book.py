@@ -1,16 +1,22 @@
-import os, io, json, datetime, textwrap, requests
+import os, io, csv, json, datetime, textwrap, argparse, shutil, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
+from backend import make_client
+from story_stream import consume_stream
+from story_repair import complete_story
+from imaging import fetch_scaled
+from render_profiles import RENDER_PROFILES, DEFAULT_PROFILE, get_profile, image_kwargs
+from metrics import stage, traced, submit
+from pdf_images import pdf_pixels, save_jpeg
+from pdf_setup import ensure_fonts
+from scheduler import set_default_class
 from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen.canvas import Canvas
-from reportlab.lib.utils import ImageReader
 
 # ─────────────────────────
 # 0) 初期化
 # ─────────────────────────
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = make_client()   # BOOK_BACKEND=fake でオフライン
 
 IMG_SIZE = 512            # 画像を PDF に貼るサイズ(px)
 MARGIN   = 40             # 余白 (pt)
@@ -36,7 +42,8 @@ def choose(label, options):
 # ─────────────────────────
 # 2) ストーリー生成
 # ─────────────────────────
-def generate_story(age, gender, hero, theme, max_tokens=700):
+def generate_story(age, gender, hero, theme, max_tokens=700, on_scene=None):
+    """on_scene を渡すとストリーミングで受け取り、シーンが書き終わるたびに on_scene(i, text) を呼ぶ"""
     prompt = f"""
 あなたは幼児向け児童文学作家です。
 # 条件
@@ -51,115 +58,286 @@ def generate_story(age, gender, hero, theme, max_tokens=700):
 # 出力形式（JSON）
 {{"title":"タイトル","story":["シーン1","シーン2","シーン3","シーン4","シーン5"]}}
 """
-    rsp = client.chat.completions.create(
+    kwargs = dict(
         model="gpt-4o-mini",
         messages=[{"role": "system", "content": prompt}],
         max_tokens=max_tokens,
         temperature=0.8,
         response_format={"type": "json_object"},
     )
-    try:
-        return json.loads(rsp.choices[0].message.content)
-    except json.JSONDecodeError:
-        # ★ 1 回だけトークン数を増やしてリトライ
-        if max_tokens < 900:
-            return generate_story(age, gender, hero, theme, max_tokens=max_tokens+200)
-        raise                    # それでも失敗したら例外を投げる
+    with stage("chat"):
+        rsp = client.chat.completions.create(stream=on_scene is not None, **kwargs)
+        text = consume_stream(rsp, on_scene=on_scene) if on_scene is not None else rsp.choices[0].message.content
+    # ★ 壊れた JSON は作り直さずに修復し、足りないシーンだけ続きを書いてもらう
+    return complete_story(client, text, 5, kwargs)
 
 
 # ─────────────────────────
 # 3) 画像生成
 # ─────────────────────────
-def generate_image(scene):
+def generate_image(scene, profile=None):
+    prof = get_profile(profile)
     dalle_prompt = (
         f"Children's picture-book illustration, {scene[:80]}, "
         "colorful, whimsical, storybook style"
     )
-    rsp = client.images.generate(
-        model="dall-e-3",
-        prompt=dalle_prompt,
-        n=1,
-        size="1024x1024",
-    )
+    with stage("image"):
+        rsp = client.images.generate(
+            prompt=dalle_prompt,
+            n=1,
+            **image_kwargs(prof),
+        )
     url = rsp.data[0].url
-    img = Image.open(requests.get(url, stream=True).raw)
-    return img.resize((IMG_SIZE, IMG_SIZE), Image.LANCZOS)
+    with stage("image_download"):
+        return fetch_scaled(url, pdf_pixels(prof["pixels"], IMG_SIZE))
 
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-# …（省略）…
-# ↑ 既存 import に追記
-# フォント登録 ── ここを 1 行にする
-pdfmetrics.registerFont(TTFont("JPFont", "fonts/NotoSansJP-Bold.ttf"))
+# ─────────────────────────
+# 4) PDF 組版（画像の直下に本文）
+# ─────────────────────────
+def save_pdf(title, scenes, images, outfile):
+    """images は JPEG ファイルのパス（JPEG のまま埋め込み、同じパスは 1 回だけ入る）"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen.canvas import Canvas
+    ensure_fonts("JPFontR", "JPFontB")      # 初回だけ解析・登録
+    with stage("pdf_render"):
+        canvas = Canvas(outfile, pagesize=A4)
+        W, H = A4
 
+        for idx, scene in enumerate(scenes):
+            img_y = H - IMG_SIZE - MARGIN
+            canvas.drawImage(images[idx], MARGIN, img_y, IMG_SIZE, IMG_SIZE)
 
+            # タイトル
+            if idx == 0:
+                canvas.setFont("JPFontB", 14)     # ← 変更
+                canvas.drawString(MARGIN, img_y - 20, f"『{title}』")
 
-# ── ★ ここを新規追加 ─────────────────
-# フォントファイルのパス（例：MS ゴシック）
-FONT_PATH = "fonts/NotoSansJP-Bold.ttf"   # ★ 太字フォントを直接指定
-# もし NotoSans を使うなら → FONT_PATH = "fonts/NotoSansJP-Regular.otf"
+            # 本文
+            canvas.setFont("JPFontR", 11)        # ← 変更
+            text_start_y = img_y - 40 if idx == 0 else img_y - 20
+            wrapped = textwrap.fill(scene, 38)   # 行幅を少し短く
+            text_obj = canvas.beginText(MARGIN, text_start_y)
+            for line in wrapped.split("\n"):
+                text_obj.textLine(line)
+            canvas.drawText(text_obj)
 
-# フォント登録
-pdfmetrics.registerFont(TTFont("JPFontR", "fonts/NotoSansJP-Regular.ttf"))
-pdfmetrics.registerFont(TTFont("JPFontB", "fonts/NotoSansJP-Bold.ttf"))
+            canvas.showPage()
+        canvas.save()
 
-# ────────────────────────────────
 
 # ─────────────────────────
-# 4) PDF 組版（画像の直下に本文）
+# 5) 途中経過の保存（output/runs/<run_id>/ に工程ごとに書く）
 # ─────────────────────────
-def save_pdf(title, scenes, images, outfile):
-    canvas = Canvas(outfile, pagesize=A4)
-    W, H = A4
+RUNS_DIR = "output/runs"
+
+def run_path(run_id, name):
+    return os.path.join(RUNS_DIR, run_id, name)
+
+def save_json(path, data):
+    with open(path + ".part", "w", encoding="utf-8") as fp:
+        json.dump(data, fp, ensure_ascii=False)
+    os.replace(path + ".part", path)
+
+def load_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+# ─────────────────────────
+# 6) 1 冊ぶんの工程（対話モード・バッチモード共通）
+# ─────────────────────────
+def make_book(run_id, params, pdf_path, log=print):
+    """output/runs/<run_id>/ の途中経過を使いながら 1 冊作り、PDF を pdf_path に書く"""
+    # 挿絵は PDF にそのまま貼れる JPEG で保存し、メモリには持たない
+    def draw(i, scene):
+        with generate_image(scene, params["profile"]) as img:
+            return save_jpeg(img, run_path(run_id, f"scene_{i}.jpg"))
+
+    def saved_image(i):
+        path = run_path(run_id, f"scene_{i}.jpg")
+        legacy = run_path(run_id, f"scene_{i}.png")     # 以前の途中経過は PNG
+        if not os.path.exists(path) and os.path.exists(legacy):
+            with Image.open(legacy) as img:
+                save_jpeg(img, path)
+        return path if os.path.exists(path) else None
 
-    for idx, scene in enumerate(scenes):
-        img_reader = ImageReader(images[idx])
-        img_y = H - IMG_SIZE - MARGIN
-        canvas.drawImage(img_reader, MARGIN, img_y, IMG_SIZE, IMG_SIZE)
+    # 工程ごとの所要時間は最後に JSON 1 行で stderr に出る
+    with traced("generate_book", profile=params["profile"], run_id=run_id):
+        # シーンが書き上がった順に挿絵の生成を始める
+        with ThreadPoolExecutor(max_workers=5) as ex:
+            img_futs = {}
+            def on_scene(i, scene):
+                # 6 こ目以降は修復で 5 こ目にまとめられるので、挿絵は作らない
+                if i >= 5:
+                    return
+                if i not in img_futs and saved_image(i) is None:
+                    img_futs[i] = submit(ex, draw, i, scene)
 
-        # タイトル
-        if idx == 0:
-            canvas.setFont("JPFontB", 14)     # ← 変更
-            canvas.drawString(MARGIN, img_y - 20, f"『{title}』")
+            story = load_json(run_path(run_id, "story.json"))
+            if story is None:
+                story = generate_story(params["age"], params["gender"], params["hero"], params["theme"],
+                                       on_scene=on_scene)
+                save_json(run_path(run_id, "story.json"), story)
+            # 保存済みのストーリーや、修復で書き足されたシーンの挿絵もここで回す
+            for i, scene in enumerate(story["story"]):
+                on_scene(i, scene)
+            title, scenes = story["title"], story["story"]
+            log(f"\n📖 ストーリー生成完了: {title}")
 
-        # 本文
-        canvas.setFont("JPFontR", 11)        # ← 変更
-        text_start_y = img_y - 40 if idx == 0 else img_y - 20
-        wrapped = textwrap.fill(scene, 38)   # 行幅を少し短く
-        text_obj = canvas.beginText(MARGIN, text_start_y)
-        for line in wrapped.split("\n"):
-            text_obj.textLine(line)
-        canvas.drawText(text_obj)
+            images = [img_futs[i].result() if i in img_futs else saved_image(i) for i in range(len(scenes))]
+        log("🖼️  画像生成完了")
 
-        canvas.showPage()
-    canvas.save()
+        os.makedirs(os.path.dirname(pdf_path) or ".", exist_ok=True)
+        save_pdf(title, scenes, images, pdf_path + ".part")
+        os.replace(pdf_path + ".part", pdf_path)
+    return {"title": title, "pages": len(scenes)}
 
 
 # ─────────────────────────
-# 5) メインフロー
+# 7) バッチモード（CSV / JSONL の行ごとに count 冊）
+# ─────────────────────────
+#   age,gender,hero,theme,count
+#   4,おんなのこ,ロボット,友情,30
+# 結果は output/batch_<ファイル名>/ に PDF と manifest.jsonl（1 冊 1 行・できた順）。
+# 同じファイルでもう一度動かすと、manifest で成功済みの冊は飛ばし、
+# 失敗した冊は output/runs/ の途中経過から続きを作る。
+BATCH_FIELDS = ("age", "gender", "hero", "theme")
+
+def read_batch(path):
+    """(run_id, params) を 1 冊ずつ返す"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8-sig", newline="") as fp:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in fp if line.strip()]
+        else:
+            rows = list(csv.DictReader(fp))
+    books = []
+    for n, row in enumerate(rows, 1):
+        missing = [k for k in BATCH_FIELDS if row.get(k) is None or not str(row[k]).strip()]
+        if missing:
+            raise SystemExit(f"⚠️ {path} の {n} 行目に {', '.join(missing)} がありません")
+        params = {k: str(row[k]).strip() for k in BATCH_FIELDS}
+        params["profile"] = row.get("profile") or DEFAULT_PROFILE
+        try:
+            get_profile(params["profile"])
+        except ValueError as e:
+            raise SystemExit(f"⚠️ {path} の {n} 行目: {e}")
+        for k in range(int(row.get("count") or 1)):
+            books.append((f"batch_{stem}_{n:04d}_{k:03d}", params))
+    return books
+
+def run_batch(path, workers, profile=None):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    out_dir = os.path.join("output", f"batch_{stem}")
+    manifest = os.path.join(out_dir, "manifest.jsonl")
+    os.makedirs(out_dir, exist_ok=True)
+
+    books = read_batch(path)
+    if profile:
+        books = [(run_id, {**params, "profile": profile}) for run_id, params in books]
+    done = set()
+    if os.path.exists(manifest):
+        with open(manifest, encoding="utf-8") as fp:
+            done = {rec["run_id"] for rec in map(json.loads, filter(str.strip, fp)) if rec["ok"]}
+    todo = [(run_id, params) for run_id, params in books if run_id not in done]
+    print(f"=== バッチ {path}: {len(books)} 冊（済 {len(done)} / 残り {len(todo)}）・同時 {workers} 冊 ===")
+
+    lock = threading.Lock()
+    stats = {"ok": 0, "error": 0, "pages": 0}
+    t0 = time.monotonic()
+
+    def progress():
+        n = stats["ok"] + stats["error"]
+        elapsed = time.monotonic() - t0
+        rate = stats["ok"] / elapsed * 60 if elapsed else 0
+        eta = (len(todo) - n) / (n / elapsed) if n else 0
+        print(f"\r📚 {n}/{len(todo)}  ✅ {stats['ok']}  ❌ {stats['error']}  "
+              f"{rate:.1f} 冊/分  のこり {eta / 60:.0f} 分 ", end="", flush=True)
+
+    def one(run_id, params):
+        os.makedirs(os.path.join(RUNS_DIR, run_id), exist_ok=True)
+        save_json(run_path(run_id, "params.json"), params)
+        pdf_path = os.path.join(out_dir, f"book_{run_id}.pdf")
+        t = time.monotonic()
+        rec = {"run_id": run_id, "params": params, "pdf": pdf_path}
+        try:
+            rec.update(make_book(run_id, params, pdf_path, log=lambda *a, **kw: None), ok=True)
+            shutil.rmtree(os.path.join(RUNS_DIR, run_id), ignore_errors=True)   # PDF ができたら途中経過は不要
+        except Exception as e:
+            rec.update(ok=False, error=f"{type(e).__name__}: {e}")
+        rec["seconds"] = round(time.monotonic() - t, 2)
+        with lock:
+            with open(manifest, "a", encoding="utf-8") as fp:
+                fp.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            stats["ok" if rec["ok"] else "error"] += 1
+            stats["pages"] += rec.get("pages", 0)
+            progress()
+
+    # 同時に作るのは workers 冊まで（挿絵はメモリに持たないので、冊数が増えてもメモリは一定）。
+    # API のレート制限は backend の LimitedClient が全スレッドで共有して守る
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as ex:
+        for _ in ex.map(lambda b: one(*b), todo):
+            pass
+
+    elapsed = time.monotonic() - t0
+    print(f"\n\n=== 完了: ✅ {stats['ok']} 冊  ❌ {stats['error']} 冊  {stats['pages']} ページ  "
+          f"{elapsed / 60:.1f} 分（{stats['ok'] / elapsed * 3600 if elapsed else 0:.0f} 冊/時） ===")
+    print(f"📄 manifest → {manifest}")
+    if stats["error"]:
+        print("❌ 失敗した冊は、同じコマンドをもう一度動かすと続きから作ります")
+    return stats
+
+
+# ─────────────────────────
+# 8) メインフロー
 # ─────────────────────────
 def main():
-    print("=== AI えほんジェネレーター (PDF) ===")
+    ap = argparse.ArgumentParser(description="AI えほんジェネレーター (PDF)")
+    ap.add_argument("--profile", choices=list(RENDER_PROFILES), default=None,
+                    help=f"挿絵の生成プロファイル（fast / standard / print、既定: {DEFAULT_PROFILE}）")
+    ap.add_argument("--resume", metavar="RUN_ID", help="途中で止まった絵本を続きから作る")
+    ap.add_argument("--batch", metavar="FILE", help="CSV / JSONL の条件でまとめて作る（age,gender,hero,theme,count）")
+    ap.add_argument("--workers", type=int, default=4, help="バッチで同時に作る冊数")
+    args = ap.parse_args()
 
-    age    = choose("対象年齢", AGES)
-    gender = choose("性別", GENDERS)
-    hero   = choose("主人公", HEROES)
-    theme  = choose("テーマ", THEMES)
+    # Web で待っている人を優先させるため、このプロセスの API 呼び出しは batch クラスで順番を待つ
+    set_default_class("batch")
+    if os.getenv("BOOK_SCHEDULER", "local") != "socket":
+        # プロセス内の順番待ちでは、別プロセスの Web に枠を譲れない（scheduler.py 参照）
+        print("⚠️ BOOK_SCHEDULER=socket ではないので、Web の注文より後回しにはなりません"
+              "（python scheduler.py serve を動かし、Web とこちらを BOOK_SCHEDULER=socket に）")
+    if args.batch:
+        stats = run_batch(args.batch, args.workers, args.profile)
+        raise SystemExit(1 if stats["error"] else 0)
 
-    story = generate_story(age, gender, hero, theme)
-    title, scenes = story["title"], story["story"]
-    print(f"\n📖 ストーリー生成完了: {title}")
+    print("=== AI えほんジェネレーター (PDF) ===")
 
-    images = [generate_image(s) for s in scenes]
-    print("🖼️  画像生成完了")
+    if args.resume:
+        run_id = args.resume
+        params = load_json(run_path(run_id, "params.json"))
+        if params is None:
+            raise SystemExit(f"⚠️ {run_id} の途中経過が見つかりません")
+        print(f"↩️  {run_id} を続きから作ります")
+    else:
+        run_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        params = {
+            "age":     choose("対象年齢", AGES),
+            "gender":  choose("性別", GENDERS),
+            "hero":    choose("主人公", HEROES),
+            "theme":   choose("テーマ", THEMES),
+            "profile": args.profile or DEFAULT_PROFILE,
+        }
+        os.makedirs(os.path.join(RUNS_DIR, run_id), exist_ok=True)
+        save_json(run_path(run_id, "params.json"), params)
 
-    os.makedirs("output", exist_ok=True)
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    pdf_path = f"output/book_{ts}.pdf"
-    save_pdf(title, scenes, images, pdf_path)
+    pdf_path = f"output/book_{run_id}.pdf"
+    try:
+        make_book(run_id, params, pdf_path)
+    except Exception:
+        print(f"\n❌ とちゅうで失敗しました。続きから: python generate_book.py --resume {run_id}")
+        raise
     print(f"\n✅ PDF 保存 → {pdf_path}")
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+# hedge.py — 挿絵 API の「保険の 2 本目」（ヘッジリクエスト）
+# -------------------------------------------------------------
+# 画像生成はたまに極端に遅い回があり、1 冊 3〜5 枚のうち一番遅い 1 枚で
+# 本の待ち時間が決まってしまう。そこで
+# ・モデルごとに最近の所要時間（直近 window 回）を覚えておき
+# ・その percentile を過ぎても返ってこない呼び出しには、同じ注文をもう 1 本出す
+# ・先に返った方を使い、残りは捨てる（async 版はキャンセルする）
+# ・2 本目は 1 分あたり budget 本まで（それ以上は待つだけ）
+# ヘッジするのは API そのものへの 1 回の呼び出しだけ（rate_limit.LimitedClient の内側）。
+# 順番待ち・レート制限の待ち・429 のバックオフは所要時間に入れず、2 本目のきっかけにもしない。
+# 2 本目はレート制限の枠がすぐ取れる時だけ出す（枠が空くのを待ってまでは出さない）。
+#   IMAGE_HEDGE=1（既定 0 = 使わない）  IMAGE_HEDGE_PERCENTILE=90
+#   IMAGE_HEDGE_BUDGET=20（本/分）  IMAGE_HEDGE_WINDOW=200  IMAGE_HEDGE_MIN_SAMPLES=20
+# ※ 記録も予算もプロセスごと。
+import asyncio, math, os, threading, time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import metrics
+
+
+class LatencyWindow:
+    """モデルごとの直近 window 回の所要時間"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model: str, p: float) -> float | None:
+        """まだ min_samples 回に満たなければ None"""
+        with self._lock:
+            values = sorted(self._samples.get(model, ()))
+        if len(values) < self.min_samples:
+            return None
+        return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Hedger:
+    def __init__(self, percentile: float = 90, budget: int = 20, window: int = 200,
+                 min_samples: int = 20, threads: int = 64):
+        self.p = percentile
+        self.budget = budget                  # 2 本目を出してよい本数 / 分
+        self.latency = LatencyWindow(window, min_samples)
+        self._spent = deque()                 # 2 本目を出した時刻
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="hedge")
+
+    @classmethod
+    def from_env(cls):
+        return cls(percentile=float(os.getenv("IMAGE_HEDGE_PERCENTILE", "90")),
+                   budget=int(os.getenv("IMAGE_HEDGE_BUDGET", "20")),
+                   window=int(os.getenv("IMAGE_HEDGE_WINDOW", "200")),
+                   min_samples=int(os.getenv("IMAGE_HEDGE_MIN_SAMPLES", "20")))
+
+    def delay(self, model: str) -> float | None:
+        """この秒数を過ぎたら 2 本目を出す（None なら出さない）"""
+        if self.budget <= 0:
+            return None
+        d = self.latency.percentile(model, self.p)
+        if d is not None:
+            metrics.set_gauge("book_image_hedge_delay_seconds", round(d, 3),
+                              help="Latency after which an image call is hedged.", model=model)
+        return d
+
+    def _spend(self, model: str) -> float | None:
+        """予算から 1 本使う（使った時刻を返す）。もう無ければ None"""
+        now = time.monotonic()
+        with self._lock:
+            while self._spent and self._spent[0] <= now - 60:
+                self._spent.popleft()
+            if len(self._spent) >= self.budget:
+                self._count(model, "no_budget")
+                return None
+            self._spent.append(now)
+        return now
+
+    def _refund(self, spent: float):
+        with self._lock:
+            try:
+                self._spent.remove(spent)
+            except ValueError:
+                pass
+
+    def _count(self, model: str, result: str):
+        metrics.inc("book_image_hedges_total", help="Hedged image calls by outcome.", model=model, result=result)
+
+    def _timed(self, model: str, fn):
+        t = time.perf_counter()
+        result = fn()
+        self.latency.record(model, time.perf_counter() - t)
+        return result
+
+    async def _atimed(self, model: str, fn):
+        t = time.perf_counter()
+        result = await fn()
+        self.latency.record(model, time.perf_counter() - t)
+        return result
+
+    def _may_hedge(self, model: str, quota) -> bool:
+        spent = self._spend(model)
+        if spent is None:
+            return False
+        if quota is not None and not quota():
+            self._refund(spent)
+            self._count(model, "no_quota")
+            return False
+        return True
+
+    def call(self, model: str, fn, quota=None):
+        """fn() を呼ぶ。遅ければ 2 本目を出し、先に成功した方を返す。
+        quota() が False なら 2 本目は出さない（レート制限の枠がすぐ取れない時）"""
+        d = self.delay(model)
+        if d is None:
+            return self._timed(model, fn)
+        first = metrics.submit(self._pool, self._timed, model, fn)
+        done, _ = wait([first], timeout=d)
+        if done or not self._may_hedge(model, quota):
+            return first.result()
+        second = metrics.submit(self._pool, self._timed, model, fn)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    # 負けた方はスレッドで最後まで走るが、結果は捨てる（所要時間は記録に入る）
+                    self._count(model, "won" if fut is second else "lost")
+                    return fut.result()
+                error = error or fut.exception()
+        raise error
+
+    async def acall(self, model: str, fn, quota=None):
+        """call の async 版（fn() はコルーチンを返す）。負けた方はキャンセルする。
+        quota は同期関数のまま渡す（スレッドで呼ぶ）"""
+        d = self.delay(model)
+        if d is None:
+            return await self._atimed(model, fn)
+        first = asyncio.ensure_future(self._atimed(model, fn))
+        done, _ = await asyncio.wait({first}, timeout=d)
+        if done or not await asyncio.to_thread(self._may_hedge, model, quota):
+            return await first
+        second = asyncio.ensure_future(self._atimed(model, fn))
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._count(model, "won" if task is second else "lost")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in (first, second):
+                task.cancel()
+
@@ -0,0 +1,102 @@
+# image_store.py — 生成した挿絵のディスクキャッシュ（LRU・容量上限つき）
+# -------------------------------------------------------------
+# DALL·E の URL はしばらくすると切れるので、1 回だけダウンロードして
+# プロンプトのハッシュ名で JPEG 保存し、以後はローカルから配る。
+# 書き込みは一時ファイル → os.replace なので、複数ワーカーが同時に
+# 同じ画像を書いても壊れたファイルは見えない。
+# Pillow・requests は初めて書き込む時に読み込む（配るだけなら不要）。
+# 合計サイズは「最後に数えた値 + その後このプロセスで書いた分」で見積もり、
+# 上限を超えそうな時か scan_interval 秒ごとにだけ全シャードを数え直す
+# （書き込みのたびに全ファイルを stat しない。他のワーカーの書き込み・派生ファイルは数え直しで拾う）。
+import fcntl, hashlib, io, os, tempfile, threading, time
+
+
+class ImageStore:
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 ** 3, quality: int = 88,
+                 scan_interval: float = 300):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.scan_interval = scan_interval
+        self._total = None                  # 見積もりの合計サイズ（None = まだ数えていない）
+        self._scanned = 0.0                 # 最後に数えた時刻（monotonic）
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(prompt: str, model: str, size: str) -> str:
+        return hashlib.sha256(f"{model}\n{size}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".jpg")
+
+    def variant_path(self, key: str, tag: str) -> str:
+        """同じ挿絵を縮めたものなど、派生ファイルの置き場（LRU の対象に入る）"""
+        return os.path.join(self.root, key[:2], f"{key}_{tag}.jpg")
+
+    def get(self, key: str) -> str | None:
+        """あればパスを返し、最終アクセス時刻（mtime）を更新する"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as fp:
+                    img.save(fp, "JPEG", quality=self.quality, optimize=True)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        self._grow(os.path.getsize(path))
+        return path
+
+    def put_url(self, key: str, url: str) -> str:
+        from imaging import fetch
+        return self.put_bytes(key, fetch(url))
+
+    def _grow(self, size: int):
+        """書いた分を見積もりに足し、上限を超えたか数え直しの時期なら evict する"""
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+            due = (self._total is None or self._total > self.max_bytes
+                   or time.monotonic() - self._scanned > self.scan_interval)
+        if due:
+            self.evict()
+
+    def evict(self):
+        """全シャードを数え直し、合計サイズが上限を超えていたら、古く使われたものから消す"""
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return                      # 他のワーカーが掃除中
+            files, total = [], 0
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".jpg"):
+                        st = entry.stat()
+                        files.append((st.st_mtime, st.st_size, entry.path))
+                        total += st.st_size
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            with self._lock:
+                self._total, self._scanned = total, time.monotonic()
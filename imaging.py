@@ -0,0 +1,80 @@
+# imaging.py — 画像ダウンロード（接続プール）と高速縮小
+# -------------------------------------------------------------
+# ・requests.Session を全体で 1 つ共有し、TLS 接続を使い回す
+#   （タイムアウト・リトライ付き）
+# ・JPEG は draft() でデコード時に 1/2・1/4… に縮め、
+#   PNG は reduce() で整数倍に縮めてから、端数だけ LANCZOS で合わせる
+# ・デコードと縮小は専用スレッドプールで実行。Pillow は処理中に GIL を
+#   手放すので、同時リクエストの縮小が 1 本の GIL で直列化されない
+import base64, io, os
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image
+
+TIMEOUT = (5, 60)   # (接続, 読み込み) 秒
+
+http = requests.Session()
+http.mount("https://", HTTPAdapter(
+    pool_connections=8, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=("GET",)),
+))
+
+decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="img-decode")
+
+
+def fetch(url: str) -> bytes:
+    if url.startswith("data:"):                 # fake バックエンドは data: URL を返す
+        return base64.b64decode(url.split(",", 1)[1])
+    with http.get(url, stream=True, timeout=TIMEOUT) as rsp:
+        rsp.raise_for_status()
+        return b"".join(rsp.iter_content(64 * 1024))
+
+
+_ahttp = None
+
+
+def _async_http():
+    """app_async 用の httpx.AsyncClient（接続プールを全リクエストで共有）"""
+    global _ahttp
+    if _ahttp is None:
+        import httpx
+        _ahttp = httpx.AsyncClient(timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+                                   limits=httpx.Limits(max_connections=256, max_keepalive_connections=64),
+                                   transport=httpx.AsyncHTTPTransport(retries=3))
+    return _ahttp
+
+
+async def afetch(url: str) -> bytes:
+    """fetch の async 版"""
+    if url.startswith("data:"):
+        return base64.b64decode(url.split(",", 1)[1])
+    rsp = await _async_http().get(url)
+    rsp.raise_for_status()
+    return rsp.content
+
+
+def load_scaled(data: bytes, size: int) -> Image.Image:
+    """size×size の RGB 画像にして返す（できるだけデコード段階で縮める）"""
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG":
+        img.draft("RGB", (size, size))
+    img = img.convert("RGB")
+    factor = min(img.width, img.height) // size
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != (size, size):
+        img = img.resize((size, size), Image.LANCZOS)
+    return img
+
+
+def fetch_scaled(url: str, size: int) -> Image.Image:
+    return decode_pool.submit(load_scaled, fetch(url), size).result()
+
+
+def open_scaled(path: str, size: int) -> Image.Image:
+    with open(path, "rb") as fp:
+        data = fp.read()
+    return decode_pool.submit(load_scaled, data, size).result()
@@ -0,0 +1,190 @@
+# job_queue.py — 絵本ジョブの待ち行列（SQLite・ブローカー不要・再起動しても残る）
+# -------------------------------------------------------------
+# Web（app.py）は積むだけ、作るのは worker.py のワーカープロセス。
+# ・claim したジョブは visibility 秒のあいだ他のワーカーから見えない。
+#   作業中は heartbeat で延長し、ワーカーが落ちて延長が止まれば別のワーカーが拾い直す
+# ・失敗したら待ってから積み直す（2 回目以降は倍々）。max_attempts 回でだめなら dead
+#   （dead-letter。python job_queue.py dead / requeue <id> で確認・積み直し）
+# ・途中経過（title・pages・audio_url）は progress に書き、Web はそれを読んで返す
+# 同じ job_id で積み直すと、checkpoint の途中経過を使って続きから作る。
+#   設定（app.py）: BOOK_QUEUE_PATH=cache/jobs.sqlite3  BOOK_QUEUE_VISIBILITY=120  BOOK_QUEUE_ATTEMPTS=3
+import json, os, sqlite3, time, uuid
+
+
+class JobQueue:
+    def __init__(self, path: str, visibility: float = 120, max_attempts: int = 3,
+                 retry_delay: float = 5, ttl: int = 86400):
+        self.path = path
+        self.visibility = visibility
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.ttl = ttl                          # done・dead を残す秒数
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, body TEXT NOT NULL, state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0, visible_at REAL NOT NULL, worker TEXT,
+                progress TEXT, result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(state, visible_at)")
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    # ── Web 側 ──
+    def enqueue(self, params: dict, job_id: str | None = None, degrade=()) -> str:
+        """積んで job_id を返す。既存の job_id でも、done・dead なら積み直す（続きから作る）。
+        queued・running ならそのまま（同じ冊を 2 つのワーカーで作らない）"""
+        now = time.time()
+        job_id = job_id or uuid.uuid4().hex
+        body = json.dumps({"params": dict(params), "degrade": list(degrade)}, ensure_ascii=False)
+        db = self._db()
+        try:
+            db.execute("INSERT INTO jobs(id, body, state, attempts, visible_at, created, updated) "
+                       "VALUES(?, ?, 'queued', 0, ?, ?, ?) "
+                       "ON CONFLICT(id) DO UPDATE SET body = excluded.body, state = 'queued', attempts = 0, "
+                       "visible_at = excluded.visible_at, worker = NULL, progress = NULL, result = NULL, "
+                       "error = NULL, updated = excluded.updated WHERE jobs.state IN ('done', 'dead')",
+                       (job_id, body, now, now, now))
+            db.execute("DELETE FROM jobs WHERE state IN ('done', 'dead') AND updated < ?", (now - self.ttl,))
+        finally:
+            db.close()
+        return job_id
+
+    def get(self, job_id: str) -> dict | None:
+        db = self._db()
+        try:
+            row = db.execute("SELECT state, attempts, progress, result, error, created, updated "
+                             "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        state, attempts, progress, result, error, created, updated = row
+        return {"id": job_id, "state": state, "attempts": attempts,
+                "progress": json.loads(progress) if progress else {},
+                "result": json.loads(result) if result else None,
+                "error": error, "created": created, "updated": updated}
+
+    def stats(self) -> dict:
+        db = self._db()
+        try:
+            return dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        finally:
+            db.close()
+
+    # ── ワーカー側 ──
+    def claim(self, worker: str) -> dict | None:
+        """見えているジョブを 1 つ取る（visibility 秒のあいだ自分のもの）。なければ None"""
+        now = time.time()
+        db = self._db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            # 期限切れのまま試行回数を使い切ったものは dead へ
+            db.execute("UPDATE jobs SET state = 'dead', updated = ?, "
+                       "error = 'visibility timeout (worker lost)' || COALESCE('; ' || error, '') "
+                       "WHERE state = 'running' AND visible_at <= ? AND attempts >= ?",
+                       (now, now, self.max_attempts))
+            row = db.execute("SELECT id, body, attempts FROM jobs WHERE state IN ('queued', 'running') "
+                             "AND visible_at <= ? ORDER BY created LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, visible_at = ?, "
+                           "worker = ?, updated = ? WHERE id = ?", (now + self.visibility, worker, now, row[0]))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        if row is None:
+            return None
+        body = json.loads(row[1])
+        return {"id": row[0], "params": body["params"], "degrade": tuple(body["degrade"]), "attempt": row[2] + 1}
+
+    def heartbeat(self, job_id: str, worker: str, progress: dict | None = None) -> bool:
+        """持ち時間を延ばす（progress があれば書く）。もう自分のジョブでなければ False"""
+        now = time.time()
+        sql, args = "UPDATE jobs SET visible_at = ?, updated = ?", [now + self.visibility, now]
+        if progress is not None:
+            sql += ", progress = ?"
+            args.append(json.dumps(progress, ensure_ascii=False))
+        db = self._db()
+        try:
+            cur = db.execute(sql + " WHERE id = ? AND worker = ? AND state = 'running'", (*args, job_id, worker))
+            return cur.rowcount > 0
+        finally:
+            db.close()
+
+    def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        now = time.time()
+        db = self._db()
+        try:
+            cur = db.execute("UPDATE jobs SET state = 'done', result = ?, error = NULL, updated = ? "
+                             "WHERE id = ? AND worker = ? AND state = 'running'",
+                             (json.dumps(result, ensure_ascii=False), now, job_id, worker))
+            return cur.rowcount > 0
+        finally:
+            db.close()
+
+    def fail(self, job_id: str, worker: str, error: str) -> str | None:
+        """積み直す（'queued'）か、使い切っていれば 'dead'。自分のジョブでなければ None"""
+        now = time.time()
+        db = self._db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND state = 'running'",
+                             (job_id, worker)).fetchone()
+            state = None
+            if row is not None:
+                state = "dead" if row[0] >= self.max_attempts else "queued"
+                delay = self.retry_delay * 2 ** (row[0] - 1)
+                db.execute("UPDATE jobs SET state = ?, error = ?, visible_at = ?, updated = ? WHERE id = ?",
+                           (state, error, now + delay, now, job_id))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        return state
+
+    # ── dead-letter ──
+    def dead(self) -> list[dict]:
+        db = self._db()
+        try:
+            rows = db.execute("SELECT id FROM jobs WHERE state = 'dead' ORDER BY updated").fetchall()
+        finally:
+            db.close()
+        return [self.get(job_id) for (job_id,) in rows]
+
+    def requeue(self, job_id: str) -> bool:
+        """dead のジョブを試行回数 0 から積み直す（途中経過は checkpoint に残っている）"""
+        now = time.time()
+        db = self._db()
+        try:
+            cur = db.execute("UPDATE jobs SET state = 'queued', attempts = 0, visible_at = ?, updated = ? "
+                             "WHERE id = ? AND state = 'dead'", (now, now, job_id))
+            return cur.rowcount > 0
+        finally:
+            db.close()
+
+
+# ====== CLI：dead-letter の確認・積み直し ======
+def main(argv=None):
+    import argparse
+    from app import job_queue
+
+    ap = argparse.ArgumentParser(description="絵本ジョブの待ち行列")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="状態ごとの件数")
+    sub.add_parser("dead", help="dead になったジョブの一覧")
+    rq = sub.add_parser("requeue", help="dead のジョブを積み直す")
+    rq.add_argument("job_id", nargs="+")
+    args = ap.parse_args(argv)
+
+    if args.command == "stats":
+        print(json.dumps(job_queue.stats(), ensure_ascii=False))
+    elif args.command == "dead":
+        for job in job_queue.dead():
+            print(f"{job['id']}  attempts={job['attempts']}  {job['error']}")
+    else:
+        for job_id in args.job_id:
+            print(f"{job_id}: {'requeued' if job_queue.requeue(job_id) else 'not dead / not found'}")
+
+
+if __name__ == "__main__":
+    main()
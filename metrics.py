@@ -0,0 +1,127 @@
+# metrics.py — 工程ごとの計測と Prometheus テキスト形式の出力
+# -------------------------------------------------------------
+#   with stage("chat"):  ...      # 所要時間ヒストグラム・エラー数・実行中ゲージ
+#   with traced("book_with_voice", path=...):  ...
+#       → 終わったら工程ごとの内訳を JSON 1 行で stderr に出す
+# スレッドプールに渡す処理は submit(ex, fn, ...) を使うと、
+# 呼び出し元の内訳（contextvars）に計測結果が入る。
+# ※ 値はプロセスごと。gunicorn の各ワーカーが自分の分を /metrics で返す。
+import contextvars, json, sys, threading, time
+from contextlib import contextmanager
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_lock = threading.Lock()
+_hist: dict[str, list] = {}                 # stage → [バケットごとの件数, 合計秒, 件数]
+_errors: dict[str, int] = {}
+_in_flight: dict[str, int] = {}
+_counters: dict[tuple, float] = {}          # (名前, ラベル) → 値
+_gauges: dict[tuple, float] = {}
+_help: dict[str, str] = {}
+
+_trace = contextvars.ContextVar("book_trace", default=None)
+
+
+def observe(name: str, seconds: float, ok: bool = True):
+    with _lock:
+        h = _hist.setdefault(name, [[0] * len(BUCKETS), 0.0, 0])
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                h[0][i] += 1
+        h[1] += seconds
+        h[2] += 1
+        if not ok:
+            _errors[name] = _errors.get(name, 0) + 1
+    trace = _trace.get()
+    if trace is not None:
+        with _lock:
+            trace.append({"stage": name, "seconds": round(seconds, 4), "ok": ok})
+
+
+@contextmanager
+def stage(name: str):
+    with _lock:
+        _in_flight[name] = _in_flight.get(name, 0) + 1
+    t = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        with _lock:
+            _in_flight[name] -= 1
+        observe(name, time.perf_counter() - t, ok)
+
+
+@contextmanager
+def traced(kind: str, **fields):
+    """1 リクエスト（1 冊）分の内訳を集め、最後に構造化ログを 1 行出す"""
+    trace = []
+    token = _trace.set(trace)
+    t = time.perf_counter()
+    ok = False
+    try:
+        yield trace
+        ok = True
+    finally:
+        _trace.reset(token)
+        total = time.perf_counter() - t
+        observe(kind, total, ok)
+        by_stage = {}
+        for span in list(trace):
+            by_stage[span["stage"]] = round(by_stage.get(span["stage"], 0) + span["seconds"], 4)
+        print(json.dumps({"event": kind, "ok": ok, "total": round(total, 4), "stages": by_stage,
+                          "spans": trace, **fields}, ensure_ascii=False), file=sys.stderr)
+
+
+def submit(ex, fn, *args, **kwargs):
+    """ex.submit と同じ。ただし呼び出し元の contextvars（内訳）を引き継ぐ"""
+    return ex.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def inc(name: str, value: float = 1, help: str = "", **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        _help.setdefault(name, help)
+
+
+def set_gauge(name: str, value: float, help: str = "", **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _gauges[key] = value
+        _help.setdefault(name, help)
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in pairs) + "}"
+
+
+def render() -> str:
+    out = ["# HELP book_stage_seconds Time spent in each pipeline stage.",
+           "# TYPE book_stage_seconds histogram"]
+    with _lock:
+        for name, (counts, total, n) in sorted(_hist.items()):
+            for le, c in zip(BUCKETS, counts):
+                out.append(f'book_stage_seconds_bucket{{stage="{name}",le="{le}"}} {c}')
+            out.append(f'book_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {n}')
+            out.append(f'book_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            out.append(f'book_stage_seconds_count{{stage="{name}"}} {n}')
+        out += ["# HELP book_stage_errors_total Failed calls per pipeline stage.",
+                "# TYPE book_stage_errors_total counter"]
+        out += [f'book_stage_errors_total{{stage="{k}"}} {v}' for k, v in sorted(_errors.items())]
+        out += ["# HELP book_stage_in_flight Calls currently running per pipeline stage.",
+                "# TYPE book_stage_in_flight gauge"]
+        out += [f'book_stage_in_flight{{stage="{k}"}} {v}' for k, v in sorted(_in_flight.items())]
+        for kind, table in (("counter", _counters), ("gauge", _gauges)):
+            for name in sorted({k[0] for k in table}):
+                out.append(f"# HELP {name} {_help.get(name) or name}")
+                out.append(f"# TYPE {name} {kind}")
+                out += [f"{name}{_labels(labels)} {v}" for (n, labels), v in sorted(table.items()) if n == name]
+    return "\n".join(out) + "\n"
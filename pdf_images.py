@@ -0,0 +1,46 @@
+# pdf_images.py — PDF に貼る挿絵を JPEG のまま埋め込む
+# -------------------------------------------------------------
+# PIL 画像を ImageReader で渡すと、ReportLab は RGB の生データを
+# Flate + ASCII85 で埋め込む（512px 1 枚 ≒ 0.8MB、3〜5 ページで数 MB）。
+# ・挿絵はあらかじめ JPEG ファイルにしておき、パスで drawImage に渡す
+#   → ReportLab はデコードせず DCTDecode ストリームとしてそのまま埋め込む
+# ・ReportLab はパスごとに XObject を 1 つ作って使い回すので、
+#   同じ挿絵が何ページに出ても中身は 1 回しか入らない
+# ・ASCII85（バイナリを文字にする分 25% 増える）は使わない（pdf_setup で設定）
+#   PDF_JPEG_QUALITY=85   PDF_DPI=0（0 ならプロファイルの解像度のまま）
+import os, tempfile
+
+PDF_JPEG_QUALITY = int(os.getenv("PDF_JPEG_QUALITY", "85"))
+PDF_DPI = int(os.getenv("PDF_DPI", "0"))
+
+
+def pdf_pixels(pixels: int, points: float) -> int:
+    """points 幅に貼る画像の解像度。PDF_DPI があればそれ以上は持たない"""
+    if PDF_DPI <= 0:
+        return pixels
+    return min(pixels, max(1, round(points / 72 * PDF_DPI)))
+
+
+def save_jpeg(img, path: str, quality: int = PDF_JPEG_QUALITY) -> str:
+    """PIL 画像を JPEG で書く（一時ファイル → os.replace）"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            img.convert("RGB").save(fp, "JPEG", quality=quality, optimize=True)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+
+def scaled_jpeg(src: str, dest: str, pixels: int, quality: int = PDF_JPEG_QUALITY) -> str:
+    """src を pixels 角に縮めた JPEG を dest に用意する（あれば使い回す）"""
+    try:
+        os.utime(dest)
+        return dest
+    except FileNotFoundError:
+        pass
+    from imaging import open_scaled
+    with open_scaled(src, pixels) as img:
+        return save_jpeg(img, dest, quality)
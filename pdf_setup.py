@@ -0,0 +1,40 @@
+# pdf_setup.py — ReportLab とフォントの準備（最初の PDF 書き出し時に 1 回だけ）
+# -------------------------------------------------------------
+# NotoSansJP の TTF は 1 本数 MB あり、TTFont() の解析に時間がかかる。
+# import 時に登録すると、PDF を作らないワーカーや「/」を返すだけの
+# リクエストまで待たされるので、使う直前に必要なフォントだけ登録する。
+# 解析済みのフォントはプロセス内で使い回す。
+# gunicorn --preload（BOOK_PRELOAD=1 / app:create_app()）なら fork 前に
+# preload() しておき、解析結果をワーカー間で共有する（copy-on-write）。
+import threading
+
+FONTS = {
+    "JPFontR": "fonts/NotoSansJP-Regular.ttf",
+    "JPFontB": "fonts/NotoSansJP-Bold.ttf",
+}
+
+_lock = threading.Lock()
+_registered: set[str] = set()
+
+
+def ensure_fonts(*names: str):
+    """names のフォントを（まだなら）登録する。省略時は全部"""
+    names = names or tuple(FONTS)
+    if _registered.issuperset(names):
+        return
+    with _lock:
+        from reportlab import rl_config
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        rl_config.useA85 = 0        # 画像をバイナリのまま入れる（pdf_images 参照）
+        for name in names:
+            if name not in _registered:
+                pdfmetrics.registerFont(TTFont(name, FONTS[name]))
+                _registered.add(name)
+
+
+def preload():
+    """fork 前に呼ぶ：PDF まわりの import とフォントの解析を済ませておく"""
+    import pdf_images, imaging                      # noqa: F401（PIL・requests を読み込む）
+    from reportlab.pdfgen.canvas import Canvas       # noqa: F401
+    ensure_fonts()
@@ -0,0 +1,329 @@
+# rate_limit.py — モデルごとのレート制限（全ワーカー共有）と 429 のバックオフ
+# -------------------------------------------------------------
+# ・トークンバケットをモデルごとに 2 つ（リクエスト/分・トークン/分）持ち、
+#   SQLite に置いて gunicorn の全ワーカーで共有する
+# ・429 / 5xx と接続エラー・時間切れは指数バックオフ（フルジッター）で再試行。Retry-After があれば従う
+#   （429 で Retry-After が無ければ x-ratelimit-reset-requests / -tokens の長い方、cap まで）
+# ・429 を受けたら、そのモデルのバケットを Retry-After 分だけ空にして
+#   他のワーカーも一緒に待たせる
+#
+#   RATE_LIMITS="gpt-4o-mini=500:200000,dall-e-3=7,tts-1=50"   # モデル=RPM[:TPM]
+# AsyncOpenAI 用に、待ちを asyncio.sleep で行う版（aacquire / AsyncLimitedClient）もある。
+# stream=True の chat は、scheduler の同時数の枠を読み終わるまで持ち続け、
+# 最初のチャンクが届くまでのエラーは再試行する（届いた後にやり直すと文が重複するので、そのまま上げる）。
+import asyncio, os, random, re, sqlite3, sys, time
+from contextlib import nullcontext
+from types import SimpleNamespace
+import metrics
+
+RETRYABLE = {408, 409, 429, 500, 502, 503, 504}
+
+
+def parse_limits(spec: str) -> dict:
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        model, _, rates = part.partition("=")
+        rpm, _, tpm = rates.partition(":")
+        limits[model.strip()] = (float(rpm or 0), float(tpm or 0))
+    return limits
+
+
+class RateLimiter:
+    def __init__(self, path: str, limits: dict, burst_seconds: float = 10.0):
+        self.path = path
+        self.limits = limits                  # model → (rpm, tpm)。0 は無制限
+        self.burst_seconds = burst_seconds
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)""")
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _buckets(self, model: str, tokens: float):
+        """(バケット名, 1 分あたりの量, 今回の消費量) の一覧"""
+        rpm, tpm = self.limits.get(model, (0, 0))
+        out = []
+        if rpm:
+            out.append((f"{model}:rpm", rpm, 1.0))
+        if tpm and tokens:
+            out.append((f"{model}:tpm", tpm, min(tokens, tpm)))
+        return out
+
+    def _capacity(self, per_min: float, cost: float) -> float:
+        # 1 分ぶんを一気に使えると上限を超えるので、burst_seconds ぶんだけ貯める
+        return max(cost, per_min * self.burst_seconds / 60)
+
+    def _try_acquire(self, db, buckets) -> float:
+        """今すぐ消費できれば消費して 0 を、できなければ待つべき秒数を返す"""
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        wait = 0.0
+        levels = {}
+        for name, per_min, cost in buckets:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            cap = self._capacity(per_min, cost)
+            level = cap if row is None else min(cap, row[0] + (now - row[1]) * per_min / 60)
+            levels[name] = level
+            if level < cost:
+                wait = max(wait, (cost - level) * 60 / per_min)
+        if wait == 0:
+            for name, per_min, cost in buckets:
+                levels[name] -= cost
+        for name, level in levels.items():
+            db.execute("INSERT OR REPLACE INTO buckets(name, tokens, updated) VALUES(?, ?, ?)",
+                       (name, level, now))
+        db.execute("COMMIT")
+        if wait:
+            wait += random.uniform(0, 0.05 * wait + 0.01)
+        return wait
+
+    def try_acquire(self, model: str, tokens: float = 0) -> float:
+        """待たずに 1 回試す。消費できたら 0、できなければ待つべき秒数"""
+        buckets = self._buckets(model, tokens)
+        if not buckets:
+            return 0.0
+        db = self._db()
+        try:
+            return self._try_acquire(db, buckets)
+        finally:
+            db.close()
+
+    def acquire(self, model: str, tokens: float = 0):
+        """枠が空くまで待ってから消費する"""
+        buckets = self._buckets(model, tokens)
+        if not buckets:
+            return
+        waited = 0.0
+        db = self._db()
+        try:
+            while wait := self._try_acquire(db, buckets):
+                time.sleep(wait)
+                waited += wait
+        finally:
+            db.close()
+        if waited:
+            metrics.observe("rate_wait", waited)
+
+    async def aacquire(self, model: str, tokens: float = 0):
+        """acquire と同じ。待つ間はイベントループを止めない（SQLite のロック待ちもスレッドで）"""
+        if not self._buckets(model, tokens):
+            return
+        waited = 0.0
+        while wait := await asyncio.to_thread(self.try_acquire, model, tokens):
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited:
+            metrics.observe("rate_wait", waited)
+
+    def penalize(self, model: str, seconds: float):
+        """429 を受けた時：そのモデルを全ワーカーで seconds 秒止める"""
+        now = time.time()
+        with self._db() as db:
+            for name, per_min, cost in self._buckets(model, 1):
+                # seconds 秒後にちょうど 1 回分たまる水位
+                db.execute("INSERT OR REPLACE INTO buckets(name, tokens, updated) VALUES(?, ?, ?)",
+                           (name, cost - seconds * per_min / 60, now))
+
+
+def _status(e) -> int | None:
+    return getattr(e, "status_code", None)
+
+
+def _headers(e):
+    return getattr(e, "headers", None) or getattr(getattr(e, "response", None), "headers", None) or {}
+
+
+def _retry_after(e) -> float | None:
+    headers = _headers(e)
+    for name, unit in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        value = headers.get(name) or headers.get(name.title())
+        try:
+            if value is not None:
+                return float(value) * unit
+        except ValueError:
+            pass
+    return None
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _reset_after(e) -> float | None:
+    """x-ratelimit-reset-requests / -tokens（"1s" "6m0s" "20ms" の形）の長い方"""
+    headers = _headers(e)
+    resets = []
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        parts = _DURATION_RE.findall(headers.get(name) or "")
+        if parts:
+            resets.append(sum(float(n) * _UNITS[u] for n, u in parts))
+    return max(resets) if resets else None
+
+
+# SDK の再試行は切っているので、接続できなかった・時間切れ（status_code なし）もこちらで再試行する
+CONNECTION_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectionError", "TimeoutError"}
+
+
+def _retryable(e) -> bool:
+    if _status(e) in RETRYABLE:
+        return True
+    return any(c.__name__ in CONNECTION_ERRORS for c in type(e).__mro__)
+
+
+def _backoff(e, model: str, limiter: RateLimiter, attempt: int, max_retries: int,
+             base: float, cap: float) -> float:
+    """再試行できるエラーなら待つ秒数を返す。できなければそのまま送出"""
+    status = _status(e)
+    if not _retryable(e):
+        raise e
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    retry_after = _retry_after(e)
+    if retry_after is None and status == 429 and (reset := _reset_after(e)) is not None:
+        retry_after = min(cap, reset)
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, 0.25 * retry_after + 0.1)
+    if status == 429:
+        limiter.penalize(model, delay)      # 諦める時も、他のワーカーには待ってもらう
+    if attempt == max_retries:
+        raise e
+    reason = str(status) if status is not None else "connection"
+    metrics.inc("book_provider_retries_total", help="Retried provider calls.", model=model, status=reason)
+    print(f"⏳ {model} {reason} → {delay:.1f}s 後に再試行 ({attempt + 1}/{max_retries})", file=sys.stderr)
+    return delay
+
+
+def call_with_backoff(fn, model: str, limiter: RateLimiter, tokens: float = 0,
+                      max_retries: int = 5, base: float = 1.0, cap: float = 30.0, scheduler=None):
+    """scheduler があれば、レート制限の枠はその順番待ち（scheduler.slot）の中で取る"""
+    for attempt in range(max_retries + 1):
+        if scheduler is None:
+            limiter.acquire(model, tokens)
+        try:
+            if scheduler is None:
+                return fn()
+            with scheduler.slot(model, tokens):
+                return fn()
+        except Exception as e:
+            time.sleep(_backoff(e, model, limiter, attempt, max_retries, base, cap))
+
+
+async def acall_with_backoff(fn, model: str, limiter: RateLimiter, tokens: float = 0,
+                             max_retries: int = 5, base: float = 1.0, cap: float = 30.0):
+    """call_with_backoff の async 版（fn() はコルーチンを返す）"""
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(model, tokens)
+        try:
+            return await fn()
+        except Exception as e:
+            # 429 の時はバケットを書き換える（SQLite）ので、スレッドで
+            await asyncio.sleep(await asyncio.to_thread(_backoff, e, model, limiter, attempt, max_retries, base, cap))
+
+
+def stream_with_backoff(fn, model: str, limiter: RateLimiter, tokens: float = 0,
+                        max_retries: int = 5, base: float = 1.0, cap: float = 30.0, scheduler=None):
+    """stream=True の呼び出し用（チャンクを順に返すジェネレーター）。
+    scheduler の枠はストリームを読み終わる（または閉じられる）まで返さない"""
+    for attempt in range(max_retries + 1):
+        with scheduler.slot(model, tokens) if scheduler is not None else nullcontext():
+            if scheduler is None:
+                limiter.acquire(model, tokens)
+            try:
+                chunks = iter(fn())
+                first = next(chunks)
+            except StopIteration:
+                return
+            except Exception as e:
+                wait = _backoff(e, model, limiter, attempt, max_retries, base, cap)
+            else:
+                yield first
+                yield from chunks
+                return
+        time.sleep(wait)        # 待つ間は枠を返しておく
+
+
+async def astream_with_backoff(fn, model: str, limiter: RateLimiter, tokens: float = 0,
+                               max_retries: int = 5, base: float = 1.0, cap: float = 30.0):
+    """stream_with_backoff の async 版（fn() はコルーチン、返すのは async イテレーター）"""
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(model, tokens)
+        try:
+            chunks = (await fn()).__aiter__()
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            return
+        except Exception as e:
+            await asyncio.sleep(await asyncio.to_thread(_backoff, e, model, limiter, attempt, max_retries, base, cap))
+            continue
+        yield first
+        async for chunk in chunks:
+            yield chunk
+        return
+
+
+class LimitedClient:
+    """OpenAI クライアントの 3 つの呼び出しにレート制限と再試行をかぶせる"""
+
+    def __init__(self, client, limiter: RateLimiter, max_retries: int = 5, scheduler=None, hedger=None):
+        self._client = client
+        self._limiter = limiter
+        self._max_retries = max_retries
+        self._scheduler = scheduler
+        self._hedger = hedger          # hedge.Hedger。挿絵の 1 回ごとの呼び出しだけをヘッジする
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.images = SimpleNamespace(generate=self._image)
+        self.audio = SimpleNamespace(speech=SimpleNamespace(create=self._speech))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _call(self, fn, model, tokens, kwargs):
+        return call_with_backoff(lambda: fn(**kwargs), model, self._limiter, tokens, self._max_retries,
+                                 scheduler=self._scheduler)
+
+    @staticmethod
+    def _chat_tokens(kwargs) -> int:
+        prompt = sum(len(str(m.get("content", ""))) for m in kwargs.get("messages", []))
+        return prompt + kwargs.get("max_tokens", 0)
+
+    def _chat(self, **kwargs):
+        fn, model, tokens = self._client.chat.completions.create, kwargs.get("model"), self._chat_tokens(kwargs)
+        if kwargs.get("stream"):
+            return stream_with_backoff(lambda: fn(**kwargs), model, self._limiter, tokens, self._max_retries,
+                                       scheduler=self._scheduler)
+        return self._call(fn, model, tokens, kwargs)
+
+    def _image(self, **kwargs):
+        model = kwargs.get("model", "dall-e-2")
+        fn = self._client.images.generate
+        if self._hedger is not None:
+            fn = self._hedged(fn, model)
+        return self._call(fn, model, 0, kwargs)
+
+    def _hedged(self, fn, model):
+        # 2 本目は、レート制限の枠がすぐ取れる時だけ（取れたらその枠を使う）
+        quota = lambda: self._limiter.try_acquire(model) == 0
+        return lambda **kw: self._hedger.call(model, lambda: fn(**kw), quota)
+
+    def _speech(self, **kwargs):
+        return self._call(self._client.audio.speech.create, kwargs.get("model"), 0, kwargs)
+
+
+class AsyncLimitedClient(LimitedClient):
+    """AsyncOpenAI 用。呼び出しはすべて await する"""
+
+    async def _call(self, fn, model, tokens, kwargs):
+        return await acall_with_backoff(lambda: fn(**kwargs), model, self._limiter, tokens, self._max_retries)
+
+    async def _chat(self, **kwargs):
+        if kwargs.get("stream"):
+            fn = self._client.chat.completions.create
+            return astream_with_backoff(lambda: fn(**kwargs), kwargs.get("model"), self._limiter,
+                                        self._chat_tokens(kwargs), self._max_retries)
+        return await super()._chat(**kwargs)
+
+    def _hedged(self, fn, model):
+        quota = lambda: self._limiter.try_acquire(model) == 0
+        return lambda **kw: self._hedger.acall(model, lambda: fn(**kw), quota)
@@ -0,0 +1,232 @@
+# scheduler.py — API 呼び出しの優先度つき順番待ち（interactive > warmup > batch）
+# -------------------------------------------------------------
+# Web のフォームで待っている子どもと、generate_book.py のまとめ作り・プールの作り置きが
+# 同じ API の枠を取り合うと、まとめ作りに枠を食われてブラウザが待たされる。そこで
+# LimitedClient の呼び出しはすべてここで順番を待ってから API を呼ぶ。
+# ・クラスは 3 つ。interactive（Web）> warmup（作り置き）> batch（generate_book.py）
+#     with priority("warmup"): ...   # その間の呼び出しのクラス（contextvars で引き継ぐ）
+# ・クラスごとの同時呼び出し数の上限（caps、0 は無制限）
+# ・モデルのレート制限（rate_limit のバケット）の次の 1 回を、待っている中で
+#   重み（weights）に応じた公平な順で渡す（重み 8:2:1 なら混んでいる時は 8:2:1 で分ける）
+# ・aging 秒以上待った呼び出しはクラスに関係なく先に通す（batch が止まりきらないように）
+#   BOOK_SCHEDULER=local（既定・プロセス内）| socket（1 台の全ワーカーで共有）| off
+#   SCHED_WEIGHTS="interactive=8,warmup=2,batch=1"  SCHED_CAPS="interactive=0,warmup=4,batch=8"
+#   SCHED_AGING=60  SCHED_SOCKET=cache/scheduler.sock
+# local はプロセスの中でしか順番を決めないので、別プロセスの generate_book.py（batch）は
+# Web（interactive）に枠を譲らない。まとめ作りを Web と同じ台で回す時は、Web・ワーカー・
+# generate_book.py のすべてを BOOK_SCHEDULER=socket にし、先に順番待ちのサーバーを 1 つ動かしておく：
+#   python scheduler.py serve
+#   BOOK_SCHEDULER=socket gunicorn ...   /   BOOK_SCHEDULER=socket python generate_book.py --batch jobs.csv
+import contextvars, itertools, json, os, socket, socketserver, sys, threading, time
+from contextlib import contextmanager
+import metrics
+
+CLASSES = ("interactive", "warmup", "batch")
+
+_priority = contextvars.ContextVar("book_priority", default=None)
+_default = os.getenv("BOOK_PRIORITY", "interactive")
+
+
+def set_default_class(cls: str):
+    """このプロセスで、priority() の外の呼び出しに使うクラス"""
+    global _default
+    _default = _check(cls)
+
+
+def current() -> str:
+    return _priority.get() or _default
+
+
+@contextmanager
+def priority(cls: str):
+    token = _priority.set(_check(cls))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _check(cls: str) -> str:
+    if cls not in CLASSES:
+        raise ValueError(f"unknown priority class: {cls!r}（{', '.join(CLASSES)}）")
+    return cls
+
+
+def parse_classes(spec: str, default: dict) -> dict:
+    out = dict(default)
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        cls, _, value = part.partition("=")
+        out[_check(cls.strip())] = float(value)
+    return out
+
+
+class _Waiter:
+    __slots__ = ("cls", "model", "since", "seq")
+
+    def __init__(self, cls, model, seq):
+        self.cls, self.model, self.since, self.seq = cls, model, time.monotonic(), seq
+
+
+class Scheduler:
+    def __init__(self, limiter, weights=None, caps=None, aging: float = 60):
+        self.limiter = limiter
+        self.weights = {"interactive": 8, "warmup": 2, "batch": 1, **(weights or {})}
+        self.caps = {"interactive": 0, "warmup": 4, "batch": 8, **(caps or {})}
+        self.aging = aging
+        self._cond = threading.Condition(threading.Lock())
+        self._waiting: list[_Waiter] = []
+        self._running = dict.fromkeys(CLASSES, 0)
+        self._vtime = dict.fromkeys(CLASSES, 0.0)     # 渡した回数 ÷ 重み（小さいクラスが次）
+        self._trying = set()                         # バケットを見に行っているモデル
+        self._seq = itertools.count()
+
+    def _head(self, model: str):
+        """model の次の 1 回を受け取る呼び出し"""
+        ready = [w for w in self._waiting
+                 if w.model == model and not (self.caps[w.cls] and self._running[w.cls] >= self.caps[w.cls])]
+        if not ready:
+            return None
+        if self.aging:
+            old = time.monotonic() - self.aging
+            aged = [w for w in ready if w.since <= old]
+            if aged:
+                return min(aged, key=lambda w: w.seq)
+        return min(ready, key=lambda w: (self._vtime[w.cls], CLASSES.index(w.cls), w.seq))
+
+    @contextmanager
+    def slot(self, model: str, tokens: float = 0, cls: str | None = None):
+        """順番が来て、レート制限の枠も取れたら中に入る。出る時に同時数の枠を返す"""
+        cls = _check(cls or current())
+        with self._cond:
+            w = _Waiter(cls, model, next(self._seq))
+            # しばらく来ていなかったクラスが、貯まった分でまとめて割り込まないように
+            busy = [self._vtime[x.cls] for x in self._waiting if x.cls != cls]
+            if busy and not any(x.cls == cls for x in self._waiting):
+                self._vtime[cls] = max(self._vtime[cls], min(busy))
+            self._waiting.append(w)
+            self._cond.notify_all()
+            self._gauges()
+            try:
+                while True:
+                    if model in self._trying or self._head(model) is not w:
+                        self._cond.wait(1.0)          # aging の繰り上がりも見るので時々起きる
+                        continue
+                    self._trying.add(model)
+                    self._cond.release()
+                    try:
+                        wait = self.limiter.try_acquire(model, tokens)
+                    finally:
+                        self._cond.acquire()
+                        self._trying.discard(model)
+                        self._cond.notify_all()
+                    if not wait:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(w)
+                self._cond.notify_all()
+            self._running[cls] += 1
+            self._vtime[cls] += 1 / self.weights[cls]
+            self._gauges()
+        waited = time.monotonic() - w.since
+        metrics.observe(f"sched_wait_{cls}", waited)
+        metrics.inc("book_sched_grants_total", help="Provider calls let through by the scheduler.",
+                    cls=cls, aged=str(bool(self.aging) and waited >= self.aging).lower())
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[cls] -= 1
+                self._cond.notify_all()
+                self._gauges()
+
+    def _gauges(self):
+        for cls in CLASSES:
+            metrics.set_gauge("book_sched_waiting", sum(w.cls == cls for w in self._waiting),
+                              help="Provider calls waiting in the scheduler.", cls=cls)
+            metrics.set_gauge("book_sched_running", self._running[cls],
+                              help="Provider calls running per priority class.", cls=cls)
+
+
+# ====== 1 台の全ワーカーで共有する（Unix ソケット） ======
+# 1 回の呼び出しにつき 1 接続。{"class", "model", "tokens"} を 1 行送り、"ok" が返ったら呼ぶ。
+# 呼び終わったら接続を閉じる（= 同時数の枠を返す）。ワーカーが落ちても接続が切れて枠は戻る。
+class RemoteScheduler:
+    def __init__(self, path: str, fallback: Scheduler):
+        self.path = path
+        self.fallback = fallback        # サーバーがいない時はプロセス内で順番を待つ
+        self._warned = False
+
+    @contextmanager
+    def slot(self, model: str, tokens: float = 0, cls: str | None = None):
+        cls = _check(cls or current())
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            if not self._warned:
+                self._warned = True
+                print(f"⚠️ scheduler {self.path} に繋がらないのでプロセス内で待ちます: {e}", file=sys.stderr)
+            with self.fallback.slot(model, tokens, cls):
+                yield
+            return
+        try:
+            t = time.monotonic()
+            sock.sendall(json.dumps({"class": cls, "model": model, "tokens": tokens}).encode() + b"\n")
+            with sock.makefile("rb") as fp:
+                reply = fp.readline().strip()
+            if reply != b"ok":
+                raise RuntimeError(f"scheduler: {reply.decode(errors='replace') or 'connection closed'}")
+            metrics.observe(f"sched_wait_{cls}", time.monotonic() - t)
+            yield
+        finally:
+            sock.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline())
+            cls, model, tokens = _check(req["class"]), str(req["model"]), float(req.get("tokens", 0))
+        except (ValueError, KeyError, TypeError) as e:
+            self.wfile.write(f"error {e}\n".encode())
+            return
+        with self.server.scheduler.slot(model, tokens, cls):
+            try:
+                self.wfile.write(b"ok\n")
+                self.wfile.flush()
+                self.rfile.read()           # 呼び出し側が閉じるまで待つ
+            except OSError:
+                pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path: str, scheduler: Scheduler):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    server = _Server(path, _Handler)
+    server.scheduler = scheduler
+    print(f"🚦 scheduler listening on {path}", file=sys.stderr)
+    server.serve_forever()
+
+
+def main(argv=None):
+    import argparse
+    from backend import local_scheduler
+
+    ap = argparse.ArgumentParser(description="API 呼び出しの優先度つき順番待ちサーバー")
+    ap.add_argument("command", choices=["serve"])
+    ap.add_argument("--socket", default=os.getenv("SCHED_SOCKET", "cache/scheduler.sock"))
+    args = ap.parse_args(argv)
+    serve(args.socket, local_scheduler())
+
+
+if __name__ == "__main__":
+    main()
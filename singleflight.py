@@ -0,0 +1,75 @@
+# singleflight.py — 同じキーの処理が同時に走ったら 1 本にまとめる
+# -------------------------------------------------------------
+# ・同じプロセス内のスレッド同士 → 先頭のスレッドの結果をそのまま受け取る
+# ・別プロセス（gunicorn ワーカー）同士 → キーごとのファイルロック（flock）で
+#   順番待ちし、待たされた場合は lookup() で共有ストレージを見直す。
+#   先に終わったワーカーが結果を保存済みなら、それを使って API を呼ばない。
+# flock はプロセスが落ちると自動で外れるので、ロックが残り続けることはない。
+import fcntl, hashlib, os, threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, lock_dir: str | None = None):
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key: str, fn, lookup=None):
+        """key が処理中なら終わるのを待って同じ結果を返す。そうでなければ fn() を実行"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_locked(key, fn, lookup)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_locked(self, key, fn, lookup):
+        if not self.lock_dir:
+            return fn()
+        path = os.path.join(self.lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".lock")
+        with open(path, "a") as fp:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                waited = False
+            except BlockingIOError:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+                waited = True
+            try:
+                # 他のワーカーの処理を待った時だけ、その結果を見に行く
+                if waited and lookup is not None:
+                    hit = lookup()
+                    if hit is not None:
+                        return hit
+                return fn()
+            finally:
+                # 結果は共有ストレージにあるので、後から来た人は lookup() で拾える
+                try:
+                    if os.stat(path).st_ino == os.fstat(fp.fileno()).st_ino:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                fcntl.flock(fp, fcntl.LOCK_UN)
@@ -0,0 +1,79 @@
+# story_cache.py — 生成済みストーリーのディスクキャッシュ（SQLite）
+# -------------------------------------------------------------
+# キー = 正規化した条件 + プロンプト + モデル + temperature のハッシュ。
+# 1 キーあたり variants 本まで貯め、そろったらランダムに 1 本返す
+# （同じ条件でも毎回同じおはなしにならないように）。
+# SQLite ファイルなので gunicorn の全ワーカーで共有できる。
+import hashlib, json, os, random, sqlite3, time
+
+
+class StoryCache:
+    def __init__(self, path: str, variants: int = 3, ttl: int = 7 * 86400, max_entries: int = 5000):
+        self.path = path
+        self.variants = variants
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS stories (
+                id INTEGER PRIMARY KEY, key TEXT NOT NULL, body TEXT NOT NULL,
+                created REAL NOT NULL, last_used REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS stories_key ON stories(key)")
+            db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def make_key(params: dict, prompt: str, model: str, temperature) -> str:
+        norm = {k: str(v).strip() for k, v in sorted(params.items())}
+        raw = json.dumps([norm, prompt, model, temperature], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, db, name: str):
+        db.execute("INSERT INTO stats(name, value) VALUES(?, 1) "
+                   "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key: str) -> dict | None:
+        """バリエーションがそろっていればその中から 1 本返す。足りなければ None（=生成して put）"""
+        if self.variants <= 0:
+            return None
+        now = time.time()
+        with self._db() as db:
+            rows = db.execute("SELECT id, body FROM stories WHERE key = ? AND created > ?",
+                              (key, now - self.ttl)).fetchall()
+            if len(rows) < self.variants:
+                self._count(db, "miss")
+                return None
+            row_id, body = random.choice(rows)
+            db.execute("UPDATE stories SET last_used = ? WHERE id = ?", (now, row_id))
+            self._count(db, "hit")
+        return json.loads(body)
+
+    def recent(self, key: str, within: float) -> dict | None:
+        """within 秒以内に入ったものがあれば返す（同時リクエストの相乗り用）"""
+        with self._db() as db:
+            row = db.execute("SELECT body FROM stories WHERE key = ? AND created > ? "
+                             "ORDER BY created DESC LIMIT 1", (key, time.time() - within)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, story: dict):
+        if self.variants <= 0:
+            return
+        now = time.time()
+        with self._db() as db:
+            db.execute("INSERT INTO stories(key, body, created, last_used) VALUES(?, ?, ?, ?)",
+                       (key, json.dumps(story, ensure_ascii=False), now, now))
+            # TTL 切れと、上限を超えた分（最近使われていない順）を捨てる
+            db.execute("DELETE FROM stories WHERE created <= ?", (now - self.ttl,))
+            db.execute("DELETE FROM stories WHERE id IN (SELECT id FROM stories "
+                       "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def stats(self) -> dict:
+        with self._db() as db:
+            counts = dict(db.execute("SELECT name, value FROM stats").fetchall())
+            entries, = db.execute("SELECT COUNT(*) FROM stories").fetchone()
+        hit, miss = counts.get("hit", 0), counts.get("miss", 0)
+        return {"hit": hit, "miss": miss, "hit_rate": hit / (hit + miss) if hit + miss else 0.0,
+                "entries": entries, "variants": self.variants}
@@ -0,0 +1,106 @@
+# story_repair.py — ストーリー JSON の検査と修復
+# -------------------------------------------------------------
+# max_tokens で途中で切れた JSON や、シーン数・型がおかしい JSON を
+# 作り直さずに直す。
+#   1. 閉じていない JSON → できあがっているシーンだけ拾う
+#   2. シーンの型をそろえる（dict や数値 → 文字列、空は捨てる）
+#   3. 多すぎるシーンは最後のシーンにまとめる
+#   4. 足りない分だけ「つづき」をモデルに書いてもらう（全部は作り直さない）
+import json, re
+from metrics import stage
+from story_stream import StoryStreamParser
+
+SCENE_KEYS = ("story", "scenes", "pages")
+TEXT_KEYS = ("text", "scene", "content", "body")
+
+
+def _scene_text(value) -> str:
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        for k in TEXT_KEYS:
+            if isinstance(value.get(k), str):
+                return value[k].strip()
+        return "".join(v for v in value.values() if isinstance(v, str)).strip()
+    if isinstance(value, list):
+        return "".join(_scene_text(v) for v in value)
+    return "" if value is None else str(value).strip()
+
+
+def _split(text: str, n: int) -> list[str]:
+    """1 つの文字列で返ってきた本文を、文の切れ目で n 個くらいに分ける"""
+    sentences = [s for s in re.split(r"(?<=[。！？!?])", text) if s.strip()]
+    if len(sentences) <= 1:
+        return [text.strip()] if text.strip() else []
+    bounds = [round(i * len(sentences) / n) for i in range(n + 1)]
+    return ["".join(sentences[bounds[i]:bounds[i + 1]]).strip() for i in range(n)]
+
+
+def parse_story(text: str, n_scenes: int) -> tuple[dict, int]:
+    """(直したストーリー, 足りないシーン数) を返す"""
+    try:
+        data = json.loads(text, strict=False)      # 文字列の中の生の改行は許す
+    except (json.JSONDecodeError, TypeError):
+        parser = StoryStreamParser()
+        parser.feed(text or "")
+        data = {"title": parser.title, "story": parser.scenes}
+
+    if isinstance(data, list):
+        data = {"story": data}
+    if not isinstance(data, dict):
+        data = {}
+
+    raw = next((data[k] for k in SCENE_KEYS if k in data), [])
+    if isinstance(raw, str):
+        raw = _split(raw, n_scenes)
+    elif isinstance(raw, dict):
+        raw = list(raw.values())
+    scenes = [t for t in (_scene_text(v) for v in raw) if t]
+    if len(scenes) > n_scenes:
+        scenes = scenes[:n_scenes - 1] + ["".join(scenes[n_scenes - 1:])]
+
+    title = data.get("title")
+    title = title.strip() if isinstance(title, str) and title.strip() else "あなただけのえほん"
+    return {"title": title, "story": scenes}, n_scenes - len(scenes)
+
+
+def _continue_kwargs(request_kwargs: dict, story: dict, missing: int) -> dict:
+    shape = json.dumps({"story": [f"シーン{len(story['story']) + i + 1}" for i in range(missing)]}, ensure_ascii=False)
+    messages = list(request_kwargs["messages"]) + [
+        {"role": "assistant", "content": json.dumps(story, ensure_ascii=False)},
+        {"role": "user", "content": f"このおはなしの つづきのシーンを {missing} こ だけ かいてください。JSON={shape}"},
+    ]
+    kwargs = {**request_kwargs, "messages": messages, "max_tokens": 250 * missing}
+    kwargs.pop("stream", None)
+    return kwargs
+
+
+def _continued(text: str, missing: int) -> list[str]:
+    extra, still_missing = parse_story(text, missing)
+    if still_missing:
+        raise ValueError(f"story is missing {still_missing} scene(s) after continuation")
+    return extra["story"]
+
+
+def continue_story(client, request_kwargs: dict, story: dict, missing: int) -> list[str]:
+    """足りないシーンだけを書いてもらう"""
+    with stage("chat_continue"):
+        rsp = client.chat.completions.create(**_continue_kwargs(request_kwargs, story, missing))
+    return _continued(rsp.choices[0].message.content, missing)
+
+
+def complete_story(client, text: str, n_scenes: int, request_kwargs: dict) -> dict:
+    story, missing = parse_story(text, n_scenes)
+    if missing > 0:
+        story["story"] += continue_story(client, request_kwargs, story, missing)
+    return story
+
+
+async def acomplete_story(client, text: str, n_scenes: int, request_kwargs: dict) -> dict:
+    """complete_story の async 版（client は AsyncOpenAI 系）"""
+    story, missing = parse_story(text, n_scenes)
+    if missing > 0:
+        with stage("chat_continue"):
+            rsp = await client.chat.completions.create(**_continue_kwargs(request_kwargs, story, missing))
+        story["story"] += _continued(rsp.choices[0].message.content, missing)
+    return story
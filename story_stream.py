@@ -0,0 +1,122 @@
+# story_stream.py — ストリーミング中の JSON から story[i] を逐次取り出す
+# -------------------------------------------------------------
+# {"title":"…","story":["…","…"]} を 1 文字ずつ読み、
+# 文字列の閉じ " が来た時点で title / story[i] を通知する。
+# チャンクの途中で切れたエスケープ（\" や \uXXXX）にも対応。
+# シーンは前後の空白を落として通知し、空のシーンは飛ばして番号を詰める
+# （story_repair.parse_story と同じ文字列・同じ番号になるように。挿絵・音声のキーやページが
+#   修復後のシーンとずれないため）。
+import json, re
+
+# 正しいエスケープ（サロゲートペアは 2 つまとめて）
+_ESCAPE_RE = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}|\\u[0-9a-fA-F]{4}|\\["\\/bfnrt]')
+
+
+def decode_string(raw: str) -> str:
+    """JSON 文字列の中身をデコードする。モデルの出力によくある生の改行・制御文字は許し、
+    \\x のような壊れたエスケープはその文字のまま残す（本全体を失敗させない）"""
+    try:
+        return json.loads('"' + raw + '"', strict=False)
+    except json.JSONDecodeError:
+        return _ESCAPE_RE.sub(lambda m: json.loads('"' + m.group() + '"'), raw)
+
+
+class StoryStreamParser:
+    def __init__(self, on_title=None, on_scene=None):
+        self.on_title = on_title or (lambda title: None)
+        self.on_scene = on_scene or (lambda i, text: None)
+        self.stack = []          # [種類("obj"/"arr"), キー or 添字, キー待ちか]
+        self.in_str = False
+        self.escape = False
+        self.buf = []
+        self.title = None
+        self.scenes = []
+        self._strings = 0        # story の先頭から続いている文字列の数（空も含む）
+
+    def feed(self, chunk: str):
+        for ch in chunk:
+            if self.in_str:
+                self._feed_str(ch)
+            else:
+                self._feed_struct(ch)
+
+    # ── 文字列の中 ──
+    def _feed_str(self, ch):
+        if self.escape:
+            self.escape = False
+            self.buf.append(ch)
+        elif ch == "\\":
+            self.escape = True
+            self.buf.append(ch)
+        elif ch == '"':
+            self.in_str = False
+            self._on_string(decode_string("".join(self.buf)))
+            self.buf = []
+        else:
+            self.buf.append(ch)
+
+    # ── 構造（{ } [ ] : ,） ──
+    def _feed_struct(self, ch):
+        top = self.stack[-1] if self.stack else None
+        if ch == '"':
+            self.in_str = True
+        elif ch == "{":
+            self.stack.append(["obj", None, True])
+        elif ch == "[":
+            self.stack.append(["arr", 0, False])
+        elif ch in "}]":
+            if self.stack:
+                self.stack.pop()
+        elif ch == ":" and top and top[0] == "obj":
+            top[2] = False
+        elif ch == "," and top:
+            if top[0] == "obj":
+                top[2] = True
+            else:
+                top[1] += 1
+
+    def _on_string(self, value):
+        top = self.stack[-1] if self.stack else None
+        if top is None:
+            return
+        if top[0] == "obj" and top[2]:
+            top[1] = value                       # キー
+            return
+        path = [frame[1] for frame in self.stack]
+        if path == ["title"]:
+            self.title = value
+            self.on_title(value)
+        elif len(path) == 2 and path[0] == "story" and top[0] == "arr":
+            if top[1] != self._strings:
+                return                           # 途中に文字列でない要素があった
+            self._strings += 1
+            value = value.strip()
+            if value:
+                self.scenes.append(value)
+                self.on_scene(len(self.scenes) - 1, value)
+
+
+def consume_stream(chunks, on_title=None, on_scene=None) -> str:
+    """chat.completions.create(stream=True) の戻り値を読み切って本文全体を返す"""
+    parser = StoryStreamParser(on_title, on_scene)
+    parts = []
+    for chunk in chunks:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        parts.append(delta)
+        parser.feed(delta)
+    return "".join(parts)
+
+
+async def aconsume_stream(chunks, on_title=None, on_scene=None) -> str:
+    """consume_stream の async 版（AsyncOpenAI のストリームを async for で読む）"""
+    parser = StoryStreamParser(on_title, on_scene)
+    parts = []
+    async for chunk in chunks:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        parts.append(delta)
+        parser.feed(delta)
+    return "".join(parts)
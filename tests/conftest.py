@@ -0,0 +1,23 @@
+# tests/conftest.py — リポジトリ直下のモジュールを import できるようにする
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app_env(tmp_path_factory):
+    """app（と app_async）を fake バックエンド・使い捨てのキャッシュで import する環境。
+    app はセッションで 1 回しか import されないので、環境もセッションで 1 つ"""
+    tmp = tmp_path_factory.mktemp("app")
+    env = {"BOOK_BACKEND": "fake", "FAKE_OPENAI_SCALE": "0.01", "BOOK_POOL": "0", "STORY_CACHE_VARIANTS": "0",
+           "BOOK_SCHEDULER": "off"}
+    for name, sub in (("STORY_CACHE_PATH", "stories.sqlite3"), ("IMAGE_CACHE_DIR", "images"),
+                      ("SINGLEFLIGHT_DIR", "locks"), ("BOOK_POOL_PATH", "pool.sqlite3"),
+                      ("ARTIFACT_DIR", "artifacts"), ("BOOK_RUNS_PATH", "runs.sqlite3"),
+                      ("RATE_LIMIT_PATH", "ratelimit.sqlite3"), ("BOOK_QUEUE_PATH", "jobs.sqlite3")):
+        env[name] = str(tmp / sub)
+    with pytest.MonkeyPatch.context() as mp:
+        for k, v in env.items():
+            mp.setenv(k, v)
+        yield tmp
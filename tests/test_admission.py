@@ -0,0 +1,37 @@
+# tests/test_admission.py — 混雑が去ったら手抜きをやめること
+import pytest
+import admission
+from admission import Admission
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_idle_server_is_not_degraded_after_burst(clock):
+    adm = Admission(slots=2, service_time=10)
+    adm.recent_wait = 20.0                     # さっきまでの混雑の名残
+    for _ in range(5):
+        with adm.admit() as ticket:
+            assert ticket.level == 0
+    assert adm.expected_wait() == 0.0
+
+
+def test_recent_wait_decays_with_time(clock):
+    adm = Admission(slots=2, service_time=10)
+    adm.recent_wait = 20.0
+    adm.running = 2                            # 枠が埋まっている → 並ぶ
+    assert adm.expected_wait() == 20.0
+    clock[0] += 20                             # 半減期（1 冊の平均時間の 2 倍）
+    assert adm.expected_wait() == pytest.approx(10.0)
+    clock[0] += 200
+    assert adm.expected_wait() == pytest.approx(5.0)     # 残るのは並んでいる分（1 × 10 ÷ 2）だけ
+
+
+def test_backlog_sets_level(clock):
+    adm = Admission(slots=1, service_time=20, thresholds=(5, 15, 30, 60))
+    adm.running = 1
+    assert sum(adm.expected_wait() >= t for t in adm.thresholds) == 2
@@ -0,0 +1,30 @@
+# tests/test_app_async.py — app_async が import でき、起動（lifespan）と簡単なリクエストが通ること
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("PIL")
+pytest.importorskip("starlette")
+pytest.importorskip("httpx")
+
+
+@pytest.fixture(scope="module")
+def app_async(app_env):
+    import app_async
+    return app_async
+
+
+def test_lifespan_starts_background(app_async, monkeypatch):
+    from starlette.testclient import TestClient
+    started = []
+    monkeypatch.setattr(app_async, "start_background", lambda: started.append(1))
+    with TestClient(app_async.app) as client:
+        assert started == [1]
+        assert client.get("/").status_code == 200
+
+
+def test_unknown_profile_is_rejected(app_async):
+    from starlette.testclient import TestClient
+    with TestClient(app_async.app) as client:
+        rsp = client.post("/api/book_with_voice", data={"age": "4", "gender": "おんなのこ", "hero": "ろぼっと",
+                                                         "theme": "ぼうけん", "profile": "no-such-profile"})
+    assert rsp.status_code == 400
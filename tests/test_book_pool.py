@@ -0,0 +1,20 @@
+# tests/test_book_pool.py — 補充計画の深さ（人気の組み合わせほど深く・上限で切る）
+from book_pool import BookPool
+
+A = {"age": "4", "gender": "おんなのこ", "hero": "ろぼっと", "theme": "ぼうけん"}
+B = {**A, "hero": "くるま"}
+
+
+def test_popular_combo_is_deeper(tmp_path):
+    pool = BookPool(str(tmp_path / "pool.sqlite3"), base_depth=1, max_depth=5)
+    for _ in range(3):
+        pool.take(A)
+    pool.take(B)
+    assert dict((p["hero"], n) for p, n in pool.deficits([A, B])) == {"ろぼっと": 5, "くるま": 3}
+
+
+def test_base_depth_above_max_is_not_capped(tmp_path):
+    pool = BookPool(str(tmp_path / "pool.sqlite3"), base_depth=8, max_depth=5)
+    assert pool.deficits([A]) == [(A, 8)]
+    pool.add(A, {"pages": []})
+    assert pool.deficits([A]) == [(A, 7)]
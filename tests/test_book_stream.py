@@ -0,0 +1,46 @@
+# tests/test_book_stream.py — /api/book_stream の SSE を fake バックエンドで読み、イベントの順番を確かめる
+import json
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("PIL")
+
+FORM = {"age": "4", "gender": "おんなのこ", "hero": "ろぼっと", "theme": "ぼうけん"}
+
+
+@pytest.fixture(scope="module")
+def app_module(app_env):
+    import app
+    return app
+
+
+def _events(body: str) -> list[tuple[str, dict]]:
+    out = []
+    for block in filter(None, body.split("\n\n")):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        out.append((fields["event"], json.loads(fields["data"])))
+    return out
+
+
+def test_stream_event_order(app_module):
+    rsp = app_module.app.test_client().post("/api/book_stream", data=FORM)
+    assert rsp.status_code == 200
+    assert rsp.mimetype == "text/event-stream"
+    events = _events(rsp.get_data(as_text=True))
+    kinds = [k for k, _ in events]
+
+    assert kinds[0] == "admission" and kinds[-1] == "done"
+    assert "error" not in kinds
+    first_page = kinds.index("page")
+    assert kinds.index("story") < first_page
+    assert sorted(d["index"] for k, d in events if k == "page") == [0, 1, 2]
+    done = events[-1][1]
+    assert events[first_page][1]["t"] < done["t"]
+    assert "time_to_first_page" in app_module.metrics.render()
+
+
+@pytest.mark.parametrize("path", ["/api/book_stream", "/api/book_with_voice"])
+def test_unknown_profile_is_rejected(app_module, path):
+    rsp = app_module.app.test_client().post(path, data={**FORM, "profile": "no-such-profile"})
+    assert rsp.status_code == 400
+    assert "no-such-profile" in rsp.get_json()["error"]
@@ -0,0 +1,172 @@
+# tests/test_hedge.py — ヘッジ：勝ち負け・予算・async での負けた方のキャンセル
+import asyncio, threading, time
+from fake_openai import FakeOpenAI
+from hedge import Hedger
+from rate_limit import LimitedClient, RateLimiter
+
+MODEL = "dall-e-2"
+
+
+def _hedger(budget=10, delay=0.05):
+    h = Hedger(percentile=50, budget=budget, min_samples=5, threads=4)
+    for _ in range(5):
+        h.latency.record(MODEL, delay)
+    return h
+
+
+def _scripted(delays):
+    """呼ばれた順に delays[i] 秒かかり、i を返す fn"""
+    calls = []
+    lock = threading.Lock()
+
+    def fn():
+        with lock:
+            i = len(calls)
+            calls.append(i)
+        time.sleep(delays[i])
+        return i
+    return fn, calls
+
+
+def test_fast_call_is_not_hedged():
+    fn, calls = _scripted([0.0])
+    assert _hedger().call(MODEL, fn) == 0
+    assert calls == [0]
+
+
+def test_hedge_wins_when_first_is_slow():
+    fn, calls = _scripted([0.5, 0.01])
+    t = time.perf_counter()
+    assert _hedger().call(MODEL, fn) == 1
+    assert time.perf_counter() - t < 0.3
+    assert calls == [0, 1]
+
+
+def test_first_wins_when_hedge_is_slower():
+    fn, calls = _scripted([0.1, 0.5])
+    assert _hedger().call(MODEL, fn) == 0
+    assert calls == [0, 1]
+
+
+def test_budget_caps_hedges():
+    h = _hedger(budget=1)
+    fn, calls = _scripted([0.2, 0.01, 0.2])
+    assert h.call(MODEL, fn) == 1               # 1 本目のヘッジ
+    assert h.call(MODEL, fn) == 2               # 予算切れ：待つだけ
+    assert calls == [0, 1, 2]
+
+
+def test_no_hedge_without_quota():
+    fn, calls = _scripted([0.2])
+    assert _hedger().call(MODEL, fn, quota=lambda: False) == 0
+    assert calls == [0]
+
+
+def test_quota_refusal_does_not_spend_budget():
+    h = _hedger(budget=1)
+    fn, calls = _scripted([0.2, 0.2, 0.01])
+    assert h.call(MODEL, fn, quota=lambda: False) == 0
+    assert h.call(MODEL, fn, quota=lambda: True) == 2
+    assert calls == [0, 1, 2]
+
+
+def test_errors_fall_back_to_the_other_call():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.1)
+            raise RuntimeError("first failed")
+        time.sleep(0.2)
+        return "second"
+    assert _hedger().call(MODEL, fn) == "second"
+
+
+def test_async_cancels_loser():
+    started, cancelled = [], []
+
+    async def fn():
+        i = len(started)
+        started.append(i)
+        try:
+            await asyncio.sleep([1.0, 0.01][i])
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+        return i
+
+    async def main():
+        return await _hedger().acall(MODEL, fn)
+
+    assert asyncio.run(main()) == 1
+    assert started == [0, 1]
+    assert cancelled == [0]
+
+
+def test_async_budget_caps_hedges():
+    h = _hedger(budget=0)
+    started = []
+
+    async def fn():
+        started.append(1)
+        await asyncio.sleep(0.1)
+        return "only"
+    assert asyncio.run(h.acall(MODEL, fn)) == "only"
+    assert started == [1]
+
+
+def test_limited_client_hedges_only_provider_time(tmp_path):
+    # 60/分・1 回分しか貯めない → 2 回目はレート制限で約 1 秒待つ。待ちは所要時間に入らない
+    limiter = RateLimiter(str(tmp_path / "rl.sqlite3"), {MODEL: (60, 0)}, burst_seconds=1)
+    h = Hedger(percentile=50, budget=10, min_samples=1)
+    client = LimitedClient(FakeOpenAI(latency={"image": (0.01, 0)}, seed=1), limiter, hedger=h)
+    for _ in range(2):
+        client.images.generate(model=MODEL, prompt="p", n=1, size="256x256")
+    assert max(h.latency._samples[MODEL]) < 0.5
+
+
+# ── FAKE_OPENAI_STALL（裾の重い遅延）のバックエンドで ──
+def _stalling(monkeypatch, tmp_path, prob, budget, percentile=90):
+    """ふだん 0.01 秒・prob の確率で 40 倍（0.4 秒）止まる images.generate"""
+    monkeypatch.setenv("FAKE_OPENAI_LATENCY", "image=1:0")
+    monkeypatch.setenv("FAKE_OPENAI_STALL", f"image={prob}:40")
+    monkeypatch.setenv("FAKE_OPENAI_SCALE", "0.01")
+    raw = FakeOpenAI.from_env()
+    raw.rng.seed(7)
+    h = Hedger(percentile=percentile, budget=budget, min_samples=5)
+    for _ in range(5):
+        h.latency.record(MODEL, 0.03)
+    outcomes = []
+    real = h._count
+    monkeypatch.setattr(h, "_count", lambda model, result: (outcomes.append(result), real(model, result)))
+    limiter = RateLimiter(str(tmp_path / "rl.sqlite3"), {MODEL: (0, 0)})
+    client = LimitedClient(raw, limiter, hedger=h)
+
+    def run(n):
+        lat = []
+        for _ in range(n):
+            t = time.perf_counter()
+            client.images.generate(model=MODEL, prompt="p", n=1, size="256x256")
+            lat.append(time.perf_counter() - t)
+        time.sleep(0.5)                      # 負けた方（止まった 1 本目）が終わるのを待つ
+        return lat
+    return raw, outcomes, run
+
+
+def test_stalled_calls_are_hedged_and_won(monkeypatch, tmp_path):
+    raw, outcomes, run = _stalling(monkeypatch, tmp_path, prob=0.1, budget=600)
+    lat = run(60)
+    stalled = [s for _, s, _ in raw.calls if s >= 0.3]
+    assert stalled                                           # 止まった回があった
+    assert outcomes.count("won") >= len(stalled) - 1        # そのほとんどで 2 本目が勝った
+    assert sum(x >= 0.3 for x in lat) <= 1                  # 止まった時間は待っていない
+
+
+def test_stall_hedges_capped_by_budget(monkeypatch, tmp_path):
+    # 3 割が止まるので、待つのは中央値まで（p90 だと止まった回そのものになる）
+    raw, outcomes, run = _stalling(monkeypatch, tmp_path, prob=0.3, budget=3, percentile=50)
+    run(30)
+    hedges = sum(r in ("won", "lost") for r in outcomes)
+    assert hedges <= 3 and "no_budget" in outcomes
+    assert len(raw.calls) - 30 == hedges                    # 余分な呼び出しは予算の分だけ
@@ -0,0 +1,57 @@
+# tests/test_image_store.py — 書き込みのたびに全シャードを数え直さないこと・上限を超えたら古い順に消すこと
+import os
+import pytest
+import image_store
+from image_store import ImageStore
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """evict が全シャードを数えた回数"""
+    count = []
+    real = ImageStore.evict
+
+    def evict(self):
+        count.append(1)
+        real(self)
+    monkeypatch.setattr(ImageStore, "evict", evict)
+    return count
+
+
+def _put(store, key, size):
+    # put_bytes の JPEG 変換（Pillow）は飛ばして、書いた後の見積もりの更新だけ通す
+    path = store.path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        fp.write(b"x" * size)
+    store._grow(size)
+    return path
+
+
+def test_rescans_only_when_over_budget(tmp_path, scans):
+    store = ImageStore(str(tmp_path), max_bytes=10_000, scan_interval=3600)
+    for i in range(5):
+        _put(store, f"{i:02d}" + "0" * 62, 1000)
+    assert len(scans) == 1                       # 最初の 1 回だけ数える
+    _put(store, "aa" + "0" * 62, 6000)           # 見積もりが上限を超えた
+    assert len(scans) == 2
+
+
+def test_rescans_after_interval(tmp_path, scans, monkeypatch):
+    store = ImageStore(str(tmp_path), max_bytes=10_000, scan_interval=60)
+    _put(store, "00" + "0" * 62, 100)
+    now = image_store.time.monotonic()
+    monkeypatch.setattr(image_store.time, "monotonic", lambda: now + 61)
+    _put(store, "01" + "0" * 62, 100)
+    assert len(scans) == 2
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=2500, scan_interval=3600)
+    paths = []
+    for i in range(3):
+        paths.append(_put(store, f"{i:02d}" + "0" * 62, 1000))
+        os.utime(paths[-1], (i, i))
+    _put(store, "0a" + "0" * 62, 1000)           # 合計 4000 → 古い 2 つを消す
+    assert [os.path.exists(p) for p in paths] == [False, False, True]
+    assert store._total == 2000
@@ -0,0 +1,104 @@
+# tests/test_job_queue.py — 待ち行列の取り合い・持ち時間・dead-letter
+import time
+import pytest
+from job_queue import JobQueue
+from worker import _run_one
+
+
+@pytest.fixture
+def q(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), visibility=0.2, max_attempts=2, retry_delay=0.05)
+
+
+def _ok(params, report, run_id, degrade):
+    report(stage="media", title="t", pages=[{"img": None, "text": "x", "audio": None}])
+    return {"run_id": run_id, "title": "t", "pages": [], "audio_url": None}
+
+
+def _boom(*args, **kwargs):
+    raise ValueError("boom")
+
+
+def test_claim_is_exclusive_until_visibility_expires(q):
+    job_id = q.enqueue({"age": "4"}, degrade=("no_tts",))
+    job = q.claim("w1")
+    assert job["id"] == job_id and job["degrade"] == ("no_tts",) and job["attempt"] == 1
+    assert q.claim("w2") is None
+    time.sleep(0.25)
+    again = q.claim("w2")
+    assert again["id"] == job_id and again["attempt"] == 2
+    assert not q.heartbeat(job_id, "w1")
+    assert not q.complete(job_id, "w1", {})
+
+
+def test_reenqueue_running_job_keeps_owner(q):
+    job_id = q.enqueue({"age": "4"})
+    q.claim("w1")
+    assert q.enqueue({"age": "4"}, job_id=job_id) == job_id
+    assert q.claim("w2") is None
+    job = q.get(job_id)
+    assert job["state"] == "running" and job["attempts"] == 1
+    assert q.heartbeat(job_id, "w1")
+    assert q.complete(job_id, "w1", {"title": "t"})
+
+
+def test_reenqueue_queued_job_is_noop(q):
+    job_id = q.enqueue({"age": "4"})
+    q.enqueue({"age": "5"}, job_id=job_id)
+    assert q.claim("w1")["params"] == {"age": "4"}
+
+
+def test_reenqueue_done_or_dead_job_requeues(q):
+    job_id = q.enqueue({"age": "4"})
+    q.claim("w1")
+    q.complete(job_id, "w1", {"title": "t"})
+    assert q.enqueue({"age": "4"}, job_id=job_id) == job_id
+    job = q.get(job_id)
+    assert job["state"] == "queued" and job["attempts"] == 0 and job["result"] is None
+
+
+def test_retry_then_dead_letter(q):
+    job_id = q.enqueue({})
+    _run_one(q, q.claim("w1"), "w1", _boom)
+    assert q.get(job_id)["state"] == "queued"
+    assert q.claim("w1") is None                     # retry_delay の間は見えない
+    time.sleep(0.06)
+    _run_one(q, q.claim("w1"), "w1", _boom)
+    job = q.get(job_id)
+    assert job["state"] == "dead" and job["error"] == "ValueError: boom"
+    assert [j["id"] for j in q.dead()] == [job_id]
+    assert q.requeue(job_id)
+    assert q.claim("w2")["attempt"] == 1
+
+
+def test_lost_worker_is_dead_lettered(q):
+    job_id = q.enqueue({})
+    q.claim("w1")
+    time.sleep(0.25)
+    q.claim("w2")
+    time.sleep(0.25)
+    assert q.claim("w3") is None
+    assert q.get(job_id)["error"].startswith("visibility timeout")
+
+
+def test_worker_writes_progress_and_result(q):
+    job_id = q.enqueue({})
+    _run_one(q, q.claim("w1"), "w1", _ok)
+    job = q.get(job_id)
+    assert job["state"] == "done" and job["result"]["run_id"] == job_id
+    assert job["progress"]["title"] == "t"
+
+
+def test_worker_logs_lost_completion(q, capsys):
+    job_id = q.enqueue({})
+    job = q.claim("w1")
+
+    def stalled(params, report, run_id, degrade):
+        # heartbeat が間に合わず持ち時間が切れ、その間に別のワーカーが拾った
+        with q._db() as db:
+            db.execute("UPDATE jobs SET visible_at = 0 WHERE id = ?", (run_id,))
+        assert q.claim("w2")["id"] == run_id
+        return {"run_id": run_id}
+    _run_one(q, job, "w1", stalled)
+    assert "もう自分のジョブではありません" in capsys.readouterr().err
+    assert q.get(job_id)["state"] == "running"
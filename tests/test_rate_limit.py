@@ -0,0 +1,271 @@
+# tests/test_rate_limit.py — 429 を返す fake を相手に、LimitedClient の再試行とバケットを確かめる
+import asyncio, json, threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+import rate_limit
+from fake_openai import FakeAPIError, FakeOpenAI
+from rate_limit import AsyncLimitedClient, LimitedClient, RateLimiter, call_with_backoff
+
+MODEL = "dall-e-2"
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    return RateLimiter(str(tmp_path / "ratelimit.sqlite3"), {MODEL: (600, 0)}, burst_seconds=1)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """rate_limit の中の time.sleep を記録する（待つのは本当に待つ）"""
+    recorded = []
+    real = rate_limit.time.sleep
+
+    def sleep(seconds):
+        recorded.append(seconds)
+        real(seconds)
+    monkeypatch.setattr(rate_limit.time, "sleep", sleep)
+    return recorded
+
+
+def _image(client):
+    return client.images.generate(model=MODEL, prompt="p", n=1, size="256x256")
+
+
+def test_retry_after_is_honoured_and_bucket_drained(limiter, sleeps):
+    fake = FakeOpenAI(scale=0, rate_limit_rate=1.0, retry_after=0.2, seed=1)
+    client = LimitedClient(fake, limiter, max_retries=2)
+    with pytest.raises(FakeAPIError) as err:
+        _image(client)
+    assert err.value.status_code == 429
+    assert [ok for _, _, ok in fake.calls] == [False] * 3        # 1 回 + 再試行 2 回
+    backoffs = [s for s in sleeps if s >= 0.2]
+    assert len(backoffs) == 2
+    assert all(0.2 <= s <= 0.2 + 0.25 * 0.2 + 0.1 for s in backoffs)
+    # 最後の 429 でバケットが Retry-After 分だけ空になっている（他のワーカーも待つ）
+    assert limiter.try_acquire(MODEL) >= 0.2
+
+
+def test_succeeds_after_429s(limiter, sleeps):
+    fake = FakeOpenAI(scale=0, rate_limit_rate=0.5, retry_after=0.05, seed=3)
+    client = LimitedClient(fake, limiter, max_retries=10)
+    for _ in range(5):
+        assert _image(client).data[0].url.startswith("data:image/png")
+    limited = sum(not ok for _, _, ok in fake.calls)
+    assert limited > 0
+    # 429 ごとに Retry-After 以上待っている（バックオフ＋空になったバケットの待ち）
+    assert sum(sleeps) >= 0.05 * limited
+
+
+def test_bucket_limits_rate(limiter):
+    # 600/分・1 秒分まで貯める → すぐに使えるのは 10 回
+    assert [limiter.try_acquire(MODEL) for _ in range(10)] == [0] * 10
+    assert limiter.try_acquire(MODEL) > 0
+
+
+class APIConnectionError(Exception):
+    """openai.APIConnectionError と同じ名前（status_code なし）"""
+
+
+class APITimeoutError(APIConnectionError):
+    pass
+
+
+@pytest.mark.parametrize("exc", [APIConnectionError, APITimeoutError, ConnectionResetError])
+def test_connection_errors_are_retried(limiter, exc):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise exc("down")
+        return "ok"
+    assert call_with_backoff(flaky, MODEL, limiter, base=0.01, cap=0.01) == "ok"
+    assert len(attempts) == 3
+
+
+def test_other_errors_are_not_retried(limiter):
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise FakeAPIError("bad request", 400)
+    with pytest.raises(FakeAPIError):
+        call_with_backoff(broken, MODEL, limiter, base=0.01)
+    assert len(attempts) == 1
+
+
+# ── stream=True の chat ──
+CHAT = "gpt-4o-mini"
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class _Streams:
+    """chat.completions.create(stream=True)。最初の fail_before 回は 1 チャンク目の前に 429"""
+
+    def __init__(self, fail_before=0, fail_after=False):
+        self.fail_before, self.fail_after, self.calls, self.log = fail_before, fail_after, 0, []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        n = self.calls
+
+        def stream():
+            if n <= self.fail_before:
+                raise FakeAPIError("rate limited", 429, {"retry-after": "0"})
+            for piece in ("a", "b", "c"):
+                self.log.append(piece)
+                yield _chunk(piece)
+                if self.fail_after:
+                    raise FakeAPIError("server error", 500)
+        return stream()
+
+
+class _Slots:
+    def __init__(self, log):
+        self.log = log
+
+    @contextmanager
+    def slot(self, model, tokens=0):
+        self.log.append("enter")
+        try:
+            yield
+        finally:
+            self.log.append("exit")
+
+
+def _read(stream):
+    return "".join(c.choices[0].delta.content for c in stream)
+
+
+def test_stream_holds_slot_until_drained(limiter):
+    raw = _Streams()
+    client = LimitedClient(raw, limiter, scheduler=_Slots(raw.log))
+    assert _read(client.chat.completions.create(model=CHAT, messages=[], stream=True)) == "abc"
+    assert raw.log == ["enter", "a", "b", "c", "exit"]
+
+
+def test_stream_slot_released_when_closed_early(limiter):
+    raw = _Streams()
+    client = LimitedClient(raw, limiter, scheduler=_Slots(raw.log))
+    stream = client.chat.completions.create(model=CHAT, messages=[], stream=True)
+    next(stream)
+    stream.close()
+    assert raw.log == ["enter", "a", "exit"]
+
+
+def test_stream_error_before_first_chunk_is_retried(limiter):
+    raw = _Streams(fail_before=2)
+    client = LimitedClient(raw, limiter, scheduler=_Slots(raw.log))
+    assert _read(client.chat.completions.create(model=CHAT, messages=[], stream=True)) == "abc"
+    assert raw.calls == 3
+    # 失敗した回の枠は、待つ前に返している
+    assert raw.log == ["enter", "exit"] * 2 + ["enter", "a", "b", "c", "exit"]
+
+
+def test_stream_error_after_first_chunk_is_raised(limiter):
+    raw = _Streams(fail_after=True)
+    client = LimitedClient(raw, limiter)
+    with pytest.raises(FakeAPIError):
+        _read(client.chat.completions.create(model=CHAT, messages=[], stream=True))
+    assert raw.calls == 1
+
+
+def test_async_stream_error_before_first_chunk_is_retried(limiter):
+    class _AsyncStreams(_Streams):
+        async def create(self, **kwargs):
+            stream = _Streams.create(self, **kwargs)
+
+            async def agen():
+                for chunk in stream:
+                    yield chunk
+            return agen()
+
+    raw = _AsyncStreams(fail_before=1)
+    client = AsyncLimitedClient(raw, limiter)
+
+    async def main():
+        stream = await client.chat.completions.create(model=CHAT, messages=[], stream=True)
+        return "".join([c.choices[0].delta.content async for c in stream])
+    assert asyncio.run(main()) == "abc"
+    assert raw.calls == 2
+
+
+# ── 本物の openai SDK を、429 を返すローカルの HTTP サーバーに向ける ──
+IMAGE_OK = {"created": 0, "data": [{"url": "https://example.invalid/a.png"}]}
+
+
+@pytest.fixture
+def provider():
+    """images.generate に、script の (status, headers) を順に返すサーバー（尽きたら 200）"""
+    openai = pytest.importorskip("openai")
+    script, hits = [], []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            hits.append(self.path)
+            status, headers = script.pop(0) if script else (200, {})
+            body = json.dumps(IMAGE_OK if status == 200 else
+                              {"error": {"message": "Rate limit reached", "type": "requests", "code": None}}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = openai.OpenAI(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", api_key="test",
+                           max_retries=0)
+    yield SimpleNamespace(client=client, script=script, hits=hits, openai=openai)
+    server.shutdown()
+    server.server_close()
+
+
+def test_real_sdk_retry_after(provider, limiter, sleeps):
+    provider.script.extend([(429, {"retry-after": "0.2"})] * 2)
+    client = LimitedClient(provider.client, limiter, max_retries=3)
+    assert _image(client).data[0].url == IMAGE_OK["data"][0]["url"]
+    assert provider.hits == ["/v1/images/generations"] * 3
+    backoffs = [s for s in sleeps if s >= 0.2]
+    assert len(backoffs) == 2 and all(s <= 0.2 + 0.25 * 0.2 + 0.1 for s in backoffs)
+
+
+def test_real_sdk_ratelimit_reset_headers(provider, limiter, sleeps):
+    # Retry-After が無い 429 は x-ratelimit-reset-* の長い方だけ待つ
+    provider.script.append((429, {"x-ratelimit-reset-requests": "250ms", "x-ratelimit-reset-tokens": "0.1s"}))
+    client = LimitedClient(provider.client, limiter, max_retries=3)
+    _image(client)
+    assert len(provider.hits) == 2
+    assert any(0.25 <= s <= 0.25 + 0.25 * 0.25 + 0.1 for s in sleeps)
+
+
+def test_real_sdk_gives_up_and_drains_bucket(provider, limiter):
+    provider.script.extend([(429, {"retry-after": "0.2"})] * 3)
+    client = LimitedClient(provider.client, limiter, max_retries=2)
+    with pytest.raises(provider.openai.RateLimitError) as err:
+        _image(client)
+    assert err.value.status_code == 429
+    assert len(provider.hits) == 3
+    assert limiter.try_acquire(MODEL) >= 0.2
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"x-ratelimit-reset-requests": "20ms"}, 0.02),
+    ({"x-ratelimit-reset-requests": "1s", "x-ratelimit-reset-tokens": "6m0s"}, 360),
+    ({"x-ratelimit-reset-tokens": "1h2m3.5s"}, 3723.5),
+    ({}, None),
+])
+def test_reset_after(headers, expected):
+    assert rate_limit._reset_after(FakeAPIError("x", 429, headers)) == expected
@@ -0,0 +1,80 @@
+# tests/test_story_repair.py — 壊れたストーリー JSON の修復（記録した失敗例のコーパス）
+import json
+import pytest
+from types import SimpleNamespace
+from story_repair import complete_story, parse_story
+
+FULL = json.dumps({"title": "もりの ぼうけん", "story": ["いち。", "に。", "さん。"]}, ensure_ascii=False)
+
+CORPUS = [
+    # (名前, モデルの出力, 期待するタイトル, 期待するシーン, 足りない数)
+    ("ok", FULL, "もりの ぼうけん", ["いち。", "に。", "さん。"], 0),
+    ("truncated mid-string", FULL[:FULL.index("さん") + 1], "もりの ぼうけん", ["いち。", "に。"], 1),
+    ("truncated mid-array", FULL[:FULL.index('"に')], "もりの ぼうけん", ["いち。"], 2),
+    ("truncated before story", '{"title": "もりの ぼうけん", "sto', "もりの ぼうけん", [], 3),
+    ("truncated in title", '{"title": "もり', "あなただけのえほん", [], 3),
+    ("empty", "", "あなただけのえほん", [], 3),
+    ("single string story", json.dumps({"title": "t", "story": "いち。に。さん。"}, ensure_ascii=False),
+     "t", ["いち。", "に。", "さん。"], 0),
+    ("dict scenes", json.dumps({"title": "t", "story": [{"text": " いち "}, {"scene": "に"}, {"body": "さん"}]},
+                               ensure_ascii=False), "t", ["いち", "に", "さん"], 0),
+    ("scenes as dict", json.dumps({"title": "t", "scenes": {"1": "a", "2": "b", "3": "c"}}), "t", ["a", "b", "c"], 0),
+    ("too many scenes", json.dumps({"title": "t", "story": ["a", "b", "c", "d", "e"]}), "t", ["a", "b", "cde"], 0),
+    ("too few scenes", json.dumps({"title": "t", "story": ["a"]}), "t", ["a"], 2),
+    ("empty and numeric scenes", json.dumps({"title": "t", "story": ["a", "", None, 3]}), "t", ["a", "3"], 1),
+    ("bare list", json.dumps(["a", "b", "c"]), "あなただけのえほん", ["a", "b", "c"], 0),
+    ("not json", "ごめんなさい、かけません", "あなただけのえほん", [], 3),
+    ("raw newline in string", '{"title": "t", "story": ["いち\nです。", "に。\t", "さん。"]}',
+     "t", ["いち\nです。", "に。", "さん。"], 0),
+    ("bad escape", '{"title": "t\\x", "story": ["a\\qb", "\\u3042\\n", "c"]}', "t\\x", ["a\\qb", "あ", "c"], 0),
+    ("bad escape, truncated", '{"title": "t", "story": ["a\\xb", "b', "t", ["a\\xb"], 2),
+]
+
+
+@pytest.mark.parametrize("text, title, scenes, missing", [c[1:] for c in CORPUS], ids=[c[0] for c in CORPUS])
+def test_parse_story_corpus(text, title, scenes, missing):
+    story, n = parse_story(text, 3)
+    assert story == {"title": title, "story": scenes}
+    assert n == missing
+
+
+class _Chat:
+    """continue_story に渡される依頼を記録し、頼まれた数だけシーンを返す"""
+
+    def __init__(self):
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        n = len(json.loads(kwargs["messages"][-1]["content"].split("JSON=", 1)[1])["story"])
+        text = json.dumps({"story": [f"つづき{i}" for i in range(n)]}, ensure_ascii=False)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "おはなし"}], "max_tokens": 700,
+           "stream": True}
+
+
+@pytest.mark.parametrize("text, title, scenes, missing", [c[1:] for c in CORPUS], ids=[c[0] for c in CORPUS])
+def test_continue_only_missing(text, title, scenes, missing):
+    client = _Chat()
+    story = complete_story(client, text, 3, REQUEST)
+    assert story["story"] == scenes + [f"つづき{i}" for i in range(missing)]
+    if not missing:
+        assert client.requests == []
+        return
+    (req,) = client.requests
+    assert f"{missing} こ だけ" in req["messages"][-1]["content"]
+    assert req["max_tokens"] == 250 * missing
+    assert "stream" not in req
+    # できているところはそのまま渡す（全部は作り直さない）
+    assert json.loads(req["messages"][-2]["content"])["story"] == scenes
+
+
+def test_continuation_still_short_raises():
+    client = _Chat()
+    client.chat.completions.create = lambda **kw: SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content='{"story": []}'))])
+    with pytest.raises(ValueError):
+        complete_story(client, json.dumps({"title": "t", "story": ["a"]}), 3, REQUEST)
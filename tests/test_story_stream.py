@@ -0,0 +1,91 @@
+# tests/test_story_stream.py — 記録したチャンク列で StoryStreamParser を確かめる
+import json
+import pytest
+from types import SimpleNamespace
+from story_repair import parse_story
+from story_stream import StoryStreamParser, consume_stream
+
+STORY = {"title": "くまの \"ぼうけん\"",
+         "story": ["もりに \\ いきました。", "「こんにちは」\nと いいました。", "おしまい 😀 ❤"]}
+
+
+def _feed(chunks):
+    seen = []
+    parser = StoryStreamParser(on_scene=lambda i, text: seen.append((i, text)))
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser, seen
+
+
+def _check(parser, seen, story):
+    assert parser.title == story["title"]
+    assert parser.scenes == story["story"]
+    assert seen == list(enumerate(story["story"]))
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_every_two_way_split(ensure_ascii):
+    # どこで 2 つに切れても同じ結果（\" \\ \uXXXX・サロゲートペアの途中も含む）
+    text = json.dumps(STORY, ensure_ascii=ensure_ascii)
+    for cut in range(len(text) + 1):
+        _check(*_feed([text[:cut], text[cut:]]), STORY)
+
+
+def test_one_char_chunks():
+    text = json.dumps(STORY, ensure_ascii=True)
+    _check(*_feed(list(text)), STORY)
+
+
+def test_recorded_chunks():
+    # 実際のストリームで見た切れ方：エスケープの途中・サロゲートペアの間で切れる
+    chunks = ['{"title": "\\u304f', '\\u307e"', ', "story": ["a\\', '"b\\', '\\c", "\\ud83d',
+              '\\ude00', ' end', '\\u3', '042"]}']
+    parser, seen = _feed(chunks)
+    assert parser.title == "くま"
+    assert seen == [(0, 'a"b\\c'), (1, "😀 endあ")]
+
+
+def test_scene_reported_when_closed():
+    parser, seen = _feed(['{"story": ["one", "tw'])
+    assert seen == [(0, "one")]
+    parser.feed('o"')
+    assert seen == [(0, "one"), (1, "two")]
+
+
+def test_nested_values_are_not_scenes():
+    _, seen = _feed(['{"meta": {"story": ["x"], "title": "t"}, "story": ["z"]}'])
+    assert seen == [(0, "z")]
+
+
+def test_consume_stream_returns_full_text():
+    text = json.dumps(STORY, ensure_ascii=True)
+    chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 7]))])
+              for i in range(0, len(text), 7)]
+    chunks.insert(0, SimpleNamespace(choices=[]))
+    seen = []
+    assert consume_stream(chunks, on_scene=lambda i, t: seen.append(t)) == text
+    assert seen == STORY["story"]
+
+
+def test_scenes_match_repaired_text():
+    # 挿絵・音声のキー（ストリーム）と narration_url のキー（修復後）が同じ文字列になる
+    text = json.dumps({"title": "t", "story": ["  はじまり。\n", "\tなか ", "おわり。 "]}, ensure_ascii=False)
+    _, seen = _feed([text])
+    assert [t for _, t in seen] == parse_story(text, 3)[0]["story"]
+
+
+def test_lenient_strings():
+    # 生の改行・壊れたエスケープでも止まらない（壊れたエスケープはそのままの文字で残す）
+    text = '{"title": "く\nま", "story": ["a\\xb", "\\ud83d\\ude00\\q"]}'
+    for split in range(len(text) + 1):
+        parser, seen = _feed([text[:split], text[split:]])
+        assert parser.title == "く\nま"
+        assert seen == [(0, "a\\xb"), (1, "😀\\q")]
+
+
+def test_empty_scenes_are_skipped_and_renumbered():
+    # 空のシーンは修復で捨てられるので、番号もそれに合わせる（後ろのページの絵がずれない）
+    text = json.dumps({"title": "t", "story": ["いち。", "  ", "", "に。", "さん。"]}, ensure_ascii=False)
+    _, seen = _feed([text])
+    assert seen == [(0, "いち。"), (1, "に。"), (2, "さん。")]
+    assert [t for _, t in seen] == parse_story(text, 3)[0]["story"]
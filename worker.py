@@ -0,0 +1,102 @@
+# worker.py — 絵本を作るワーカープロセス（job_queue の待ち行列から取って作る）
+# -------------------------------------------------------------
+# Web（BOOK_QUEUE=1 の app.py）は積んで結果を読むだけにし、生成はこちらで行う。
+# Web とワーカーは別々に台数・プロセス数を決められる。
+#   python worker.py --workers 8 --threads 4     # 8 プロセス × 同時 4 冊
+#   BOOK_QUEUE_WORKERS=8  BOOK_QUEUE_THREADS=4  BOOK_QUEUE_POLL=0.5
+# ・作っている間は visibility の 1/3 ごとに heartbeat（止まれば別のワーカーが拾い直す）
+# ・途中経過は progress に書く（Web の SSE・/api/jobs はそれを返す）
+# ・生成物（挿絵・音声・途中経過）は ARTIFACT_DIR などの共有ストレージに置く
+# ・SIGTERM / Ctrl-C では、作りかけの冊を作り終えてから止まる
+import argparse, multiprocessing, os, signal, socket, sys, threading, traceback
+
+
+def _run_one(q, job, worker: str, build_book):
+    state = {"stage": "queued"}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def report(**kw):
+        with lock:
+            if "pages" in kw:
+                kw["pages"] = [dict(pg) for pg in kw["pages"]]
+            state.update(kw)
+            snapshot = dict(state)
+        if not q.heartbeat(job["id"], worker, snapshot):
+            print(f"⚠️ {job['id']} は別のワーカーに移りました", file=sys.stderr)
+
+    def keep_alive():
+        while not stop.wait(q.visibility / 3):
+            q.heartbeat(job["id"], worker)
+
+    beat = threading.Thread(target=keep_alive, daemon=True)
+    beat.start()
+    try:
+        result = build_book(job["params"], report=report, run_id=job["id"], degrade=job["degrade"])
+        if not q.complete(job["id"], worker, result):
+            # 持ち時間が切れて別のワーカーに移っていた（結果はそちらのものを使う）
+            print(f"⚠️ {job['id']} を作り終えましたが、もう自分のジョブではありません（結果は捨てます）",
+                  file=sys.stderr)
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        outcome = q.fail(job["id"], worker, f"{type(e).__name__}: {e}")
+        print(f"❌ {job['id']} attempt {job['attempt']} → {outcome}", file=sys.stderr)
+    finally:
+        stop.set()
+
+
+def work(threads: int, poll: float):
+    """1 プロセス分：threads 本のスレッドがそれぞれ 1 冊ずつ取って作る"""
+    from app import BOOK_POOL, build_book, job_queue, start_background, start_pool_refiller
+    from metrics import traced
+    start_background()              # 生成物の掃除（プロセスを分けた後で始める）
+    if BOOK_POOL:
+        start_pool_refiller()       # 作り置きの補充も Web ではなくワーカーで（1 プロセスだけが担当）
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *a: stopping.set())
+    signal.signal(signal.SIGINT, lambda *a: stopping.set())
+
+    def loop(n):
+        worker = f"{socket.gethostname()}:{os.getpid()}:{n}"
+        while not stopping.is_set():
+            job = job_queue.claim(worker)
+            if job is None:
+                stopping.wait(poll)
+                continue
+            with traced("queue_job", job_id=job["id"], attempt=job["attempt"]):
+                _run_one(job_queue, job, worker, build_book)
+
+    pool = [threading.Thread(target=loop, args=(n,), name=f"queue-worker-{n}") for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="絵本ジョブのワーカー")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("BOOK_QUEUE_WORKERS", "2")),
+                    help="ワーカープロセスの数")
+    ap.add_argument("--threads", type=int, default=int(os.getenv("BOOK_QUEUE_THREADS", "4")),
+                    help="1 プロセスで同時に作る冊数")
+    ap.add_argument("--poll", type=float, default=float(os.getenv("BOOK_QUEUE_POLL", "0.5")),
+                    help="待ち行列が空の時に見に行く間隔（秒）")
+    args = ap.parse_args(argv)
+
+    if args.workers <= 1:
+        work(args.threads, args.poll)
+        return
+    procs = [multiprocessing.Process(target=work, args=(args.threads, args.poll), name=f"book-worker-{i}")
+             for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    print(f"👷 {args.workers} プロセス × {args.threads} 冊で待ち行列を処理中（Ctrl-C で止める）", file=sys.stderr)
+    # 子プロセスにも SIGINT / SIGTERM が届くので、親は終わるのを待つだけ
+    signal.signal(signal.SIGINT, lambda *a: None)
+    signal.signal(signal.SIGTERM, lambda *a: [p.terminate() for p in procs if p.is_alive()])
+    for p in procs:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()